@@ -0,0 +1,732 @@
+# %%
+import asyncio
+import contextlib
+import copy
+import hashlib
+import http.server
+import io
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+import tracemalloc
+import urllib.parse
+
+import numpy as np
+import pandas as pd
+
+import runes as r
+import export_stream
+import export_diff
+import monster_rune_pairing as mrp
+import build_optimizer
+import stat_distribution as sd
+import player_store
+import pulldown
+import http_utils
+import swarfarm_api
+
+# Per-roll value ranges for legendary 6* runes, keyed by exporter stat id.
+sub_roll_ranges = {
+    1: (135, 375),  # Flat HP
+    2: (5, 8),      # HP
+    3: (10, 20),    # Flat Atk
+    4: (5, 8),      # ATK
+    5: (10, 20),    # Flat Def
+    6: (5, 8),      # DEF
+    8: (4, 6),      # SPD
+    9: (4, 6),      # CR
+    10: (4, 7),     # CD
+    11: (4, 8),     # RES
+    12: (4, 8),     # ACC
+}
+
+# Possible main stats per slot, by exporter stat id.
+slot_main_stats = {
+    1: [3],
+    2: [1, 2, 3, 4, 5, 6, 8],
+    3: [5],
+    4: [1, 2, 3, 4, 5, 6, 9, 10],
+    5: [1],
+    6: [1, 2, 3, 4, 5, 6, 11, 12],
+}
+
+# Sub stats that can never roll on a slot, by exporter stat id.
+slot_excluded_subs = {
+    1: [5, 6],
+    3: [3, 4],
+    5: [1],
+}
+
+grindable_stat_ids = [1, 2, 3, 4, 5, 6, 8]
+
+# %%
+def make_synthetic_rune(rune_id, rng, occupied_id=0):
+    """
+    Builds one rune dictionary in the same layout as the Summoners War exporter.
+    Sub stat values, gems and grinds are random but respect slot restrictions.
+    """
+    slot = rng.randint(1, 6)
+    main = rng.choice(slot_main_stats[slot])
+    excluded = {main} | set(slot_excluded_subs.get(slot, []))
+    candidates = [stat for stat in sub_roll_ranges if stat not in excluded]
+
+    innate = [0, 0]
+    if rng.random() < 0.4:
+        innate_stat = rng.choice(candidates)
+        candidates.remove(innate_stat)
+        innate = [innate_stat, rng.randint(*sub_roll_ranges[innate_stat])]
+
+    level = rng.choice([0, 3, 6, 9, 12, 12, 15, 15, 15])
+    subs = rng.sample(candidates, 4)
+    rolls = [1, 1, 1, 1]
+    for _ in range(min(level, 12) // 3):
+        rolls[rng.randrange(4)] += 1
+
+    gemmed_index = rng.randrange(4) if rng.random() < 0.3 else -1
+    sec_eff = []
+    for i, (stat, roll_count) in enumerate(zip(subs, rolls)):
+        low, high = sub_roll_ranges[stat]
+        value = sum(rng.randint(low, high) for _ in range(roll_count))
+        gemmed = int(i == gemmed_index)
+        grind_value = rng.randint(0, high) if stat in grindable_stat_ids and rng.random() < 0.5 else 0
+        sec_eff.append([stat, value, gemmed, grind_value])
+
+    grade = rng.choice([3, 4, 5, 5, 5])
+    if rng.random() < 0.1:
+        grade += 10
+
+    return {
+        'rune_id': rune_id,
+        'wizard_id': 1,
+        'occupied_type': 1,
+        'occupied_id': occupied_id,
+        'slot_no': slot,
+        'rank': grade % 10,
+        'class': 6,
+        'set_id': rng.choice([k for k, v in r.set_id_dict.items() if v]),
+        'upgrade_limit': 15,
+        'upgrade_curr': level,
+        'base_value': 0,
+        'sell_value': 0,
+        'pri_eff': [main, r.main_stat_max[r.stat_dict[main]]],
+        'prefix_eff': innate,
+        'sec_eff': sec_eff,
+        'extra': grade,
+    }
+
+def make_synthetic_export(n_runes=2000, n_units=100, seed=0):
+    """
+    Builds an exporter-shaped dictionary with 'runes' and 'unit_list' sections.
+    Roughly a third of the runes are equipped on the generated units.
+    """
+    rng = random.Random(seed)
+    n_equipped = min(n_runes // 3, n_units * 6)
+    unit_list = []
+    for unit_index in range(n_units):
+        unit_id = 1000000 + unit_index
+        unit_runes = [
+            make_synthetic_rune(rune_index + 1, rng, occupied_id=unit_id)
+            for rune_index in range(unit_index * 6, min((unit_index + 1) * 6, n_equipped))
+        ]
+        unit_list.append({'unit_id': unit_id, 'unit_master_id': 10000 + unit_index, 'runes': unit_runes})
+    inventory = [make_synthetic_rune(rune_index + 1, rng) for rune_index in range(n_equipped, n_runes)]
+    return {'runes': inventory, 'unit_list': unit_list}
+
+def make_synthetic_monsters(n_monsters=300, seed=0):
+    """
+    Builds a monsters_prepared-shaped DataFrame (update_monster_priority's output)
+    with random preferred sets, slot 2/4/6 main stats and *_value weights.
+    """
+    rng = random.Random(seed)
+    rows = []
+    for i in range(n_monsters):
+        row = {
+            'name': f'monster {i}',
+            'top_4_sub_stats': '',
+            'most_popular_slot2': rng.choice(['SPD','ATK','HP','DEF']),
+            'most_popular_slot4': rng.choice(['CD','CR','HP','ATK','DEF']),
+            'most_popular_slot6': rng.choice(['HP','ATK','DEF','ACC','RES']),
+            'most_popular_mainset': rng.choice(r.main_sets),
+            'most_popular_offset': rng.choice(r.off_sets),
+        }
+        for stat in r.stat_list:
+            row[stat + '_value'] = rng.choice([0, 0, 0.5, 1, 1, 2])
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+def make_synthetic_builds(n_builds=300000, seed=0):
+    """
+    Builds a player_data-shaped DataFrame (pulldown.py's csv files) of random builds.
+    """
+    rng = random.Random(seed)
+    sets = [name.upper() for name in ['Violent','Swift','Will','Revenge','Blade','Rage','Fatal','Energy','Focus','Guard','Despair']] + ['Unknown']
+    mains = ['SPD','HP','ATK','DEF','CR','CD','ACC','RES']
+    stat_ranges = {'HP': (15000, 40000), 'ATK': (700, 3000), 'DEF': (600, 2500), 'SPD': (100, 330),
+                   'CR': (15, 100), 'CD': (50, 250), 'ACC': (0, 85), 'RES': (15, 100)}
+    data = {col: [rng.choice(sets) for _ in range(n_builds)] for col in ['Set1','Set2','Set3']}
+    data.update({col: [rng.choice(mains) for _ in range(n_builds)] for col in ['Slot2','Slot4','Slot6']})
+    data['Score'] = [rng.random() * 200 for _ in range(n_builds)]
+    data.update({stat: [rng.randint(low, high) for _ in range(n_builds)] for stat, (low, high) in stat_ranges.items()})
+    return pd.DataFrame(data)
+
+def prepare_pairing_runes(runes_df):
+    """
+    Mirrors the rune columns main.py passes to monster_rune_pairing: upper case sets and
+    each stat's Base value under the stat's name.
+    """
+    runes = runes_df.reset_index()[['rune_id','slot_no','set_id','main_stat_type']].copy()
+    runes['set_id'] = runes['set_id'].str.upper()
+    for stat in r.stat_list:
+        runes[stat] = runes_df['Base ' + stat].fillna(0).to_numpy()
+    return runes
+
+def prepare_scoring_frame(runes_df):
+    """
+    Mirrors the steps main.py runs on runes_df before scoring.
+    """
+    runes_df = runes_df.copy()
+    runes_df['Innate Stat'] = runes_df['Innate Stat'].fillna('')
+    runes_df['Innate Stat Value'] = runes_df['Innate Stat Value'].fillna(0)
+    for stat in r.stat_list:
+        runes_df[stat] = runes_df['Base ' + stat].fillna(0)
+    return runes_df
+
+def timed(label, func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    elapsed = time.perf_counter() - start
+    print(f'{label}: {elapsed:.3f}s')
+    return result, elapsed
+
+# %% load_runes
+def bench_load_runes(n_runes=50000):
+    data = make_synthetic_export(n_runes=n_runes, n_units=n_runes // 20)
+    runes_df, _ = timed('load_runes', r.load_runes, data)
+    print(f'{len(runes_df)} runes, {len(runes_df.columns)} columns')
+
+# %% json.load + load_runes vs streaming
+def bench_export_stream(n_runes=50000):
+    data = make_synthetic_export(n_runes=n_runes, n_units=n_runes // 20)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        json_path = os.path.join(tmp_dir, 'export.json')
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        del data
+
+        def load_whole_file(json_path):
+            with open(json_path, encoding='utf-8') as f:
+                return r.load_runes(json.load(f))
+
+        for label, func in [('json.load + load_runes', load_whole_file), ('export_stream.load_export', export_stream.load_export)]:
+            tracemalloc.start()
+            timed(label, func, json_path)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(f'  peak memory {peak / 1e6:.0f} MB')
+
+# %% score_rune vs score_runes
+def bench_score_runes(n_runes=50000):
+    data = make_synthetic_export(n_runes=n_runes, n_units=n_runes // 20)
+    runes_df = prepare_scoring_frame(r.load_runes(data))
+
+    row_wise, row_time = timed('score_rune (row-wise)', runes_df.apply, r.score_rune, axis=1)
+    column_wise, column_time = timed('score_runes (vectorized)', r.score_runes, runes_df)
+
+    pd.testing.assert_series_equal(row_wise, column_wise, check_names=False)
+    print(f'{len(runes_df)} runes, identical scores, {row_time / column_time:.0f}x faster')
+
+# %% all_gem_grind_combinations
+def bench_all_gem_grind_combinations(n_runes=50000):
+    data = make_synthetic_export(n_runes=n_runes, n_units=n_runes // 20)
+    runes_df = r.load_runes(data)
+
+    maxed_runes, elapsed = timed('all_gem_grind_combinations', r.all_gem_grind_combinations, runes_df)
+    print(f'{len(runes_df)} runes -> {len(maxed_runes)} gem/grind candidates')
+
+# %% top k gem options vs all_gem_grind_combinations + groupby
+def bench_top_gem_options(n_runes=50000, k=3):
+    data = make_synthetic_export(n_runes=n_runes, n_units=n_runes // 20)
+    runes_df = r.load_runes(data)
+
+    def full_ranking(runes_df):
+        maxed_runes = r.get_rolls(r.all_gem_grind_combinations(runes_df.copy()))
+        maxed_runes = maxed_runes.sort_values('New Total Rolls', ascending=False, kind='stable')
+        return maxed_runes.groupby('rune_id').head(k)
+
+    timed('all_gem_grind_combinations + groupby', full_ranking, runes_df)
+    top_options, _ = timed('iter_top_gem_options', lambda df: pd.DataFrame(r.iter_top_gem_options(df, k=k)), runes_df)
+    print(f'{len(runes_df)} runes -> {len(top_options)} top {k} gem options')
+
+# %% RuneTable memory and scans
+def bench_rune_table(n_runes=50000):
+    data = make_synthetic_export(n_runes=n_runes, n_units=n_runes // 20)
+    runes_df = r.load_runes(data)
+    rune_table, _ = timed('RuneTable.from_dataframe', r.RuneTable.from_dataframe, runes_df)
+
+    df_bytes = runes_df.memory_usage(deep=True).sum()
+    print(f'DataFrame: {df_bytes / 1e6:.1f} MB, RuneTable: {rune_table.nbytes / 1e6:.1f} MB ({df_bytes / rune_table.nbytes:.1f}x smaller)')
+
+    query = dict(slot_2=['SPD'], slot_4=['CD'], slot_6=['HP'], sub_stats=['SPD','HP','DEF','CD','Flat HP','ACC'])
+    timed('find_runes (DataFrame)', r.find_runes, runes_df, sets=['VIOLENT','WILL'], **query)
+    timed('find_runes (RuneTable)', r.find_runes, rune_table, sets=['VIOLENT','WILL'], **query)
+
+# %% find_runes vs RuneIndex queries
+def bench_rune_index(n_runes=200000, n_queries=100):
+    data = make_synthetic_export(n_runes=n_runes, n_units=n_runes // 20)
+    runes_df = r.load_runes(data)
+    rune_index, _ = timed('RuneIndex', r.RuneIndex, runes_df)
+    print(f'{rune_index.nbytes / 1e6:.1f} MB of bitsets for {n_runes} runes')
+
+    rng = random.Random(0)
+    queries = [dict(sets=rng.sample(r.set_names, 2), slot_2=['SPD'], slot_4=rng.sample(['CD','CR','HP','ATK'], 1),
+                    slot_6=rng.sample(['HP','ATK','DEF'], 1), sub_stats=rng.sample(r.stat_names, 6), min_sub_stats=3)
+               for _ in range(n_queries)]
+    _, query_time = timed(f'{n_queries} RuneIndex queries', lambda: [rune_index.query(**query) for query in queries])
+    _, frame_time = timed(f'{n_queries} RuneIndex queries + to_dataframe', lambda: [rune_index.query(**query).to_dataframe() for query in queries])
+    print(f'{query_time / n_queries * 1000:.2f} ms per query, {frame_time / n_queries * 1000:.2f} ms with the DataFrame')
+
+# %% grading one profile at a time vs grade_runes_profiles
+def bench_grade_profiles(n_runes=20000, n_profiles=20):
+    data = make_synthetic_export(n_runes=n_runes, n_units=n_runes // 20)
+    runes_df = r.load_runes(data)
+
+    rng = random.Random(0)
+    profiles = {}
+    for p in range(n_profiles):
+        stats = rng.sample(r.stat_names, 8)
+        profiles[f'profile {p}'] = {'max_value': stats[:1], 'high_value': stats[1:3], 'some_value': stats[3:6],
+                                    'no_value': stats[6:7], 'negative_value': stats[7:]}
+
+    timed('grade_runes_sub_stats x 1', r.grade_runes_sub_stats, runes_df, **profiles['profile 0'])
+    scores, _ = timed(f'grade_runes_profiles x {n_profiles}', r.grade_runes_profiles, runes_df, profiles)
+    print(f'{scores.shape[0]} runes x {scores.shape[1]} profiles')
+
+# %% groupby rank vs PercentileIndex
+def bench_percentile_index(n_runes=50000):
+    data = make_synthetic_export(n_runes=n_runes, n_units=n_runes // 20)
+    runes_df = prepare_scoring_frame(r.load_runes(data))
+    runes_df['Score'] = r.score_runes(runes_df)
+    runes_df['SPD'] = runes_df['Base SPD']
+
+    def groupby_ranks(runes_df):
+        return {(level, metric): runes_df.groupby(group_cols)[metric].rank(pct=True)
+                for metric in ['SPD','Score'] for level, group_cols in r.percentile_levels.items()}
+
+    timed('groupby rank (2 metrics)', groupby_ranks, runes_df)
+    percentile_index, _ = timed('PercentileIndex', r.PercentileIndex, runes_df, ['SPD','Score'])
+    timed('PercentileIndex.percentile_frame', percentile_index.percentile_frame, runes_df)
+
+    # hypothetical values are looked up without ranking the table again
+    candidates = runes_df.sample(1000, random_state=0)
+    timed('1000 single lookups', lambda: [percentile_index.percentile('SPD', row.SPD + 4, row.slot_no, row.main_stat_type)
+                                          for row in candidates.itertuples()])
+    timed('remove + insert 1000 runes', lambda: (percentile_index.remove(candidates), percentile_index.insert(candidates)))
+
+# %% monster x rune value matrix
+def bench_pairing_matrix(n_runes=3000, n_monsters=300):
+    data = make_synthetic_export(n_runes=n_runes, n_units=n_runes // 20)
+    runes = prepare_pairing_runes(r.load_runes(data))
+    monsters = make_synthetic_monsters(n_monsters)
+
+    pairing, _ = timed('PairingMatrix', mrp.PairingMatrix, runes, monsters)
+    values, _ = timed('values + eligibility (all runes x all monsters)', lambda: (pairing.values(), pairing.monster_eligible()))
+    print(f'{values[0].shape[0]} runes x {values[0].shape[1]} monsters')
+
+# %% best monsters for every rune and gem option
+def bench_best_monsters_for_runes(n_runes=10000, n_monsters=300, top_k=3):
+    data = make_synthetic_export(n_runes=n_runes, n_units=n_runes // 20)
+    runes_df = r.load_runes(data)
+    runes_df['set_id'] = runes_df['set_id'].str.upper()
+    maxed_runes = r.get_rolls(r.all_gem_grind_combinations(runes_df))
+    monsters = make_synthetic_monsters(n_monsters)
+    print(f'{len(maxed_runes)} gem/grind options of {n_runes} runes x {n_monsters} monsters')
+
+    timed('find_best_monsters_for_all_runes', mrp.find_best_monsters_for_all_runes, maxed_runes, monsters)
+    timed(f'find_best_monsters_for_all_runes, top {top_k}', mrp.find_best_monsters_for_all_runes, maxed_runes, monsters, top_k=top_k)
+    timed(f'find_best_monsters_for_all_runes, top {top_k} per option', mrp.find_best_monsters_for_all_runes, maxed_runes, monsters,
+          top_k=top_k, per_option=True)
+
+# %% greedy pairing vs optimal assignment
+def bench_assignment(n_runes=3000, n_monsters=300):
+    data = make_synthetic_export(n_runes=n_runes, n_units=n_runes // 20)
+    runes = prepare_pairing_runes(r.load_runes(data))
+    monsters = make_synthetic_monsters(n_monsters)
+
+    timed('find_best_runes_for_monsters (greedy)', mrp.find_best_runes_for_monsters, monsters, runes, verbose=False)
+    timed('assign_runes_to_monsters (optimal)', mrp.assign_runes_to_monsters, monsters, runes)
+    (_, _, summary), _ = timed('compare_assignments', mrp.compare_assignments, monsters, runes)
+    print(summary)
+
+# %% full six-rune builds
+def bench_build_optimizer(n_runes=150000, n_monsters=20):
+    data = make_synthetic_export(n_runes=n_runes, n_units=n_runes // 20)
+    runes = prepare_pairing_runes(r.load_runes(data))
+    monsters = make_synthetic_monsters(n_monsters)
+    pairing, _ = timed('PairingMatrix', mrp.PairingMatrix, runes, monsters)
+    print(f'{n_runes // 6} runes per slot')
+
+    for min_stats in [{}, {'SPD': 40}, {'SPD': 40, 'ACC': 30}]:
+        def optimize_all():
+            return [build_optimizer.optimize_build(monster, monsters, runes, min_stats=min_stats, top_n=3, pairing=pairing)
+                    for _, monster in monsters.iterrows()]
+        builds, elapsed = timed(f'optimize_build x {n_monsters}, top 3, min_stats={min_stats}', optimize_all)
+        print(f'  {sum(len(b) > 0 for b in builds)} monsters with a build, {elapsed / n_monsters * 1000:.0f} ms per monster')
+
+    # 'Unknown', blank and set names no rune has ask for no off set, like a missing one
+    monster = monsters.iloc[0].copy()
+    monster['most_popular_offset'] = np.nan
+    no_offset = build_optimizer.optimize_build(monster, monsters, runes, pairing=pairing)
+    for offset in ['Unknown', '', 'NO SUCH SET']:
+        monster['most_popular_offset'] = offset
+        build = build_optimizer.optimize_build(monster, monsters, runes, pairing=pairing)
+        print(f'off set {offset!r}: {len(build)} runes, same as no off set: {build.equals(no_offset)}')
+
+# %% roster builds on one process vs all cores
+def bench_roster_optimizer(n_runes=30000, n_monsters=200):
+    data = make_synthetic_export(n_runes=n_runes, n_units=n_runes // 20)
+    runes = prepare_pairing_runes(r.load_runes(data))
+    monsters = make_synthetic_monsters(n_monsters)
+
+    _, serial_time = timed('optimize_roster, 1 process', build_optimizer.optimize_roster, monsters, runes, min_stats={'SPD': 30}, processes=1)
+    processes = os.cpu_count()
+    builds, parallel_time = timed(f'optimize_roster, {processes} processes', build_optimizer.optimize_roster, monsters, runes,
+                                  min_stats={'SPD': 30}, processes=processes, verbose=True)
+    print(f'{builds["priority"].nunique()} builds, {serial_time / parallel_time:.1f}x faster on {processes} cores')
+
+# %% set build grouping and roll estimation
+def bench_stat_distribution(n_builds=300000, n_row_wise=5000):
+    builds = make_synthetic_builds(n_builds)
+    base_stats = {'HP': 10710, 'ATK': 736, 'DEF': 692, 'SPD': 111, 'CR': 15, 'CD': 50, 'ACC': 0, 'RES': 15}
+    set_bonus_data = sd.load_set_bonuses(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'set_bonuses.csv'))
+
+    sample = builds.iloc[:n_row_wise]
+    timed(f'estimate_rolls_for_build x {n_row_wise} (row-wise)', lambda: [sd.estimate_rolls_for_build(row, base_stats, set_bonus_data)
+                                                                          for _, row in sample.iterrows()])
+    timed(f'estimate_rolls x {n_builds} (column-wise)', sd.estimate_rolls, builds, base_stats, set_bonus_data)
+    (set_builds_df, _), _ = timed(f'analyze_set_builds x {n_builds}', sd.analyze_set_builds, builds, base_stats, set_bonus_data)
+    print(f'{len(set_builds_df)} set builds')
+
+# %% roster-wide stat distribution, cold and cached
+def bench_analyze_roster(n_monsters=40, n_builds=5000):
+    base_stats = {'HP': 10710, 'ATK': 736, 'DEF': 692, 'SPD': 111, 'CR': 15, 'CD': 50, 'ACC': 0, 'RES': 15}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        player_dir = os.path.join(tmp_dir, 'player_data')
+        os.makedirs(player_dir)
+        for i in range(n_monsters):
+            builds = make_synthetic_builds(n_builds, seed=i)
+            builds['Data Age'] = pd.Timestamp.today().strftime('%Y-%m-%d')
+            builds.to_csv(os.path.join(player_dir, f'monster_{i}.csv'), index=False)
+        base_stats_by_monster = {f'monster_{i}': base_stats for i in range(n_monsters)}
+        kwargs = dict(player_dir=player_dir, cache_dir=os.path.join(tmp_dir, 'cache'), output_file=os.path.join(tmp_dir, 'distributions.csv'),
+                      set_bonus_file=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'set_bonuses.csv'))
+
+        timed(f'analyze_roster, {n_monsters} monsters, 1 process', sd.analyze_roster, base_stats_by_monster, processes=1,
+              **{**kwargs, 'cache_dir': os.path.join(tmp_dir, 'cache_serial')})
+        timed(f'analyze_roster, {n_monsters} monsters, {os.cpu_count()} processes', sd.analyze_roster, base_stats_by_monster, **kwargs)
+        timed('analyze_roster, cached', sd.analyze_roster, base_stats_by_monster, **kwargs)
+
+# %% player_data csv files vs the consolidated player_store
+def bench_player_store(n_monsters=1000, n_builds=300):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        player_dir, store_dir = os.path.join(tmp_dir, 'player_data'), os.path.join(tmp_dir, 'player_store')
+        os.makedirs(player_dir)
+        ages = pd.date_range(end=pd.Timestamp.today().normalize(), periods=900).strftime('%Y-%m-%d')
+        for i in range(n_monsters):
+            builds = make_synthetic_builds(n_builds, seed=i)
+            builds['Data Age'] = [ages[(i * 7 + j * 13) % len(ages)] for j in range(n_builds)]
+            builds.to_csv(os.path.join(player_dir, f'monster_{i}.csv'), index=False)
+
+        timed(f'load_data x {n_monsters} csv files', lambda: [sd.load_data(os.path.join(player_dir, f'monster_{i}.csv')) for i in range(n_monsters)])
+        timed(f'player_store.import_player_csvs, {n_monsters} monsters', player_store.import_player_csvs, player_dir, store_dir)
+        df, _ = timed('player_store.read_player_data, every monster', player_store.read_player_data, store_dir)
+        recent, _ = timed('player_store.read_player_data, since the date cutoff', player_store.read_player_data, store_dir, start=sd.date_cutoff())
+        timed('player_store.read_player_data, 10 monsters x 3 columns', player_store.read_player_data, store_dir,
+              monsters=[f'monster_{i}' for i in range(10)], columns=['Set1', 'SPD', 'Data Age'])
+        print(f'{len(df)} builds, {len(recent)} since the cutoff')
+
+        # the scraper appends a full rescrape, only the builds that weren't stored yet are written
+        new_builds = make_synthetic_builds(20, seed=n_monsters)
+        new_builds['Data Age'] = ages[-1]
+        rescrape = pd.concat([pd.read_csv(os.path.join(player_dir, 'monster_0.csv')), new_builds], ignore_index=True)
+        written, _ = timed('player_store.append_player_data, rescrape of one monster', player_store.append_player_data, 'monster_0', rescrape, store_dir)
+        timed('player_store.compact', player_store.compact, store_dir)
+        print(f'{written} new builds appended')
+
+# %% scraper against a local stub of the monster site
+def make_monster_page(n_builds=200, seed=0):
+    """
+    Builds a page shaped like a godsarmy monster page: the base stats table, a second table
+    and the table of player builds pulldown.get_player_data reads.
+    """
+    rng = random.Random(seed)
+    builds = make_synthetic_builds(n_builds, seed)
+    base_stats = pd.DataFrame([{'HP': 10.71, 'ATK': 736, 'DEF': 692, 'SPD': 111, 'CR': 15, 'CD': 50, 'RES': 15, 'ACC': 0}])
+    # stat cells look like "total (runes)", get_player_data keeps the part in parentheses
+    players = pd.DataFrame({'Calc': '', 'Player': [f'player{i}' for i in range(n_builds)], 'Score': builds['Score'].round(1),
+                            'Sets': (builds['Set1'] + ' ' + builds['Set2']).str.title(),
+                            'Slots': builds['Slot2'] + ' ' + builds['Slot4'] + ' ' + builds['Slot6']})
+    for stat in ['HP', 'ATK', 'DEF', 'SPD', 'CR', 'CD', 'ACC', 'RES']:
+        players[stat] = [f'{value} ({value:,})'.replace(',', '.') for value in builds[stat]]
+    today = pd.Timestamp.today().normalize()
+    players['Data Age'] = [(today - pd.Timedelta(days=rng.randint(0, 200))).strftime('%d.%m.%Y') for _ in range(n_builds)]
+    tables = [base_stats.to_html(index=False), pd.DataFrame({'Skill': ['S1', 'S2']}).to_html(index=False), players.to_html(index=False)]
+    return '<html><body>' + ''.join(tables) + '</body></html>'
+
+class StubPageHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, so pooled connections are reused
+    disable_nagle_algorithm = True  # headers and body are separate writes
+
+    def setup(self):
+        # once per connection, standing in for the TCP and TLS handshakes
+        time.sleep(self.server.connect_latency)
+        self.server.connections += 1
+        super().setup()
+
+    def do_GET(self):
+        time.sleep(self.server.latency)
+        self.server.requests += 1
+        if self.headers.get('If-None-Match') == self.server.etag:
+            self.send_response(304)
+            self.send_header('ETag', self.server.etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.server.bytes_sent += len(self.server.page)
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(self.server.page)))
+        self.send_header('ETag', self.server.etag)
+        self.end_headers()
+        self.wfile.write(self.server.page)
+
+    def log_message(self, *args):
+        pass
+
+class StubMonsterSite(http.server.ThreadingHTTPServer):
+    """
+    Serves the same monster page for every path after latency seconds, like a slow remote site.
+    Each new connection first waits connect_latency seconds. Answers If-None-Match with a 304
+    and counts connections, requests and body bytes sent.
+    """
+    daemon_threads = True
+
+    def __init__(self, page, latency=0.2, connect_latency=0):
+        super().__init__(('127.0.0.1', 0), StubPageHandler)
+        self.page = page.encode()
+        self.etag = '"' + hashlib.sha256(self.page).hexdigest()[:16] + '"'
+        self.latency = latency
+        self.connect_latency = connect_latency
+        self.connections = 0
+        self.requests = 0
+        self.bytes_sent = 0
+        self.url = f'http://127.0.0.1:{self.server_port}'
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+def quietly(func, *args, **kwargs):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return func(*args, **kwargs)
+
+@contextlib.contextmanager
+def http_cache_dir(cache_dir):
+    # points http_utils' cache at cache_dir for the block, then back at what it was
+    previous = http_utils.http_cache_dir
+    http_utils.http_cache_dir = cache_dir
+    try:
+        yield
+    finally:
+        http_utils.http_cache_dir = previous
+
+def bench_scraper(n_monsters=40, latency=0.2, concurrency=16):
+    site = StubMonsterSite(make_monster_page(), latency)
+    names = [f'Monster {i}' for i in range(n_monsters)]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        player_dir = os.path.join(tmp_dir, 'player_data')
+        os.makedirs(player_dir)
+        kwargs = dict(site_url=site.url, player_dir=player_dir)
+        # separate http caches, so neither run revalidates the other's pages
+        with http_cache_dir(os.path.join(tmp_dir, 'http_serial')):
+            serial, serial_time = timed(f'get_monster_summary x {n_monsters} (serial), {latency}s latency', quietly,
+                                        lambda: [pulldown.get_monster_summary(name, store_dir=os.path.join(tmp_dir, 'store_serial'), **kwargs) for name in names])
+        with http_cache_dir(os.path.join(tmp_dir, 'http')):
+            summaries, async_time = timed(f'scrape_monsters x {n_monsters}, {concurrency} in flight', quietly, asyncio.run,
+                                          pulldown.scrape_monsters(names, concurrency, store_dir=os.path.join(tmp_dir, 'store'),
+                                                                   summary_file=os.path.join(tmp_dir, 'monster_summaries.csv'), **kwargs))
+    site.shutdown()
+    print(f'{summaries["error"].isna().sum()}/{n_monsters} pages parsed, {serial_time / async_time:.1f}x faster')
+
+# %% paginated monsters api, following next links vs all pages at once
+class StubApiHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        time.sleep(self.server.latency)
+        query = urllib.parse.parse_qs(urllib.parse.urlsplit(self.path).query)
+        page = int(query.get('page', ['1'])[0])
+        monsters = self.server.monsters
+        results = monsters[(page - 1) * self.server.page_size:page * self.server.page_size]
+        more = page * self.server.page_size < len(monsters)
+        body = json.dumps({'count': len(monsters), 'next': f'{self.server.url}/api/v2/monsters/?page={page + 1}' if more else None,
+                           'previous': None, 'results': results}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+def make_synthetic_swarfarm_monsters(n_monsters=3000, seed=0):
+    """
+    SWARFARM-like monster list entries, five elements per family.
+    """
+    rng = random.Random(seed)
+    elements = ['fire', 'water', 'wind', 'light', 'dark']
+    return [{'id': i, 'com2us_id': 10000 + i, 'name': f'Monster {i}', 'element': elements[i % 5], 'family_id': 100 + i // 5,
+             'base_hp': rng.randint(5000, 15000), 'base_attack': rng.randint(400, 900), 'base_defense': rng.randint(400, 900),
+             'speed': rng.randint(90, 120), 'crit_rate': 15, 'crit_damage': 50, 'resistance': 15, 'accuracy': 0}
+            for i in range(n_monsters)]
+
+class StubMonsterApi(http.server.ThreadingHTTPServer):
+    """
+    Serves n_monsters SWARFARM-like monsters, page_size per page, after latency seconds per request.
+    """
+    daemon_threads = True
+
+    def __init__(self, n_monsters=3000, page_size=100, latency=0.2):
+        super().__init__(('127.0.0.1', 0), StubApiHandler)
+        self.monsters = make_synthetic_swarfarm_monsters(n_monsters)
+        self.page_size = page_size
+        self.latency = latency
+        self.url = f'http://127.0.0.1:{self.server_port}'
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+def follow_next_links(base_url):
+    """
+    The page by page loop get_all_monsters used to run.
+    """
+    session, monsters, next_url = http_utils.shared_session(), [], base_url
+    while next_url:
+        data = http_utils.cached_get(session, next_url).json()
+        monsters.extend(data['results'])
+        next_url = data['next']
+    return monsters
+
+def bench_all_monsters(n_monsters=3000, latency=0.2, workers=8):
+    api = StubMonsterApi(n_monsters, latency=latency)
+    base_url = f'{api.url}/api/v2/monsters/'
+    with tempfile.TemporaryDirectory() as tmp_dir, http_cache_dir(tmp_dir):
+        n_pages = -(-n_monsters // api.page_size)
+        sequential, _ = timed(f'{n_pages} pages, following next links', follow_next_links, base_url)
+        monsters, _ = timed(f'{n_pages} pages, swarfarm_api.get_all_monsters({workers} workers)', swarfarm_api.get_all_monsters, base_url, workers)
+    api.shutdown()
+    print(f'{len(monsters)} monsters, same as sequential: {monsters == sequential}')
+
+# %% monster lookups: scanning the list vs the MonsterCatalog indexes
+def bench_monster_catalog(n_monsters=3000, n_roster=1500):
+    all_monsters = make_synthetic_swarfarm_monsters(n_monsters)
+    rng = random.Random(1)
+    names = [f'MONSTER {rng.randrange(n_monsters)}' for _ in range(n_roster)]
+    units = pd.Series([10000 + rng.randrange(n_monsters) for _ in range(n_roster)])
+
+    def scan_roster():
+        base_stats = [swarfarm_api.monster_base_stats(swarfarm_api.find_monster_by_name(all_monsters, name)) for name in names]
+        names_by_id = {monster['com2us_id']: monster['name'].lower() for monster in all_monsters}
+        return base_stats, units.map(names_by_id)
+
+    catalog, _ = timed(f'MonsterCatalog of {n_monsters} monsters', swarfarm_api.MonsterCatalog, all_monsters)
+    (scanned, scanned_names), _ = timed(f'{n_roster} names and ids, scanning the list', scan_roster)
+    (stats, catalog_names), seconds = timed(f'{n_roster} names and ids, MonsterCatalog',
+                                            lambda: (catalog.base_stat_array(names), catalog.names_for_com2us_ids(units)))
+    print(f'  {seconds / (2 * n_roster) * 1e6:.2f} us per lookup, same results: '
+          f'{np.array_equal(stats, [list(row.values()) for row in scanned]) and catalog_names.equals(scanned_names)}')
+
+# %% a new session per request vs the shared keep-alive session
+def bench_shared_session(n_requests=100, latency=0.01, connect_latency=0.05):
+    site = StubMonsterSite(make_monster_page(20), latency, connect_latency)
+    urls = [f'{site.url}/monsters/monster_{i}' for i in range(n_requests)]
+    runs = [('new session per request', lambda url: http_utils.get_legacy_session().get(url)),
+            ('shared_session', lambda url: http_utils.shared_session().get(url))]
+    for label, get in runs:
+        connections_before = site.connections
+        timed(f'{n_requests} requests, {label}', lambda: [get(url) for url in urls])
+        print(f'  {site.connections - connections_before} connections opened')
+    http_utils.close_shared_sessions()
+    site.shutdown()
+
+# %% http cache: download, revalidate, fresh and offline
+def bench_http_cache(n_pages=200, latency=0.02):
+    site = StubMonsterSite(make_monster_page(), latency)
+    urls = [f'{site.url}/monsters/monster_{i}' for i in range(n_pages)]
+    session = http_utils.shared_session()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        runs = [('download', dict(ttl=0)), ('revalidate', dict(ttl=0)), ('fresh', dict(ttl=3600)), ('offline', dict(offline=True))]
+        for label, kwargs in runs:
+            requests_before, bytes_before = site.requests, site.bytes_sent
+            responses, _ = timed(f'cached_get x {n_pages}, {label}', lambda: [http_utils.cached_get(session, url, cache_dir=tmp_dir, **kwargs) for url in urls])
+            print(f'  {site.requests - requests_before} requests, {(site.bytes_sent - bytes_before) / 1e6:.1f} MB of bodies, '
+                  f'{sum(response.from_cache for response in responses)} served from the cache')
+    site.shutdown()
+
+# %% incremental update vs full rebuild
+def build_rune_frames(runes_df, unit_list):
+    """
+    Mirrors main.build_frames on an already loaded runes_df, with the units kept as they are.
+    """
+    rune_hashes, unit_hashes = export_diff.rune_hashes(runes_df), export_diff.unit_hashes(unit_list)
+    r.check_hero_gem(runes_df)
+    runes_df['Total Rolls'] = runes_df[['Rolls ACC','Rolls CD','Rolls CR','Rolls ATK','Rolls DEF','Rolls HP','Rolls RES','Rolls SPD']].sum(axis=1)
+    reapp_targets = r.find_reapp_targets(runes_df)
+    maxed_runes = r.get_rolls(r.all_gem_grind_combinations(runes_df))
+    maxed_runes_percentile = r.find_percentiles(maxed_runes.set_index('rune_id'),'New Total Rolls')
+    runes_df['Score'] = export_diff.rune_scores(runes_df)
+    return {'runes_df': runes_df, 'my_monsters': pd.DataFrame.from_dict(unit_list), 'reapp_targets': reapp_targets, 'maxed_runes': maxed_runes,
+            'maxed_runes_percentile': maxed_runes_percentile, 'rune_hashes': rune_hashes, 'unit_hashes': unit_hashes}
+
+def bench_incremental_update(n_runes=50000, n_changed=50):
+    data = make_synthetic_export(n_runes=n_runes, n_units=n_runes // 20)
+    previous = build_rune_frames(r.load_runes(data), data['unit_list'])
+
+    # power up, sell and add a few inventory runes
+    rng = random.Random(1)
+    new_data = copy.deepcopy(data)
+    inventory = new_data['runes']
+    for rune in rng.sample(inventory, n_changed):
+        rune['upgrade_curr'] = 15
+        rune['sec_eff'][0][1] += 5
+    del inventory[:n_changed]
+    inventory += [make_synthetic_rune(10**7 + i, rng) for i in range(n_changed)]
+
+    timed('full rebuild', lambda: build_rune_frames(r.load_runes(new_data), new_data['unit_list']))
+    (frames, changes), _ = timed('export_diff.update_frames', lambda: export_diff.update_frames(previous, r.load_runes(new_data), new_data))
+    print('runes added/changed/removed:', *[len(changes['runes'][key]) for key in ['added','changed','removed']])
+
+# %%
+if __name__ == '__main__':
+    bench_load_runes()
+    bench_export_stream()
+    bench_score_runes()
+    bench_all_gem_grind_combinations()
+    bench_top_gem_options()
+    bench_rune_table()
+    bench_rune_index()
+    bench_grade_profiles()
+    bench_percentile_index()
+    bench_pairing_matrix()
+    bench_best_monsters_for_runes()
+    bench_assignment()
+    bench_build_optimizer()
+    bench_roster_optimizer()
+    bench_stat_distribution()
+    bench_analyze_roster()
+    bench_player_store()
+    bench_scraper()
+    bench_shared_session()
+    bench_all_monsters()
+    bench_monster_catalog()
+    bench_http_cache()
+    bench_incremental_update()
@@ -0,0 +1,410 @@
+# %%
+import heapq
+import itertools
+import json
+import multiprocessing
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from runes import stat_list, main_sets
+from monster_rune_pairing import PairingMatrix, slot_to_column_mapping
+
+# rune classes used for set completion
+MAIN, OFF, OTHER = 0, 1, 2
+
+# lagrange multipliers tried for each minimum stat when bounding a branch
+multiplier_grid = [0, 0.25, 0.5, 1, 2, 4]
+# rows checked against the Pareto front at once
+pareto_block_size = 256
+
+def set_size(set_name):
+    # the main sets are the 4 rune sets, every other set needs 2 runes
+    return 4 if set_name in main_sets else 2
+
+# %%
+def pareto_front(points):
+    """
+    Returns the positions of the rows of points (n x d) that no other row dominates,
+    i.e. no other row is at least as large in every column. Of identical rows only the
+    first is kept.
+    """
+    order = np.lexsort(points.T[::-1] * -1)
+    if points.shape[1] == 1:
+        return order[:1]
+    # most rows are dominated by the row with the highest value, drop them before the sweep
+    dominated = np.all(points <= points[order[0]], axis=1)
+    dominated[order[0]] = False
+    order = order[~dominated[order]]
+    # the rest are swept in blocks, each checked against the front so far and the rows before it in
+    # the block. Dominance is transitive, so a row dominated by an earlier dominated row is also
+    # dominated by a row of the front
+    front = np.zeros(0, dtype=int)
+    earlier = np.tril(np.ones((pareto_block_size, pareto_block_size), dtype=bool), -1)
+    for start in range(0, len(order), pareto_block_size):
+        block = order[start:start + pareto_block_size]
+        dominated = np.all(points[front][None, :, :] >= points[block][:, None, :], axis=2).any(axis=1)
+        in_block = np.all(points[block][None, :, :] >= points[block][:, None, :], axis=2)
+        dominated |= (in_block & earlier[:len(block), :len(block)]).any(axis=1)
+        front = np.append(front, block[~dominated])
+    return np.sort(front)
+
+def pareto_layers(points, n_layers):
+    """
+    Returns the positions of the rows in the first n_layers Pareto fronts. A row outside
+    them is dominated by n_layers other rows, each of which makes a build at least as good,
+    so the top n_layers builds never need it.
+    """
+    remaining = np.arange(len(points))
+    keep = []
+    for _ in range(n_layers):
+        if not len(remaining):
+            break
+        front = remaining[pareto_front(points[remaining])]
+        keep.append(front)
+        remaining = np.setdiff1d(remaining, front)
+    return np.sort(np.concatenate(keep))
+
+def known_set(set_name, rune_sets=None):
+    # monster_summaries.csv has blank and 'Unknown' sets, and a set no rune has can't be completed
+    if not isinstance(set_name, str) or not set_name.strip() or set_name.strip().upper() == 'UNKNOWN':
+        return False
+    return rune_sets is None or set_name in rune_sets
+
+def set_requirements(mainset, offset, rune_sets=None):
+    """
+    Returns how many runes the build needs from the main set and from the off set.
+    Blank and 'Unknown' sets, and sets none of rune_sets (when given) is, need no runes.
+    """
+    need_main = set_size(mainset) if known_set(mainset, rune_sets) else 0
+    need_off = set_size(offset) if known_set(offset, rune_sets) and offset != mainset else 0
+    if need_main + need_off > 6:
+        need_off = 0
+    return need_main, need_off
+
+class SlotCandidates:
+    """
+    Rune candidates of one slot for a build search: positions in the pairing's runes,
+    their Total Value, set class (MAIN, OFF or OTHER) and the constrained stats,
+    sorted by value so the best branches are tried first.
+    """
+
+    def __init__(self, rows, values, classes, stats):
+        order = np.argsort(-values, kind='stable')
+        self.rows = rows[order]
+        self.values = values[order]
+        self.classes = classes[order]
+        self.stats = stats[order]
+
+    def __len__(self):
+        return len(self.rows)
+
+def build_candidates(pairing, monster_column, mainset, offset, slot_mains, min_stats, free_slots, top_n=1, available=None):
+    """
+    Returns a SlotCandidates for every slot. Runes must have the slot's wanted main stat, and
+    be from the main set or off set unless the build has slots left for any set. Within each
+    set class, only runes on the first top_n Pareto fronts of (Total Value, constrained stats)
+    are kept: a rune beaten on all of them by another rune of the same slot and class is never
+    needed for the best build.
+    """
+    values = pairing.values(columns=[monster_column])[:, 0]
+    classes = np.where(pairing.set_id == mainset, MAIN, np.where(pairing.set_id == offset, OFF, OTHER))
+    stats = pairing.stats[:, [stat_list.index(stat) for stat in min_stats]]
+
+    candidates = {}
+    for slot in slot_to_column_mapping:
+        in_slot = pairing.slot_no == slot
+        wanted_main = slot_mains.get(slot)
+        if isinstance(wanted_main, str) and wanted_main:
+            in_slot &= pairing.main_stat_type == wanted_main
+        if not free_slots:
+            in_slot &= classes != OTHER
+        if available is not None:
+            in_slot &= available
+
+        keep = []
+        for rune_class in [MAIN, OFF, OTHER]:
+            rows = np.flatnonzero(in_slot & (classes == rune_class))
+            if len(rows):
+                points = np.column_stack([values[rows], stats[rows]])
+                keep.append(rows[pareto_layers(points, top_n)])
+        rows = np.concatenate(keep) if keep else np.zeros(0, dtype=int)
+        candidates[slot] = SlotCandidates(rows, values[rows], classes[rows], stats[rows])
+    return candidates
+
+def search_builds(candidates, need_main, need_off, min_stats, top_n=1):
+    """
+    Branch-and-bound search over one candidate per slot, best bound first. A branch is cut
+    when the remaining slots can't complete the sets or reach a minimum stat, or when its
+    upper bound can't beat the top_n builds found so far.
+
+    The upper bound is the branch's value plus, for each remaining slot, the best
+    value + multipliers @ stats, minus multipliers @ the stats still missing. With
+    multipliers of 0 this is the best value left in every slot; larger multipliers
+    charge for the value a build gives up to reach the minimum stats, and the smallest
+    bound over a small grid of multipliers is used.
+    Returns [(value, {slot: position in the pairing's runes})] of the best builds, best first.
+    """
+    slots = sorted(candidates, key=lambda slot: len(candidates[slot]))
+    slot_candidates = [candidates[slot] for slot in slots]
+    if any(len(c) == 0 for c in slot_candidates):
+        return []
+
+    minimums = np.array(list(min_stats.values()), dtype=float)
+    multipliers = np.array(list(itertools.product(multiplier_grid, repeat=len(minimums))), dtype=float)
+    multipliers = multipliers.reshape(len(multiplier_grid) ** len(minimums), len(minimums))
+    # best relaxed value and best constrained stats still reachable from each depth on
+    best_relaxed = [(c.values[:, None] + c.stats @ multipliers.T).max(axis=0) for c in slot_candidates]
+    relaxed_left = np.vstack([np.cumsum(best_relaxed[::-1], axis=0)[::-1], np.zeros((1, len(multipliers)))])
+    best_stats = [c.stats.max(axis=0) for c in slot_candidates]
+    best_stats_left = np.vstack([np.cumsum(best_stats[::-1], axis=0)[::-1], np.zeros((1, len(minimums)))])
+
+    top = []  # min heap of (value, counter, picks)
+    counter = 0
+    picks = [0] * len(slots)
+    last = len(slots) - 1
+
+    def keep(build_value):
+        nonlocal counter
+        counter += 1
+        entry = (build_value, counter, list(picks))
+        if len(top) < top_n:
+            heapq.heappush(top, entry)
+        else:
+            heapq.heappushpop(top, entry)
+
+    def search(depth, value, stats, n_main, n_off):
+        c = slot_candidates[depth]
+        child_stats = stats + c.stats
+        child_main = n_main + (c.classes == MAIN)
+        child_off = n_off + (c.classes == OFF)
+        feasible = np.maximum(need_main - child_main, 0) + np.maximum(need_off - child_off, 0) <= last - depth
+        if len(minimums):
+            feasible &= np.all(child_stats + best_stats_left[depth + 1] >= minimums, axis=1)
+
+        if depth == last:
+            # the last slot is scored for all its candidates at once, they are sorted by value
+            for i in np.flatnonzero(feasible)[:top_n]:
+                if len(top) == top_n and value + c.values[i] <= top[0][0]:
+                    break
+                picks[depth] = i
+                keep(value + c.values[i])
+            return
+
+        bounds = value + c.values[:, None] + relaxed_left[depth + 1] + (child_stats - minimums) @ multipliers.T
+        bounds = np.where(feasible, bounds.min(axis=1), -np.inf)
+        for i in np.argsort(-bounds, kind='stable'):
+            if bounds[i] == -np.inf or (len(top) == top_n and bounds[i] <= top[0][0]):
+                break
+            picks[depth] = i
+            search(depth + 1, value + c.values[i], child_stats[i], child_main[i], child_off[i])
+
+    search(0, 0.0, np.zeros(len(minimums)), 0, 0)
+    builds = sorted(top, key=lambda entry: -entry[0])
+    return [(value, {slot: slot_candidates[depth].rows[pick] for depth, (slot, pick) in enumerate(zip(slots, build))})
+            for value, _, build in builds]
+
+def monster_preferences(monster):
+    """
+    Returns the build preferences of a monster row as a small picklable dictionary.
+    """
+    return {'name': monster['name'], 'mainset': monster['most_popular_mainset'], 'offset': monster['most_popular_offset'],
+            'slot_mains': {slot: monster[column] for slot, column in slot_to_column_mapping.items() if column}}
+
+def best_builds(pairing, monster_column, preferences, min_stats=None, top_n=1, available=None):
+    """
+    Returns [(value, {slot: position in the pairing's runes})] of the top_n builds for the
+    monster in the pairing's monster_column, best first. pairing only needs stats, weights,
+    slot_no, set_id, main_stat_type and values(), so a PairingMatrix or a SharedRuneMatrix works.
+    """
+    min_stats = dict(min_stats or {})
+    mainset, offset = preferences['mainset'], preferences['offset']
+    need_main, need_off = set_requirements(mainset, offset, set(pd.unique(pairing.set_id)))
+    candidates = build_candidates(pairing, monster_column, mainset, offset, preferences['slot_mains'], min_stats,
+                                  6 - need_main - need_off, top_n, available)
+    return search_builds(candidates, need_main, need_off, min_stats, top_n)
+
+def build_frame(pairing, monster_columns, builds):
+    """
+    Returns the runes of [(value, {slot: row})] builds in the layout of find_best_runes_for_monster,
+    with 'build' (position in builds) and 'Build Value' columns.
+    """
+    frames = []
+    for build_number, (monster_column, (value, slot_rows)) in enumerate(zip(monster_columns, builds)):
+        rows = [slot_rows[slot] for slot in sorted(slot_rows)]
+        build = pairing.pair_frame(rows, [monster_column] * len(rows))
+        build['build'] = build_number
+        build['Build Value'] = value
+        frames.append(build)
+    if not frames:
+        return pairing.pair_frame([], []).assign(build=pd.Series(dtype=int), **{'Build Value': pd.Series(dtype=float)})
+    return pd.concat(frames, ignore_index=True)
+
+def optimize_build(monster, monsters, runes, min_stats=None, top_n=1, pairing=None, available=None):
+    """
+    Finds the best full six-rune builds for a monster (a row of update_monster_priority's output).
+    The build uses the monster's slot 2/4/6 main stats, completes its most popular main set and
+    off set (4 + 2 runes, or 2 + 2 plus two runes of any set) and maximizes the sum of the
+    runes' Total Value. min_stats are optional minimum totals of stat_list stats over the six
+    runes, such as {'SPD': 40, 'ACC': 25}. pairing is a PairingMatrix to reuse and available
+    an optional mask of its runes that can still be used.
+
+    Returns the runes of the top_n builds in the layout of find_best_runes_for_monster,
+    with 'build' (0 is the best) and 'Build Value' columns. The frame is empty if no build
+    meets the constraints.
+    """
+    if pairing is None:
+        pairing = PairingMatrix(runes, monsters)
+    monster_column = int(np.flatnonzero(pairing.monsters['name'].to_numpy() == monster['name'])[0])
+    builds = best_builds(pairing, monster_column, monster_preferences(monster), min_stats, top_n, available)
+    return build_frame(pairing, [monster_column] * len(builds), builds)
+
+# %% roster
+class SharedRuneMatrix:
+    """
+    The numeric arrays of a PairingMatrix saved as .npy files in a directory so worker
+    processes can open them as read-only memory maps instead of unpickling DataFrames.
+    Every worker shares the same pages of the OS file cache. Set names and main stats
+    are saved as integer codes.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        load = lambda name: np.load(os.path.join(directory, name + '.npy'), mmap_mode='r')
+        with open(os.path.join(directory, 'categories.json')) as f:
+            categories = json.load(f)
+        self.stats = load('stats')
+        self.weights = load('weights')
+        self.slot_no = load('slot_no')
+        self.set_id = np.array(categories['set_id'], dtype=object)[load('set_codes')]
+        self.main_stat_type = np.array(categories['main_stat_type'], dtype=object)[load('main_codes')]
+
+    @staticmethod
+    def save(pairing, directory):
+        set_codes, set_names = pd.factorize(pairing.set_id)
+        main_codes, main_stats = pd.factorize(pairing.main_stat_type)
+        arrays = {'stats': pairing.stats, 'weights': pairing.weights, 'slot_no': pairing.slot_no.astype(np.int64),
+                  'set_codes': set_codes, 'main_codes': main_codes}
+        for name, values in arrays.items():
+            np.save(os.path.join(directory, name + '.npy'), np.ascontiguousarray(values))
+        with open(os.path.join(directory, 'categories.json'), 'w') as f:
+            json.dump({'set_id': set_names.tolist(), 'main_stat_type': main_stats.tolist()}, f)
+        return SharedRuneMatrix(directory)
+
+    def values(self, rows=slice(None), columns=slice(None)):
+        return self.stats[rows] @ self.weights[columns].T
+
+# each worker process opens the shared matrix once
+worker_matrix = None
+
+def init_worker(directory):
+    global worker_matrix
+    worker_matrix = SharedRuneMatrix(directory)
+
+def close_worker():
+    # drops the memory maps, so the directory can be removed (Windows won't delete mapped files)
+    global worker_matrix
+    worker_matrix = None
+
+def roster_task(task):
+    # task is (monster column, preferences, min_stats, top_n, file of taken rows), only small objects are pickled
+    monster_column, preferences, min_stats, top_n, taken_file = task
+    available = None
+    if taken_file:
+        available = np.ones(len(worker_matrix.slot_no), dtype=bool)
+        available[np.load(os.path.join(worker_matrix.directory, taken_file))] = False
+    builds = best_builds(worker_matrix, monster_column, preferences, min_stats, top_n, available)
+    return [(float(value), {slot: int(row) for slot, row in slot_rows.items()}) for value, slot_rows in builds]
+
+# monsters searched again per process in each round of optimize_roster
+search_again_per_process = 1
+
+def free_build(builds, rune_ids, taken):
+    # the first of the builds that doesn't use a taken rune. builds are the best ones among runes
+    # that were available when they were searched, so it is also the best among the runes left
+    return next((build for build in builds if taken.isdisjoint(rune_ids[list(build[1].values())])), None)
+
+def optimize_roster(monsters, runes, min_stats=None, min_stats_by_monster=None, processes=None, alternatives=1, verbose=False):
+    """
+    Finds a build for every monster with optimize_build's rules, giving each rune to one monster.
+    monsters are in priority order (update_monster_priority's output) and min_stats applies to
+    every monster unless min_stats_by_monster has an entry for the monster's name.
+
+    Monsters are optimized on a pool of processes (os.cpu_count() by default). The pairing's
+    arrays are shared with the workers through SharedRuneMatrix, and each worker returns its
+    monster's top `alternatives` builds. Contested runes are resolved in priority order: a monster
+    gets its best build whose runes weren't taken by a higher priority monster. When all of a
+    monster's alternatives are taken, it and the lower priority monsters wait for the next round,
+    where the ones whose alternatives are all taken are searched again in parallel without the
+    runes taken so far. Every round settles at least one monster, and up to ties between builds
+    of equal value the builds are the same as optimizing the monsters one after another with
+    optimize_build.
+
+    On Windows the pool starts fresh interpreters, so call this under `if __name__ == '__main__':`.
+    Returns the builds in the layout of find_best_runes_for_monsters with a 'Build Value' column.
+    """
+    pairing = PairingMatrix(runes, monsters)
+    min_stats_by_monster = min_stats_by_monster or {}
+    preferences = [monster_preferences(monster) for _, monster in pairing.monsters.iterrows()]
+    monster_min_stats = [min_stats_by_monster.get(monster['name'], min_stats) for monster in preferences]
+    rune_ids = pairing.runes['rune_id'].to_numpy()
+    processes = processes or os.cpu_count()
+
+    taken = set()
+    chosen = {}
+    candidates = {}
+    next_column = 0
+    rounds = 0
+    with tempfile.TemporaryDirectory() as directory:
+        SharedRuneMatrix.save(pairing, directory)
+        if processes == 1:
+            init_worker(directory)
+            pool = None
+        else:
+            pool = multiprocessing.Pool(processes, initializer=init_worker, initargs=(directory,))
+        try:
+            while next_column < len(preferences):
+                # search every unsettled monster whose alternatives are all taken, or that wasn't searched yet.
+                # monsters far down the order are likely to lose their runes again before they settle,
+                # so only the first few are searched again in one round
+                search = [column for column in range(next_column, len(preferences)) if column not in candidates]
+                search += [column for column in range(next_column, len(preferences))
+                           if column in candidates and len(candidates[column]) == alternatives
+                           and free_build(candidates[column], rune_ids, taken) is None][:processes * search_again_per_process]
+                taken_file = None
+                if taken:
+                    taken_file = f'taken_{rounds}.npy'
+                    np.save(os.path.join(directory, taken_file), np.flatnonzero(np.isin(rune_ids, list(taken))))
+                tasks = [(column, preferences[column], monster_min_stats[column], alternatives, taken_file) for column in search]
+                if pool is None:
+                    results = [roster_task(task) for task in tasks]
+                else:
+                    results = pool.map(roster_task, tasks, chunksize=max(1, len(tasks) // (processes * 4)))
+                candidates.update(zip(search, results))
+                rounds += 1
+
+                # settle monsters in priority order until one has all its alternatives taken
+                while next_column < len(preferences):
+                    build = free_build(candidates[next_column], rune_ids, taken)
+                    if build is None and len(candidates[next_column]) == alternatives:
+                        break
+                    # fewer builds than asked for means the monster has no other build
+                    if build is not None:
+                        taken.update(rune_ids[list(build[1].values())])
+                        chosen[next_column] = build
+                    next_column += 1
+        finally:
+            if pool is None:
+                close_worker()
+            else:
+                pool.close()
+                pool.join()
+    if verbose:
+        print(len(chosen), 'of', len(preferences), 'monsters built in', rounds, 'rounds')
+
+    columns = sorted(chosen)
+    result = build_frame(pairing, columns, [chosen[column] for column in columns])
+    result['priority'] = np.array(columns, dtype=int)[result['build'].to_numpy(dtype=int)]
+    return result.drop(columns='build')
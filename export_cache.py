@@ -0,0 +1,148 @@
+# %%
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+import runes as r
+
+# Bump when the cached frames change shape or the pipeline that builds them changes.
+CACHE_FORMAT_VERSION = 2
+
+def file_hash(file_path, block_size=1 << 20):
+    """
+    Returns the sha256 hex digest of a file's contents.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def cache_key(file_path):
+    """
+    Keys a cache entry on the export's content and the scoring constants in runes.py.
+    """
+    return f'{file_hash(file_path)[:24]}-{r.scoring_version()}-v{CACHE_FORMAT_VERSION}'
+
+# %% columnar frame files
+def save_frame(df, frame_dir):
+    """
+    Saves a DataFrame as one .npy file per column plus a meta.json.
+    Numeric, bool and datetime columns are saved as they are so they can be memory mapped.
+    String and categorical columns are saved as integer codes with their categories in meta.json,
+    and any other object column (lists, dicts) falls back to a pickled object array.
+    """
+    os.makedirs(frame_dir, exist_ok=True)
+    columns = [('column', name, df[name].array if isinstance(df[name].dtype, pd.CategoricalDtype) else df[name].to_numpy())
+               for name in df.columns]
+    meta = {'columns': [], 'range_index': None, 'index_name': df.index.name}
+    if isinstance(df.index, pd.RangeIndex):
+        meta['range_index'] = [df.index.start, df.index.stop, df.index.step]
+    else:
+        columns.insert(0, ('index', df.index.name, df.index.to_numpy()))
+    for i, (kind, name, values) in enumerate(columns):
+        file_name = f'{i}.npy'
+        entry = {'kind': kind, 'name': name, 'file': file_name, 'encoding': 'array'}
+        if isinstance(values, pd.Categorical):
+            entry['encoding'] = 'categorical'
+            entry['categories'] = values.categories.tolist()
+            values = values.codes
+        elif values.dtype == object:
+            is_text = all(value is None or isinstance(value, str) or (isinstance(value, float) and np.isnan(value)) for value in values)
+            if is_text:
+                categorical = pd.Categorical(values)
+                entry['encoding'] = 'categorical'
+                entry['categories'] = categorical.categories.tolist()
+                values = categorical.codes
+            else:
+                entry['encoding'] = 'pickle'
+        np.save(os.path.join(frame_dir, file_name), values, allow_pickle=entry['encoding'] == 'pickle')
+        meta['columns'].append(entry)
+    with open(os.path.join(frame_dir, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+
+def load_frame(frame_dir, mmap=True, columns=None, categorical=False):
+    """
+    Loads a DataFrame saved with save_frame. With mmap=True numeric columns are
+    copy-on-write memory maps, so pages are only read when used and changes stay in memory.
+    When columns is given only those columns' files are read. With categorical=True
+    string columns are loaded as categoricals instead of object arrays.
+    """
+    with open(os.path.join(frame_dir, 'meta.json')) as f:
+        meta = json.load(f)
+
+    index = pd.RangeIndex(*meta['range_index'], name=meta['index_name']) if meta['range_index'] else None
+    data = {}
+    for entry in meta['columns']:
+        if columns is not None and entry['kind'] == 'column' and entry['name'] not in columns:
+            continue
+        path = os.path.join(frame_dir, entry['file'])
+        if entry['encoding'] == 'pickle':
+            values = np.load(path, allow_pickle=True)
+        else:
+            values = np.load(path, mmap_mode='c' if mmap else None)
+        if entry['encoding'] == 'categorical':
+            values = pd.Categorical.from_codes(values, entry['categories'])
+            if not categorical:
+                values = np.asarray(values, dtype=object)
+        if entry['kind'] == 'index':
+            index = pd.Index(values, name=entry['name'])
+        else:
+            data[entry['name']] = values
+    return pd.DataFrame(data, index=index, copy=False)
+
+# %%
+def load_entry(entry_dir, mmap=True):
+    with open(os.path.join(entry_dir, 'frames.json')) as f:
+        names = json.load(f)
+    return {name: load_frame(os.path.join(entry_dir, name), mmap=mmap) for name in names}
+
+def previous_entry(cache_dir):
+    """
+    Returns the most recently written cache entry built with the current scoring constants
+    and cache format, or None.
+    """
+    suffix = f'-{r.scoring_version()}-v{CACHE_FORMAT_VERSION}'
+    entries = [os.path.join(cache_dir, name) for name in os.listdir(cache_dir) if name.endswith(suffix)] if os.path.isdir(cache_dir) else []
+    entries = [entry_dir for entry_dir in entries if os.path.exists(os.path.join(entry_dir, 'frames.json'))]
+    if not entries:
+        return None
+    return max(entries, key=lambda entry_dir: os.path.getmtime(os.path.join(entry_dir, 'frames.json')))
+
+def cached_export(json_path, build, cache_dir='cache', mmap=True, update=None):
+    """
+    Returns the frames build(json_path) produces ({name: DataFrame}), reusing the cached
+    copy when the export's contents and runes.scoring_version() haven't changed.
+    When they have and update is given, update(previous_frames, json_path) brings the
+    frames of the most recent cache entry up to date instead of building from scratch.
+    Entries are written to a temporary directory first and then renamed into place.
+    """
+    entry_dir = os.path.join(cache_dir, cache_key(json_path))
+    if os.path.exists(os.path.join(entry_dir, 'frames.json')):
+        print('Loading cached frames from', entry_dir)
+        return load_entry(entry_dir, mmap=mmap)
+
+    previous_dir = previous_entry(cache_dir) if update is not None else None
+    if previous_dir is not None:
+        print('Updating cached frames from', previous_dir)
+        frames = update(load_entry(previous_dir, mmap=mmap), json_path)
+    else:
+        frames = build(json_path)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(dir=cache_dir)
+    try:
+        for name, df in frames.items():
+            save_frame(df, os.path.join(tmp_dir, name))
+        with open(os.path.join(tmp_dir, 'frames.json'), 'w') as f:
+            json.dump(list(frames), f)
+        os.replace(tmp_dir, entry_dir)
+    except OSError:
+        # another run wrote the same entry first
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return frames
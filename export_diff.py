@@ -0,0 +1,131 @@
+# %%
+import hashlib
+import json
+
+import numpy as np
+import pandas as pd
+
+import runes as r
+import monsters as m
+
+# %% hashes
+def rune_hashes(runes_df):
+    """
+    Returns a 'rune_hash' for every rune in a load_runes DataFrame, indexed by rune_id.
+    Columns are aligned to RuneTable.columns() first so a stat showing up for the
+    first time in the box doesn't change the hash of every other rune.
+    """
+    columns = r.as_runes_df(runes_df).reindex(columns=r.RuneTable.columns())
+    hashes = pd.util.hash_pandas_object(columns, index=True)
+    return pd.DataFrame({'rune_hash': hashes.to_numpy().view(np.int64)}, index=runes_df.index)
+
+def unit_hashes(unit_list):
+    """
+    Returns a 'unit_hash' for every unit in the exporter's unit_list, indexed by unit_id.
+    Runes are hashed separately by rune_hashes so they are left out here.
+    """
+    hashes = []
+    for unit in unit_list:
+        unit = {key: value for key, value in unit.items() if key not in ('runes', 'artifacts')}
+        digest = hashlib.blake2b(json.dumps(unit, sort_keys=True, default=str).encode(), digest_size=8).digest()
+        hashes.append(int.from_bytes(digest, 'little', signed=True))
+    index = pd.Index([unit['unit_id'] for unit in unit_list], name='unit_id')
+    return pd.DataFrame({'unit_hash': np.array(hashes, dtype=np.int64)}, index=index)
+
+def diff_hashes(old, new):
+    """
+    Compares two hash frames from rune_hashes or unit_hashes.
+    Returns a dictionary of 'added', 'removed' and 'changed' ids.
+    """
+    old_hashes, new_hashes = old.iloc[:, 0], new.iloc[:, 0]
+    common = new_hashes.index.intersection(old_hashes.index)
+    changed = common[new_hashes.loc[common].to_numpy() != old_hashes.loc[common].to_numpy()]
+    return {
+        'added': new_hashes.index.difference(old_hashes.index),
+        'removed': old_hashes.index.difference(new_hashes.index),
+        'changed': changed,
+    }
+
+# %% frames
+def rune_scores(runes_df):
+    """
+    Returns runes.score_runes for a load_runes DataFrame without changing it. The score
+    inputs are prepared the same way main.py prepares runes_df: upper case set names,
+    blank innate stats and each stat's Base value (0 when the rune doesn't have it).
+    """
+    scoring_df = runes_df[['slot_no','main_stat_type']].copy()
+    scoring_df['set_id'] = runes_df['set_id'].str.upper()
+    scoring_df['Innate Stat'] = runes_df['Innate Stat'].fillna('')
+    scoring_df['Innate Stat Value'] = runes_df['Innate Stat Value'].fillna(0)
+    for stat in r.stat_list:
+        scoring_df[stat] = runes_df['Base '+stat].fillna(0) if 'Base '+stat in runes_df.columns else 0
+    return r.score_runes(scoring_df)
+
+def reuse_column(runes_df, previous_df, changed_df, column):
+    # unchanged runes keep the previous value, changed and new runes take the recomputed one
+    if column not in previous_df.columns and column not in changed_df.columns:
+        return
+    missing = pd.Series(np.nan, index=runes_df.index)
+    previous_values = previous_df[column].reindex(runes_df.index) if column in previous_df.columns else missing
+    changed_values = changed_df[column].reindex(runes_df.index) if column in changed_df.columns else missing
+    runes_df[column] = changed_values.where(runes_df.index.isin(changed_df.index), previous_values)
+
+def update_frames(previous, runes_df, data):
+    """
+    Brings the frames cached for a previous export up to date with a new one.
+    runes_df and data are what export_stream.load_export returns for the new export.
+
+    Runes are matched by rune_id and units by unit_id. Only runes that were added or
+    changed (powered up, re-gemmed, moved to another monster) go through check_hero_gem,
+    score_runes and all_gem_grind_combinations, gem/grind options of sold runes are dropped,
+    and the rolls percentiles are only re-ranked in the groups those runes belong to.
+
+    Returns the updated frames and the rune and unit differences.
+    """
+    new_rune_hashes = rune_hashes(runes_df)
+    new_unit_hashes = unit_hashes(data['unit_list'])
+    rune_changes = diff_hashes(previous['rune_hashes'], new_rune_hashes)
+    unit_changes = diff_hashes(previous['unit_hashes'], new_unit_hashes)
+    changed_runes = rune_changes['added'].union(rune_changes['changed'])
+    stale_runes = changed_runes.union(rune_changes['removed'])
+
+    previous_runes = previous['runes_df']
+    changed_df = runes_df[runes_df.index.isin(changed_runes)].copy()
+
+    r.check_hero_gem(changed_df)
+    reuse_column(runes_df, previous_runes, changed_df, 'Max Hero Gem')
+    changed_df['Total Rolls'] = changed_df[['Rolls ACC','Rolls CD','Rolls CR','Rolls ATK','Rolls DEF','Rolls HP','Rolls RES','Rolls SPD']].sum(axis=1)
+    reuse_column(runes_df, previous_runes, changed_df, 'Total Rolls')
+    reapp_targets = r.find_reapp_targets(runes_df)
+
+    # all_gem_grind_combinations fills the Base columns of the frame it is given, do the same for the whole box
+    base_columns = ['Base '+stat for stat in r.stat_dict.values()]
+    runes_df[base_columns] = runes_df[base_columns].fillna(0)
+    previous_maxed = previous['maxed_runes']
+    maxed_runes = previous_maxed[~previous_maxed['rune_id'].isin(stale_runes)]
+    if len(changed_df):
+        changed_maxed = r.get_rolls(r.all_gem_grind_combinations(changed_df))
+        # each rune's options are already in order, so a stable sort on rune_id matches a full rebuild
+        maxed_runes = pd.concat([maxed_runes, changed_maxed], ignore_index=True)
+        maxed_runes = maxed_runes.iloc[np.argsort(maxed_runes['rune_id'].to_numpy(), kind='stable')]
+    maxed_runes.index = pd.RangeIndex(len(maxed_runes))
+    percentile_columns = maxed_runes[['slot_no','set_id','main_stat_type','New Total Rolls']].set_axis(pd.Index(maxed_runes['rune_id']))
+    maxed_runes_percentile = r.update_percentiles(previous['maxed_runes_percentile'], percentile_columns, 'New Total Rolls', stale_runes)
+
+    changed_df['Score'] = rune_scores(changed_df)
+    reuse_column(runes_df, previous_runes, changed_df, 'Score')
+
+    # only added and changed units are mapped to names again
+    changed_units = unit_changes['added'].union(unit_changes['changed'])
+    previous_monsters = previous['my_monsters']
+    my_monsters = [previous_monsters[~previous_monsters['unit_id'].isin(changed_units.union(unit_changes['removed']))]]
+    new_units = [unit for unit in data['unit_list'] if unit['unit_id'] in changed_units]
+    if new_units:
+        my_monsters.append(m.load_my_monsters({'unit_list': new_units}))
+    my_monsters = pd.concat(my_monsters, ignore_index=True)
+    unit_order = my_monsters['unit_id'].map(pd.Series(np.arange(len(new_unit_hashes)), index=new_unit_hashes.index))
+    my_monsters = my_monsters.iloc[np.argsort(unit_order.to_numpy(), kind='stable')].reset_index(drop=True)
+
+    frames = {'runes_df': runes_df, 'my_monsters': my_monsters, 'reapp_targets': reapp_targets, 'maxed_runes': maxed_runes,
+              'maxed_runes_percentile': maxed_runes_percentile, 'rune_hashes': new_rune_hashes, 'unit_hashes': new_unit_hashes}
+    return frames, {'runes': rune_changes, 'units': unit_changes}
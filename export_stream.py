@@ -0,0 +1,200 @@
+# %%
+import json
+import re
+
+import numpy as np
+
+import runes as r
+
+json_decoder = json.JSONDecoder()
+whitespace = re.compile(r'\s*')
+structural_chars = re.compile(r'["\[\]{}]')
+string_body = re.compile(r'[^"\\]*(?:\\.[^"\\]*)*"', re.S)
+
+class JsonStreamReader:
+    """
+    Reads JSON from a text file a buffer at a time.
+    Values can be decoded one at a time (array items, object keys) or skipped
+    by scanning for brackets and quotes without building any Python objects.
+    """
+
+    def __init__(self, file, read_size=1 << 16):
+        self.file = file
+        self.read_size = read_size
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def fill(self, size=None):
+        # drop what has already been consumed and append the next block of the file
+        self.buffer = self.buffer[self.pos:]
+        self.pos = 0
+        text = self.file.read(size or self.read_size)
+        if not text:
+            self.eof = True
+        self.buffer += text
+        return bool(text)
+
+    def peek(self):
+        """
+        Returns the next non-whitespace character without consuming it, or '' at the end of the file.
+        """
+        while True:
+            self.pos = whitespace.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.fill():
+                return ''
+
+    def expect(self, chars):
+        char = self.peek()
+        if not char or char not in chars:
+            raise ValueError(f"Expected one of {chars!r} at offset {self.pos}, found {char!r}")
+        self.pos += 1
+        return char
+
+    def read_value(self):
+        """
+        Decodes the next JSON value, reading more of the file until it is complete.
+        """
+        self.peek()
+        read_size = self.read_size
+        while True:
+            try:
+                value, end = json_decoder.raw_decode(self.buffer, self.pos)
+                # a number that ends at the end of the buffer may continue in the next block
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self.fill(read_size)
+            read_size *= 2
+
+    def skip_string(self):
+        # self.pos is just past the opening quote
+        while True:
+            match = string_body.match(self.buffer, self.pos)
+            if match:
+                self.pos = match.end()
+                return
+            if not self.fill():
+                raise ValueError('Unterminated string')
+
+    def skip_value(self):
+        """
+        Skips the next JSON value without decoding it.
+        """
+        char = self.peek()
+        if char == '"':
+            self.pos += 1
+            self.skip_string()
+            return
+        if char not in '[{':
+            self.read_value() # numbers, true, false and null are tiny
+            return
+
+        depth = 0
+        while True:
+            match = structural_chars.search(self.buffer, self.pos)
+            if match is None:
+                self.pos = len(self.buffer)
+                if not self.fill():
+                    raise ValueError('Unexpected end of file')
+                continue
+            self.pos = match.end()
+            char = match.group()
+            if char == '"':
+                self.skip_string()
+                continue
+            depth += 1 if char in '[{' else -1
+            if depth == 0:
+                return
+
+    def iter_array(self):
+        """
+        Yields each item of the next JSON array, decoding one item at a time.
+        """
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield self.read_value()
+            if self.expect(',]') == ']':
+                return
+
+    def iter_object_keys(self):
+        """
+        Yields each key of the next JSON object. The caller has to read or skip
+        the key's value before asking for the next key.
+        """
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            key = self.read_value()
+            self.expect(':')
+            yield key
+            if self.expect(',}') == '}':
+                return
+
+# %%
+def read_export(reader, chunk_size=5000):
+    """
+    Reads one exporter document from the reader. Inventory runes and each unit's runes
+    are decoded chunk_size runes at a time with runes.decode_runes, and every other
+    top-level section is skipped without being parsed.
+
+    Returns the same DataFrame as runes.load_runes and a {'unit_list': [...]} dictionary
+    (units without their runes and artifacts) for monsters.load_my_monsters.
+    """
+    inventory, equipped, unit_list = [], [], []
+    inventory_chunk, equipped_chunk = [], []
+
+    for key in reader.iter_object_keys():
+        if key == 'runes':
+            for rune in reader.iter_array():
+                inventory_chunk.append(rune)
+                if len(inventory_chunk) >= chunk_size:
+                    inventory.append(r.decode_runes(inventory_chunk))
+                    inventory_chunk = []
+        elif key == 'unit_list':
+            for unit in reader.iter_array():
+                equipped_chunk.extend(unit.pop('runes', []))
+                unit.pop('artifacts', None)
+                unit_list.append(unit)
+                if len(equipped_chunk) >= chunk_size:
+                    equipped.append(r.decode_runes(equipped_chunk))
+                    equipped_chunk = []
+        else:
+            reader.skip_value()
+
+    # inventory runes first, then equipped runes, like load_runes
+    inventory.append(r.decode_runes(inventory_chunk))
+    equipped.append(r.decode_runes(equipped_chunk))
+    chunks = inventory + equipped
+    decoded = {}
+    for key in list(chunks[0]):
+        # free each chunk array as soon as it is copied so only one extra copy of a key is alive
+        decoded[key] = np.concatenate([chunk.pop(key) for chunk in chunks])
+    del chunks, inventory, equipped
+    return r.decoded_runes_to_df(decoded), {'unit_list': unit_list}
+
+def stream_exports(file_path, chunk_size=5000):
+    """
+    Yields (runes_df, data) for each exporter document in the file, so files with
+    several concatenated exports are read one account at a time.
+    """
+    with open(file_path, encoding='utf-8') as f:
+        reader = JsonStreamReader(f)
+        while reader.peek():
+            yield read_export(reader, chunk_size)
+
+def load_export(file_path, chunk_size=5000):
+    """
+    Streams a single exporter file. Returns (runes_df, data) where data only holds 'unit_list'.
+    """
+    return next(stream_exports(file_path, chunk_size))
@@ -1,8 +1,15 @@
 # %%
+import gzip
+import hashlib
+import json
+import os
 import requests
 import socket
+import time
 import urllib3
 import ssl
+import tempfile
+import threading
 
 
 # Test if local port 80 is open
@@ -19,20 +26,171 @@ header = {
     "X-Requested-With": "XMLHttpRequest"
 }
 
+# responses retried with backoff, besides connection errors
+retry_statuses = (429, 500, 502, 503, 504)
+
 class CustomHttpAdapter(requests.adapters.HTTPAdapter):
-    # "Transport adapter" that allows us to use a custom ssl_context.
-    def __init__(self, ssl_context=None, **kwargs):
+    # "Transport adapter" that allows us to use a custom ssl_context and a default timeout.
+    def __init__(self, ssl_context=None, timeout=None, **kwargs):
         self.ssl_context = ssl_context
+        self.timeout = timeout
         super().__init__(**kwargs)
  
     def init_poolmanager(self, connections, maxsize, block=False):
         self.poolmanager = urllib3.poolmanager.PoolManager(
             num_pools=connections, maxsize=maxsize,
             block=block, ssl_context=self.ssl_context)
+
+    def send(self, request, timeout=None, **kwargs):
+        # requests has no session wide timeout, so requests without one get the adapter's
+        return super().send(request, timeout=self.timeout if timeout is None else timeout, **kwargs)
  
-def get_legacy_session():
+def get_legacy_session(pool_maxsize=10, retries=3, backoff_factor=0.5, timeout=(10, 60)):
+    """
+    Returns a new session that allows legacy TLS renegotiation. pool_maxsize is how many connections
+    per host are kept open for reuse, GETs are retried up to retries times on connection errors and
+    retry_statuses, waiting backoff_factor * 2**n seconds, and timeout is (connect, read) seconds.
+    Use shared_session unless the session needs its own connections.
+    """
     ctx = ssl.create_default_context(ssl.Purpose.SERVER_AUTH)
     ctx.options |= 0x4  # OP_LEGACY_SERVER_CONNECT
+    retry = urllib3.util.Retry(total=retries, backoff_factor=backoff_factor, status_forcelist=retry_statuses,
+                               allowed_methods=['GET', 'HEAD'], raise_on_status=False)
     session = requests.session()
-    session.mount('https://', CustomHttpAdapter(ctx))
-    return session
\ No newline at end of file
+    session.mount('https://', CustomHttpAdapter(ctx, timeout=timeout, pool_maxsize=pool_maxsize, max_retries=retry))
+    session.mount('http://', CustomHttpAdapter(timeout=timeout, pool_maxsize=pool_maxsize, max_retries=retry))
+    return session
+
+shared_sessions = {}
+shared_sessions_lock = threading.Lock()
+
+def shared_session(pool_maxsize=10, retries=3, backoff_factor=0.5, timeout=(10, 60)):
+    """
+    Returns this process's session for these get_legacy_session options, created on first use.
+    Its pools keep connections to each host alive and can be used from several threads at once,
+    so only the first requests to a host pay for the TCP and TLS handshakes.
+    """
+    # keyed on the pid too, so a forked worker doesn't reuse its parent's sockets
+    key = (os.getpid(), pool_maxsize, retries, backoff_factor, timeout)
+    with shared_sessions_lock:
+        if key not in shared_sessions:
+            shared_sessions[key] = get_legacy_session(pool_maxsize, retries, backoff_factor, timeout)
+        return shared_sessions[key]
+
+def close_shared_sessions():
+    with shared_sessions_lock:
+        for session in shared_sessions.values():
+            session.close()
+        shared_sessions.clear()
+
+# %% on-disk http cache
+http_cache_dir = os.path.join('cache', 'http')
+
+# seconds a cached response is used without asking the server, by url prefix (longest match wins).
+# older responses are revalidated with a conditional request, urls not listed are always revalidated
+cache_ttls = {
+    'https://swarfarm.com/api/v2/monsters/': 30 * 24 * 3600,
+    'https://godsarmy.garude.de/monsters/': 24 * 3600,
+    'https://godsarmy.garude.de/node/': 24 * 3600,
+}
+
+# with offline_mode on, cached_get only serves from the cache and never touches the network
+offline_mode = os.environ.get('SW_OFFLINE', '') not in ('', '0')
+
+def cache_ttl(url):
+    prefixes = [prefix for prefix in cache_ttls if url.startswith(prefix)]
+    return cache_ttls[max(prefixes, key=len)] if prefixes else 0
+
+def cache_paths(url, cache_dir):
+    key = hashlib.sha256(url.encode()).hexdigest()
+    return os.path.join(cache_dir, key[:2], key + '.json'), os.path.join(cache_dir, key[:2], key + '.gz')
+
+def load_cache_entry(url, cache_dir):
+    meta_path, body_path = cache_paths(url, cache_dir)
+    try:
+        with open(meta_path) as f:
+            entry = json.load(f)
+        with gzip.open(body_path, 'rb') as f:
+            entry['body'] = f.read()
+    except (OSError, ValueError):
+        return None
+    return entry if entry.get('url') == url else None
+
+def save_cache_entry(url, response, cache_dir):
+    meta_path, body_path = cache_paths(url, cache_dir)
+    os.makedirs(os.path.dirname(meta_path), exist_ok=True)
+    entry = {'url': url, 'fetched_at': time.time(), 'etag': response.headers.get('ETag'),
+             'last_modified': response.headers.get('Last-Modified'), 'encoding': response.encoding,
+             'content_type': response.headers.get('Content-Type')}
+    # body first and each file renamed into place, so a half written entry is never read
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(body_path))
+    try:
+        with os.fdopen(fd, 'wb') as raw, gzip.GzipFile(fileobj=raw, mode='wb') as f:
+            f.write(response.content)
+        os.replace(tmp_path, body_path)
+    except BaseException:
+        remove_quietly(tmp_path)
+        raise
+    save_cache_meta(entry, meta_path)
+
+def save_cache_meta(entry, meta_path):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(meta_path))
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump({key: value for key, value in entry.items() if key != 'body'}, f)
+        os.replace(tmp_path, meta_path)
+    except BaseException:
+        remove_quietly(tmp_path)
+        raise
+
+def remove_quietly(path):
+    # temporary files of a failed cache write
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+def cached_response(entry, status_code=200):
+    response = requests.Response()
+    response.status_code = status_code
+    response.url = entry['url']
+    response._content = entry.get('body', b'')
+    response.encoding = entry.get('encoding')
+    if entry.get('content_type'):
+        response.headers['Content-Type'] = entry['content_type']
+    response.from_cache = True
+    return response
+
+def cached_get(session, url, headers=header, ttl=None, cache_dir=None, offline=None):
+    """
+    session.get(url) through the on-disk cache. 200 responses are stored gzip compressed with their
+    ETag, Last-Modified and fetch time. A cached response younger than ttl (cache_ttl(url) by default)
+    is returned without a request, an older one is revalidated with If-None-Match/If-Modified-Since
+    and only downloaded again if the server says it changed.
+    Offline (offline_mode by default) only the cache is used, and a url that isn't cached
+    gets a 504 response, like a request with Cache-Control: only-if-cached.
+    Returned responses have from_cache set when their body came from the cache.
+    """
+    cache_dir = http_cache_dir if cache_dir is None else cache_dir
+    offline = offline_mode if offline is None else offline
+    ttl = cache_ttl(url) if ttl is None else ttl
+    entry = load_cache_entry(url, cache_dir)
+    if entry is not None and (offline or time.time() - entry['fetched_at'] < ttl):
+        return cached_response(entry)
+    if offline:
+        return cached_response({'url': url}, status_code=504)
+
+    conditional = {}
+    if entry is not None and entry.get('etag'):
+        conditional['If-None-Match'] = entry['etag']
+    if entry is not None and entry.get('last_modified'):
+        conditional['If-Modified-Since'] = entry['last_modified']
+    response = session.get(url, headers={**(headers or {}), **conditional})
+    if response.status_code == 304 and entry is not None:
+        entry['fetched_at'] = time.time()
+        save_cache_meta(entry, cache_paths(url, cache_dir)[0])
+        return cached_response(entry)
+    response.from_cache = False
+    if response.status_code == 200:
+        save_cache_entry(url, response, cache_dir)
+    return response
@@ -2,12 +2,17 @@
 import pandas as pd
 import numpy as np
 import os
-import json
 
 import importlib
 import runes as r
 importlib.reload(r)
 import monsters as m
+import export_stream
+importlib.reload(export_stream)
+import export_cache
+importlib.reload(export_cache)
+import export_diff
+importlib.reload(export_diff)
 import monster_rune_pairing
 importlib.reload(monster_rune_pairing)
 from monster_rune_pairing import update_monster_priority,find_best_runes_for_monsters,find_best_monsters_for_all_runes
@@ -17,17 +22,33 @@ from monster_rune_pairing import update_monster_priority,find_best_runes_for_mon
 json_path = 'FractalParadox-35313848.json'
 
 # %% load data
-with open(json_path, encoding='utf-8') as json_data:
-    data = json.load(json_data)
-
-my_monsters = m.load_my_monsters(data)
-runes_df = r.load_runes(data)
-r.check_hero_gem(runes_df)
-runes_df['Total Rolls'] = runes_df[['Rolls ACC','Rolls CD','Rolls CR','Rolls ATK','Rolls DEF','Rolls HP','Rolls RES','Rolls SPD']].sum(axis=1)
-reapp_targets = r.find_reapp_targets(runes_df)
-maxed_runes = r.all_gem_grind_combinations(runes_df)
-
-maxed_runes = r.get_rolls(maxed_runes)
+def build_frames(json_path):
+    # runes are decoded while the file is streamed, data only keeps the unit list
+    runes_df, data = export_stream.load_export(json_path)
+    rune_hashes, unit_hashes = export_diff.rune_hashes(runes_df), export_diff.unit_hashes(data['unit_list'])
+
+    my_monsters = m.load_my_monsters(data)
+    r.check_hero_gem(runes_df)
+    runes_df['Total Rolls'] = runes_df[['Rolls ACC','Rolls CD','Rolls CR','Rolls ATK','Rolls DEF','Rolls HP','Rolls RES','Rolls SPD']].sum(axis=1)
+    reapp_targets = r.find_reapp_targets(runes_df)
+    maxed_runes = r.all_gem_grind_combinations(runes_df)
+
+    maxed_runes = r.get_rolls(maxed_runes)
+    maxed_runes_percentile = r.find_percentiles(maxed_runes.set_index('rune_id'),'New Total Rolls')
+    runes_df['Score'] = export_diff.rune_scores(runes_df)
+    return {'runes_df': runes_df, 'my_monsters': my_monsters, 'reapp_targets': reapp_targets, 'maxed_runes': maxed_runes,
+            'maxed_runes_percentile': maxed_runes_percentile, 'rune_hashes': rune_hashes, 'unit_hashes': unit_hashes}
+
+def update_frames(previous, json_path):
+    runes_df, data = export_stream.load_export(json_path)
+    frames, changes = export_diff.update_frames(previous, runes_df, data)
+    print('Runes added/changed/removed:', *[len(changes['runes'][key]) for key in ['added','changed','removed']])
+    return frames
+
+# reruns on an unchanged export reload the frames from the cache, a new export only recomputes the runes that changed
+frames = export_cache.cached_export(json_path, build_frames, update=update_frames)
+runes_df, my_monsters, reapp_targets, maxed_runes = frames['runes_df'], frames['my_monsters'], frames['reapp_targets'], frames['maxed_runes']
+maxed_runes_percentile = frames['maxed_runes_percentile']
 
 my_monsters['name'] = my_monsters['name'].str.title()
 
@@ -62,7 +83,7 @@ for stat in r.stat_list:
     column_name = 'Base '+stat
     runes_df[stat] = runes_df[column_name]
 
-runes_df['Score'] = runes_df.apply(r.score_rune,axis=1)
+# 'Score' comes with the frames (export_diff.rune_scores) so only changed runes are rescored
 
 # move 'Total Value' and 'Total Rolls' to the front of the dataframe
 column_order_list = ['slot_no','set_id','main_stat_type','Score','SPD','Total Rolls']
@@ -74,25 +95,15 @@ runes_df['Total Rolls'] = runes_df['Total Rolls'] + runes_df['Gemmed'].astype(in
 runes_df = runes_df.drop(columns=r.stat_list)
 
 # find rolls percentile
-maxed_runes_percentile = r.find_percentiles(maxed_runes.set_index('rune_id'),'New Total Rolls')
-
 runes_df['Slot Rolls Percentile'] = maxed_runes_percentile.groupby(maxed_runes_percentile.index)['Slot Percentile'].max()
 runes_df['Set Rolls Percentile'] = maxed_runes_percentile.groupby(maxed_runes_percentile.index)['Set Percentile'].max()
 
-# find spd percentile
-runes_spd_df = runes_df[runes_df['Base SPD']!=0].copy() # Only look at runes with SPD
-runes_spd_percentile = r.find_percentiles(runes_spd_df,'Base SPD')
-runes_spd_percentile = runes_spd_percentile.rename(columns={'Slot Percentile':'Slot SPD Percentile'
-                                                            ,'Set Percentile':'Set SPD Percentile'})
-
-runes_df = runes_df.join(runes_spd_percentile[['Slot SPD Percentile','Set SPD Percentile']])
+# find spd and score percentiles in one pass, runes without SPD are only ranked on score
+percentile_df = runes_df[['slot_no','set_id','main_stat_type','Score']].copy()
+percentile_df['SPD'] = runes_df['Base SPD'].where(runes_df['Base SPD']!=0)
+percentile_index = r.PercentileIndex(percentile_df, ['SPD','Score'])
 
-# find score percentile
-runes_score_percentile = r.find_percentiles(runes_df,'Score')
-runes_score_percentile = runes_score_percentile.rename(columns={'Slot Percentile':'Slot Score Percentile'
-                                                            ,'Set Percentile':'Set Score Percentile'})
-
-runes_df = runes_df.join(runes_score_percentile[['Slot Score Percentile','Set Score Percentile']])
+runes_df = runes_df.join(percentile_index.percentile_frame(percentile_df))
 
 runes_df['Max Slot Percentile'] = runes_df[['Slot Score Percentile','Slot Rolls Percentile','Slot SPD Percentile']].max(axis=1)
 runes_df['Max Set Percentile'] = runes_df[['Set Score Percentile','Set Rolls Percentile','Set SPD Percentile']].max(axis=1)
@@ -153,6 +164,10 @@ gem_targets_df.loc[gem_targets_df['Min Slot Percentile'] < gem_targets_df['Slot
 
 gem_targets_df = gem_targets_df.sort_values(['set_id','Min Slot Percentile','slot_no'],ascending=[True,False,True])
 
+# add the best re-gem option for each rune
+best_gem_options = pd.DataFrame(r.iter_top_gem_options(runes_df, k=1)).set_index('rune_id')
+gem_targets_df = gem_targets_df.join(best_gem_options[['Suggested Gem Out','Suggested Gem In','New Total Rolls']])
+
 # %% export runes_df,monsters_prepared,maxed_runes,best_monsters_for_runes,best_runes_for_monsters to excel
 output_dir_path = os.path.dirname(os.path.abspath(__file__))
 
@@ -180,7 +195,9 @@ r.score_rune(runes_df.loc[61599286895])
 # %%
 
 importlib.reload(r)
-result_df = r.find_runes(runes_df
+# build the index once, then rerun queries against it
+rune_index = r.RuneIndex(runes_df)
+result_df = r.find_runes(rune_index
              ,sets=['VIOLENT','WILL']
              ,slot_2=['SPD']
              ,slot_4=['CD']
@@ -203,5 +220,14 @@ pd.set_option("display.width", 200)         # widen the console printout
 
 print(graded_df[["grade_score"]].head(10))
 
+# %% what-if pairing, each change only repairs the part of the assignment it affects
+pairing_session = monster_rune_pairing.PairingSession(monsters_prepared, maxed_runes)
+best_runes_for_monsters = pairing_session.assignment()
+
+#pairing_session.remove_rune(61599286895)
+#pairing_session.update_monster_weights(monsters_prepared['name'].iloc[0], {'SPD_value': 2})
+#pairing_session.set_priority(monsters_prepared['name'].iloc[5], 0)
+#best_runes_for_monsters = pairing_session.assignment()
+
 
 # %%
@@ -1,4 +1,5 @@
 # %%
+import numpy as np
 import pandas as pd
 
 import runes as r
@@ -15,118 +16,526 @@ slot_to_column_mapping = {
     6: 'most_popular_slot6'
 }
 
-def find_best_runes_for_monster(monster,monsters,runes):
-    monster_preferences = monsters[monsters['name'] == monster['name']].copy()
-    
-    best_runes_for_monster = pd.DataFrame()
-    for slot, column in slot_to_column_mapping.items():
-        # Use all sets for the slot
-        filtered_runes = runes[(runes['slot_no'] == slot)]
-        # Process main sets - matching on both set and main stat
-        sets = off_sets
-        # add main set to sets
-        most_popular_mainset = monster_preferences['most_popular_mainset'].values[0]
-        sets.append(most_popular_mainset)
-
-        sets = filtered_runes[filtered_runes['set_id'].isin(sets)].copy()
-        merged_sets = pd.DataFrame()
-        if column:  # Variable main stat slots
-            merged_sets = sets.merge(monster_preferences
-                                     ,left_on='main_stat_type'
-                                     ,right_on=column
-                                     ,how='inner')
-        else:  # Fixed main stat slots
-            sets['key'] = 1
-            monster_preferences['key'] = 1
-            merged_sets = sets.merge(monster_preferences, on='key', how='inner')
-            sets.drop('key', axis=1, inplace=True)
-            merged_sets.drop('key', axis=1, inplace=True)
-
-        merged_sets['hp_score'] = merged_sets['HP'] * merged_sets['HP_value']
-        merged_sets['atk_score'] = merged_sets['ATK'] * merged_sets['ATK_value']
-        merged_sets['def_score'] = merged_sets['DEF'] * merged_sets['DEF_value']
-        merged_sets['spd_score'] = merged_sets['SPD'] * merged_sets['SPD_value']
-        merged_sets['cr_score'] = merged_sets['CR'] * merged_sets['CR_value']
-        merged_sets['cd_score'] = merged_sets['CD'] * merged_sets['CD_value']
-        merged_sets['acc_score'] = merged_sets['ACC'] * merged_sets['ACC_value']
-        merged_sets['res_score'] = merged_sets['RES'] * merged_sets['RES_value']
-        merged_sets['Total Value'] = merged_sets[['hp_score','atk_score','def_score','spd_score','cr_score','cd_score','acc_score','res_score']].sum(axis=1)
-
-        #keep only the highest value rune from the main set and 1 from off_sets
-        best_main_set_rune = merged_sets[merged_sets['set_id']==most_popular_mainset].sort_values('Total Value',ascending=False).head(1)
-        best_runes_for_monster = pd.concat([best_runes_for_monster, best_main_set_rune])
-
-        best_main_set_rune = merged_sets[merged_sets['set_id'].isin(off_sets)].sort_values('Total Value',ascending=False).head(1)
-        best_runes_for_monster = pd.concat([best_runes_for_monster, best_main_set_rune])
-
-        # Process off_sets - matching only on main stat
-    best_runes_for_monster = best_runes_for_monster.drop(columns=['key'])
-    return best_runes_for_monster
-
-# this function is terrible and needs to be re-written
-def find_best_runes_for_monsters(monsters,runes):
-    # create an empty dataframe based on runes
-    used_runes = runes.head(0).copy()
+stat_value_columns = [stat+'_value' for stat in stat_list]
+score_columns = ['hp_score','atk_score','def_score','spd_score','cr_score','cd_score','acc_score','res_score']
+
+class PairingMatrix:
+    """
+    Shared scoring core for both pairing directions.
+    Rune stats are stacked into an (n_runes x 8) matrix and the monsters' *_value weights
+    into an (n_monsters x 8) matrix, so values(rows) @ gives every rune's 'Total Value'
+    for every monster in one matrix multiply. Slot/main stat and set eligibility are
+    (n_runes x n_monsters) boolean masks, and rows/columns are positions in self.runes
+    and self.monsters.
+    """
+
+    def __init__(self, runes, monsters):
+        self.runes = r.as_runes_df(runes, ['rune_id','slot_no','set_id','main_stat_type'] + stat_list, index=False).reset_index(drop=True)
+        self.monsters = monsters.reset_index(drop=True)
+        self.stats = self.runes[stat_list].fillna(0).to_numpy(dtype=float)
+        self.weights = self.monsters[stat_value_columns].fillna(0).to_numpy(dtype=float)
+        self.slot_no = self.runes['slot_no'].to_numpy()
+        self.set_id = self.runes['set_id'].to_numpy()
+        self.main_stat_type = self.runes['main_stat_type'].to_numpy()
+        self.mainset = self.monsters['most_popular_mainset'].to_numpy()
+        self.is_off_set = self.runes['set_id'].isin(off_sets).to_numpy()
+        self.is_main_set_rune = self.runes['set_id'].isin(main_sets).to_numpy()
+        # integer codes so the (n_runes x n_monsters) masks compare ints instead of strings,
+        # missing values are -1 for runes and -2 for monsters so they never match like NaN
+        set_codes = pd.factorize(np.concatenate([self.set_id, self.mainset]))[0]
+        self.set_codes, self.mainset_codes = set_codes[:len(self.set_id)], set_codes[len(self.set_id):]
+        self.mainset_codes[self.mainset_codes == -1] = -2
+        slot_columns = [column for column in slot_to_column_mapping.values() if column]
+        main_codes = pd.factorize(np.concatenate([self.main_stat_type] + [self.monsters[column].to_numpy() for column in slot_columns]))[0]
+        self.main_codes = main_codes[:len(self.main_stat_type)]
+        monster_main_codes = main_codes[len(self.main_stat_type):]
+        monster_main_codes[monster_main_codes == -1] = -2
+        self.slot_main_codes = dict(zip(slot_columns, monster_main_codes.reshape(len(slot_columns), -1)))
+
+    def values(self, rows=slice(None), columns=slice(None)):
+        """
+        Returns the (rows x columns) matrix of Total Value.
+        """
+        return self.stats[rows] @ self.weights[columns].T
+
+    def main_stat_ok(self, rows=slice(None), columns=slice(None)):
+        """
+        Returns whether each rune's main stat is the one the monster wants for the rune's slot.
+        Slots 1, 3 and 5 have fixed main stats and always match.
+        """
+        slot_no, main_codes = self.slot_no[rows], self.main_codes[rows]
+        mask = np.ones((len(slot_no), len(self.monsters.index[columns])), dtype=bool)
+        for slot, column in slot_to_column_mapping.items():
+            if column:
+                in_slot = slot_no == slot
+                mask[in_slot] = main_codes[in_slot, None] == self.slot_main_codes[column][columns][None, :]
+        return mask
+
+    def same_set(self, rows=slice(None), columns=slice(None)):
+        # rune set is the monster's main set
+        return self.set_codes[rows, None] == self.mainset_codes[columns][None, :]
+
+    def monster_eligible(self, rows=slice(None), columns=slice(None)):
+        """
+        Which monsters a rune can go to when pairing runes to monsters: the slot's main stat
+        has to match, main set runes only go to monsters using that set, and runes for the
+        fixed main stat slots only go to monsters whose main set they are.
+        """
+        same_set = self.same_set(rows, columns)
+        fixed_slot = np.array([slot_to_column_mapping[slot] is None for slot in self.slot_no[rows]], dtype=bool)
+        eligible = self.main_stat_ok(rows, columns)
+        eligible &= ~self.is_main_set_rune[rows, None] | same_set
+        eligible &= ~fixed_slot[:, None] | same_set
+        return eligible
+
+    def pair_frame(self, rows, columns, fill_stats=False):
+        """
+        Returns one row per (rune, monster) pair with the rune's and monster's columns,
+        the per stat *_score columns and 'Total Value', like the cross-join merge did.
+        """
+        runes = self.runes.iloc[rows].reset_index(drop=True)
+        if fill_stats:
+            runes[stat_list] = runes[stat_list].fillna(0)
+        monsters = self.monsters.iloc[columns].reset_index(drop=True)
+        pairs = pd.concat([runes, monsters], axis=1)
+        for stat, score_column in zip(stat_list, score_columns):
+            pairs[score_column] = pairs[stat] * pairs[stat+'_value']
+        pairs['Total Value'] = pairs[score_columns].sum(axis=1)
+        return pairs
+
+def best_pair(values, mask):
+    # position of the highest value allowed by the mask, None if nothing is allowed
+    values = np.where(mask, values, -np.inf)
+    if not mask.any():
+        return None
+    return np.unravel_index(np.argmax(values), values.shape)
+
+def find_best_runes_for_monster(monster,monsters,runes,pairing=None,available=None):
+    """
+    Returns the best main set rune and the best off set rune of every slot for the monster.
+    When the main set is itself an off set, the off set rune comes from the other off sets,
+    so the two picks are never the same rune. pairing is a PairingMatrix of runes and monsters to reuse, and available an optional
+    boolean mask of the pairing's runes that can still be used.
+    """
+    if pairing is None:
+        pairing = PairingMatrix(runes, monsters)
+    columns = np.flatnonzero(pairing.monsters['name'].to_numpy() == monster['name'])
+    most_popular_mainset = pairing.mainset[columns[0]]
+    available = np.ones(len(pairing.runes), dtype=bool) if available is None else available
+
+    rows, best_columns = [], []
+    for slot in slot_to_column_mapping:
+        slot_rows = np.flatnonzero((pairing.slot_no == slot) & available)
+        values = pairing.values(slot_rows, columns)
+        eligible = pairing.main_stat_ok(slot_rows, columns)
+        #keep only the highest value rune from the main set and 1 from the other off_sets
+        main_set = pairing.set_id[slot_rows] == most_popular_mainset
+        for set_mask in [main_set, pairing.is_off_set[slot_rows] & ~main_set]:
+            best = best_pair(values, eligible & set_mask[:, None])
+            if best is not None:
+                rows.append(slot_rows[best[0]])
+                best_columns.append(columns[best[1]])
+    return pairing.pair_frame(rows, best_columns)
+
+def find_best_runes_for_monsters(monsters,runes,verbose=True):
+    """
+    Greedily gives each monster, in order, its best runes among the ones not used yet.
+    All monsters are scored against all runes once with a PairingMatrix.
+    See assign_runes_to_monsters for an assignment that doesn't depend on the order.
+    """
+    pairing = PairingMatrix(runes, monsters)
+    available = np.ones(len(pairing.runes), dtype=bool)
+    rune_ids = pairing.runes['rune_id'].to_numpy()
     results = []
     counter = 0
     for index,monster_row in monsters.iterrows():
         counter += 1
-        print(monster_row['name'],counter,'of',len(monsters))
+        if verbose:
+            print(monster_row['name'],counter,'of',len(monsters))
         #find best runes for monster excluding runes already used
-        best_runes_for_monster = find_best_runes_for_monster(monster_row
-                                                             ,monsters
-                                                             ,runes[~runes['rune_id'].isin(used_runes['rune_id'])])
+        best_runes_for_monster = find_best_runes_for_monster(monster_row, monsters, runes, pairing=pairing, available=available)
+        best_runes_for_monster['priority'] = counter - 1
         results.append(best_runes_for_monster)
-        #add best runes to used_runes
-        used_runes = pd.concat([used_runes.infer_objects(),best_runes_for_monster.infer_objects()])
-        #infer_objects fixes a weird bug with pandas version 1.5 (https://stackoverflow.com/questions/73800841/add-series-as-a-new-row-into-dataframe-triggers-futurewarning)
+        available &= ~np.isin(rune_ids, best_runes_for_monster['rune_id'].to_numpy())
 
     return pd.concat(results)
 
-def find_best_monster_for_rune(rune,monsters):
-    
-    #fill HP, ATK, DEF, SPD, CR, CD, ACC, RES with 0 if they are nan
-    rune[r.stat_list] = rune[r.stat_list].fillna(0)
-
-    # if the rune is in main_sets rune, then only consider monsters that have the same main set
-    if rune['set_id'].values[0] in main_sets:
-        monsters = monsters[monsters['most_popular_mainset'] == rune['set_id'].values[0]].copy()        
-
-    column = slot_to_column_mapping[rune['slot_no'].values[0]]
-    if column:
-        monsters = monsters[monsters[column] == rune['main_stat_type'].values[0]].copy()
-    else:
-        monsters = monsters[monsters['most_popular_mainset'] == rune['set_id'].values[0]].copy()
-
-    rune['key'] = 1
-    monsters['key'] = 1
-    rune = rune.merge(monsters,on='key',how='inner')
-
-    rune['hp_score'] = rune['HP'] * rune['HP_value']
-    rune['atk_score'] = rune['ATK'] * rune['ATK_value']
-    rune['def_score'] = rune['DEF'] * rune['DEF_value']
-    rune['spd_score'] = rune['SPD'] * rune['SPD_value']
-    rune['cr_score'] = rune['CR'] * rune['CR_value']
-    rune['cd_score'] = rune['CD'] * rune['CD_value']
-    rune['acc_score'] = rune['ACC'] * rune['ACC_value']
-    rune['res_score'] = rune['RES'] * rune['RES_value']
-    rune['Total Value'] = rune[['hp_score','atk_score','def_score','spd_score','cr_score','cd_score','acc_score','res_score']].sum(axis=1)
-    rune = rune.sort_values('Total Value',ascending=False)
-
-    rune = rune.drop(columns=['key'])
-    
-    return rune.head(1)
+# %% pairing session
+class PairingSession:
+    """
+    Keeps find_best_runes_for_monsters' greedy assignment up to date as runes and monsters change.
 
-def find_best_monsters_for_all_runes(maxed_runes,monsters):
-    rune_list = maxed_runes['rune_id'].drop_duplicates().tolist()
-    results = []
-    counter = 0
-    for rune in rune_list:
-        counter += 1
-        print(rune,counter,'of',len(rune_list))
-        rune_copy = maxed_runes[maxed_runes['rune_id'] == rune].copy()
-        results.append(find_best_monster_for_rune(rune_copy,monsters))
-    return pd.concat(results)
+    For every monster and every (slot, 'main'/'off') pick, the rows of the runes it could use are
+    kept sorted best first, so a pick is the first row whose rune isn't held by a higher priority
+    monster. After a change only the picks whose candidate lists contain a rune whose holder
+    changed are looked at again, walking the monsters in priority order so a rune taken from a
+    lower priority monster is passed on to its next best candidate.
+
+    Monsters are identified by name. assignment() returns the same frame as
+    find_best_runes_for_monsters(monsters_in_priority_order, runes).
+    """
+
+    def __init__(self, monsters, runes):
+        self.monsters = monsters.reset_index(drop=True)
+        self.runes = r.as_runes_df(runes, ['rune_id','slot_no','set_id','main_stat_type'] + stat_list, index=False).reset_index(drop=True)
+        self.order = list(range(len(self.monsters)))
+        self.rebuild_pairing()
+        self.removed = set()
+        self.holder = {}  # rune_id -> monster column holding it
+        self.picks = [{} for _ in self.order]  # monster column -> {(slot, kind): row}
+        self.candidates = [self.monster_candidates(column) for column in self.order]
+        self.candidate_ids = [self.rune_id_sets(candidates) for candidates in self.candidates]
+        self.repair(force=set(self.order))
+
+    def rebuild_pairing(self):
+        self.pairing = PairingMatrix(self.runes, self.monsters)
+        self.rune_ids = self.pairing.runes['rune_id'].to_numpy()
+        self.rank = np.empty(len(self.order), dtype=int)
+        self.rank[self.order] = np.arange(len(self.order))
+
+    def column(self, name):
+        return int(np.flatnonzero(self.monsters['name'].to_numpy() == name)[0])
+
+    def monster_candidates(self, column, rows=None):
+        """
+        Returns {(slot, kind): rows sorted by Total Value, ties to the earlier row} for a monster,
+        with the same main set and off set rules as find_best_runes_for_monster.
+        """
+        rows = np.arange(len(self.pairing.runes)) if rows is None else rows
+        values = self.pairing.values(rows, [column])[:, 0]
+        main_ok = self.pairing.main_stat_ok(rows, [column])[:, 0]
+        main_set = self.pairing.set_id[rows] == self.pairing.mainset[column]
+        set_masks = {'main': main_set, 'off': self.pairing.is_off_set[rows] & ~main_set}
+        candidates = {}
+        for slot in slot_to_column_mapping:
+            in_slot = main_ok & (self.pairing.slot_no[rows] == slot)
+            for kind, set_mask in set_masks.items():
+                positions = np.flatnonzero(in_slot & set_mask)
+                candidates[(slot, kind)] = rows[positions[np.lexsort((positions, -values[positions]))]]
+        return candidates
+
+    def rune_id_sets(self, candidates):
+        # rune_ids of each candidate list, to check quickly whether a change touches it
+        return {key: set(self.rune_ids[rows]) for key, rows in candidates.items()}
+
+    def available(self, row, column):
+        # a rune is free for a monster when it isn't held by a higher priority monster
+        rune_id = self.rune_ids[row]
+        if rune_id in self.removed:
+            return False
+        holder = self.holder.get(rune_id)
+        return holder is None or self.rank[holder] >= self.rank[column]
+
+    def repair(self, changed=(), force=()):
+        """
+        Brings the picks up to date after the holders of the changed rune_ids changed, recomputing
+        every pick of the monsters in force. Returns the rune_ids whose holder changed.
+        """
+        changed = set(changed)
+        force = set(force)
+        for column in self.order:
+            if column not in force and not changed:
+                continue
+            picks = self.picks[column]
+            for key, rows in self.candidates[column].items():
+                if column not in force and changed.isdisjoint(self.candidate_ids[column][key]):
+                    continue
+                old = picks.get(key)
+                new = next((row for row in rows if self.available(row, column)), None)
+                if new == old:
+                    continue
+                if new is None:
+                    del picks[key]
+                else:
+                    picks[key] = new
+                held = {self.rune_ids[row] for row in picks.values()}
+                if old is not None and self.rune_ids[old] not in held and self.holder.get(self.rune_ids[old]) == column:
+                    del self.holder[self.rune_ids[old]]
+                    changed.add(self.rune_ids[old])
+                if new is not None and self.holder.get(self.rune_ids[new]) != column:
+                    self.holder[self.rune_ids[new]] = column
+                    changed.add(self.rune_ids[new])
+        return changed
+
+    def add_rune(self, rune):
+        """
+        Adds runes (a DataFrame, or one rune as a Series or dictionary) and repairs the assignment.
+        """
+        new_runes = r.as_runes_df(rune, index=False)
+        if not isinstance(new_runes, pd.DataFrame):
+            new_runes = pd.DataFrame([rune])
+        start = len(self.runes)
+        self.runes = pd.concat([self.runes, new_runes], ignore_index=True)
+        self.rebuild_pairing()
+        rows = np.arange(start, len(self.runes))
+        for column in self.order:
+            added = self.monster_candidates(column, rows)
+            for key, old_rows in self.candidates[column].items():
+                if len(added[key]):
+                    # new rows come last, so they go after existing rows of the same value
+                    merged = np.concatenate([old_rows, added[key]])
+                    values = self.pairing.values(merged, [column])[:, 0]
+                    self.candidates[column][key] = merged[np.lexsort((merged, -values))]
+            self.candidate_ids[column] = self.rune_id_sets(self.candidates[column])
+        self.removed.difference_update(self.rune_ids[rows])
+        return self.repair(changed=self.rune_ids[rows])
+
+    def remove_rune(self, rune_id):
+        """
+        Removes a rune (all its rows) from the pool and repairs the assignment.
+        """
+        self.removed.add(rune_id)
+        self.holder.pop(rune_id, None)
+        return self.repair(changed=[rune_id])
+
+    def update_monster_weights(self, name, weights):
+        """
+        Changes some of a monster's *_value weights, e.g. {'SPD_value': 2}, and repairs the assignment.
+        """
+        column = self.column(name)
+        for weight_column, value in weights.items():
+            self.monsters.loc[column, weight_column] = value
+        self.rebuild_pairing()
+        self.candidates[column] = self.monster_candidates(column)
+        self.candidate_ids[column] = self.rune_id_sets(self.candidates[column])
+        return self.repair(force=[column])
+
+    def set_priority(self, name, priority):
+        """
+        Moves a monster to position priority (0 is first) and repairs the assignment.
+        """
+        column = self.column(name)
+        self.order.remove(column)
+        self.order.insert(priority, column)
+        self.rank[self.order] = np.arange(len(self.order))
+        # the monster's runes may now go to monsters it moved behind
+        return self.repair(changed={self.rune_ids[row] for row in self.picks[column].values()}, force=[column])
+
+    def assignment(self):
+        """
+        Returns the current picks in the layout of find_best_runes_for_monsters.
+        """
+        results = []
+        for priority, column in enumerate(self.order):
+            picks = self.picks[column]
+            rows = [picks[key] for key in self.candidates[column] if key in picks]
+            pairs = self.pairing.pair_frame(rows, [column] * len(rows))
+            pairs['priority'] = priority
+            results.append(pairs)
+        return pd.concat(results)
+
+# %% optimal assignment
+def solve_assignment(cost):
+    """
+    Minimum cost assignment of every row of an (n_rows x n_cols) cost matrix, n_rows <= n_cols,
+    to a different column. Shortest augmenting path method (Jonker-Volgenant), adding one row
+    at a time with Dijkstra over reduced costs, each step vectorized over the columns.
+    Returns the column assigned to each row.
+    """
+    n_rows, n_cols = cost.shape
+    u = np.zeros(n_rows)
+    v = np.zeros(n_cols)
+    col_for_row = np.full(n_rows, -1)
+    row_for_col = np.full(n_cols, -1)
+    all_rows = np.arange(n_rows)
+
+    for current_row in range(n_rows):
+        shortest = np.full(n_cols, np.inf)
+        path = np.full(n_cols, -1)
+        visited_rows = np.zeros(n_rows, dtype=bool)
+        visited_cols = np.zeros(n_cols, dtype=bool)
+        min_value = 0.0
+        row = current_row
+        sink = -1
+        while sink == -1:
+            visited_rows[row] = True
+            reduced = min_value + cost[row] - u[row] - v
+            improved = ~visited_cols & (reduced < shortest)
+            shortest[improved] = reduced[improved]
+            path[improved] = row
+
+            candidates = np.where(visited_cols, np.inf, shortest)
+            col = int(np.argmin(candidates))
+            min_value = candidates[col]
+            if not np.isfinite(min_value):
+                raise ValueError('No feasible assignment')
+            visited_cols[col] = True
+            if row_for_col[col] == -1:
+                sink = col
+            else:
+                row = row_for_col[col]
+
+        # update the dual variables
+        u[current_row] += min_value
+        moved = visited_rows & (all_rows != current_row)
+        u[moved] += min_value - shortest[col_for_row[moved]]
+        v[visited_cols] -= min_value - shortest[visited_cols]
+
+        # augment along the path back to the current row
+        col = sink
+        while True:
+            row = path[col]
+            row_for_col[col] = row
+            col_for_row[row], col = col, col_for_row[row]
+            if row == current_row:
+                break
+
+    return col_for_row
+
+def priority_weights(n_monsters, priority_strength=1.0):
+    # the first monster's runes count (1 + priority_strength) times as much as the last monster's
+    if n_monsters < 2:
+        return np.ones(n_monsters)
+    return 1 + priority_strength * (n_monsters - 1 - np.arange(n_monsters)) / (n_monsters - 1)
+
+def assign_runes_to_monsters(monsters,runes,priority_strength=1.0):
+    """
+    Globally optimal version of find_best_runes_for_monsters.
+    Every monster has a main set position and an off set position per slot, like the greedy
+    pairing, and each rune goes to at most one position. The total of Total Value x monster
+    priority weight (monsters earlier in the frame weigh more, see priority_weights) is
+    maximized as a weighted bipartite matching, split into independent problems per slot:
+    one per main set that isn't an off set, and one for the off set runes, which fill every
+    monster's off set position and the main set positions of monsters whose main set is an
+    off set (a REVENGE rune goes to a REVENGE monster's main set or to another monster's
+    off set, never both).
+
+    Returns the chosen pairs in the same layout as find_best_runes_for_monsters.
+    """
+    pairing = PairingMatrix(runes, monsters)
+    weights = priority_weights(len(pairing.monsters), priority_strength)
+    all_columns = np.arange(len(pairing.monsters))
+    mainset_is_off_set = np.isin(pairing.mainset, off_sets)
+    rows, columns = [], []
+
+    for slot in slot_to_column_mapping:
+        in_slot = pairing.slot_no == slot
+        # (rune rows, monsters with a main set position, monsters with an off set position)
+        problems = [(np.flatnonzero(in_slot & pairing.is_off_set), np.flatnonzero(mainset_is_off_set), all_columns)]
+        for main_set in pd.unique(pairing.mainset[~mainset_is_off_set]):
+            problems.append((np.flatnonzero(in_slot & (pairing.set_id == main_set)), np.flatnonzero(pairing.mainset == main_set), all_columns[:0]))
+
+        for rune_rows, main_columns, off_columns in problems:
+            position_columns = np.concatenate([main_columns, off_columns])
+            if not len(rune_rows) or not len(position_columns):
+                continue
+            value = pairing.values(rune_rows, position_columns) * weights[position_columns]
+            same_set = pairing.same_set(rune_rows, position_columns)
+            is_main_position = np.arange(len(position_columns)) < len(main_columns)
+            eligible = pairing.main_stat_ok(rune_rows, position_columns) & (value > 0) & (same_set == is_main_position)
+            keep = eligible.any(axis=1)
+            rune_rows, value, eligible = rune_rows[keep], value[keep], eligible[keep]
+            if not len(rune_rows):
+                continue
+
+            # positions are the rows, every position can also stay empty (a 0 cost dummy column)
+            cost = np.where(eligible, -value, 1.0).T
+            cost = np.hstack([cost, np.zeros((len(position_columns), len(position_columns)))])
+            assigned = solve_assignment(cost)
+            for position, rune in enumerate(assigned):
+                if rune < len(rune_rows) and eligible[rune, position]:
+                    rows.append(rune_rows[rune])
+                    columns.append(position_columns[position])
+
+    assignment = pairing.pair_frame(rows, columns)
+    assignment['priority'] = columns
+    return assignment.sort_values(['priority','slot_no'], kind='stable').reset_index(drop=True)
+
+def compare_assignments(monsters,runes,priority_strength=1.0):
+    """
+    Runs the greedy find_best_runes_for_monsters and assign_runes_to_monsters on the same
+    monsters and runes. Returns both assignments and a summary of their total Total Value
+    and priority weighted value.
+    """
+    greedy = find_best_runes_for_monsters(monsters, runes, verbose=False).reset_index(drop=True)
+    optimal = assign_runes_to_monsters(monsters, runes, priority_strength)
+    weights = priority_weights(len(monsters), priority_strength)
+
+    summary = pd.DataFrame({
+        'runes used': [len(greedy), len(optimal)],
+        'Total Value': [greedy['Total Value'].sum(), optimal['Total Value'].sum()],
+        'Weighted Value': [(greedy['Total Value'] * weights[greedy['priority']]).sum(),
+                           (optimal['Total Value'] * weights[optimal['priority']]).sum()],
+    }, index=['greedy','optimal'])
+    summary.loc['improvement'] = summary.loc['optimal'] / summary.loc['greedy'] - 1
+    return greedy, optimal, summary
+
+def find_best_monster_for_rune(rune,monsters,pairing=None,rows=None):
+    """
+    Returns the best (gem option, monster) pair for a rune's rows of maxed_runes.
+    pairing is a PairingMatrix to reuse, with rows the positions of the rune's options in it.
+    """
+    if pairing is None:
+        pairing = PairingMatrix(rune, monsters)
+        rows = np.arange(len(pairing.runes))
+
+    best = best_pair(pairing.values(rows), pairing.monster_eligible(rows))
+    if best is None:
+        return pairing.pair_frame([], [], fill_stats=True)
+    return pairing.pair_frame([rows[best[0]]], [best[1]], fill_stats=True)
+
+def top_monsters(values, tie_rows, top_k):
+    """
+    Returns the top_k monster columns of each row of an (n x n_monsters) value matrix, best first.
+    Ties go to the lower tie_rows value, then to the earlier monster.
+    """
+    monster_columns = np.broadcast_to(np.arange(values.shape[1]), values.shape)
+    order = np.lexsort((monster_columns, tie_rows, -values), axis=-1)
+    return order[:, :top_k]
+
+def find_best_monsters_for_all_runes(maxed_runes,monsters,top_k=1,per_option=False,chunk_rows=20000):
+    """
+    Returns the best monsters for every rune of maxed_runes in one pass.
+    Rows are sorted by rune_id once so each rune's gem/grind options are a contiguous block,
+    and blocks of runes are scored against every monster with one matrix multiply. For each
+    rune the top_k monsters are kept with the option that suits each of them best (with
+    top_k=1 this is the same pair as find_best_monster_for_rune). With per_option=True the
+    top_k monsters are kept for every option instead.
+
+    Returns one row per pair in the layout of find_best_monster_for_rune with a 'rank'
+    column (0 is the best), ordered by rune_id.
+    """
+    pairing = PairingMatrix(maxed_runes, monsters)
+    order = np.argsort(pairing.runes['rune_id'].to_numpy(), kind='stable')
+    rune_ids = pairing.runes['rune_id'].to_numpy()[order]
+    starts = np.flatnonzero(np.r_[True, rune_ids[1:] != rune_ids[:-1]])
+    ends = np.r_[starts[1:], len(order)]
+    top_k = min(top_k, len(pairing.monsters))
+
+    pair_rows, pair_columns, ranks = [], [], []
+    first_rune = 0
+    while first_rune < len(starts):
+        # whole runes, about chunk_rows options at a time
+        last_rune = max(first_rune + 1, np.searchsorted(starts, starts[first_rune] + chunk_rows))
+        rows = order[starts[first_rune]:ends[last_rune - 1]]
+        values = np.where(pairing.monster_eligible(rows), pairing.values(rows), -np.inf)
+        positions = np.arange(len(rows))
+
+        if per_option:
+            best_rows = np.broadcast_to(positions[:, None], values.shape)
+        else:
+            # each monster's best option of each rune, ties go to the earliest option
+            block_starts = starts[first_rune:last_rune] - starts[first_rune]
+            block_sizes = np.diff(np.r_[block_starts, len(rows)])
+            best_values = np.maximum.reduceat(values, block_starts, axis=0)
+            is_best = values == np.repeat(best_values, block_sizes, axis=0)
+            best_rows = np.minimum.reduceat(np.where(is_best, positions[:, None], len(rows)), block_starts, axis=0)
+            values = best_values
+
+        top = top_monsters(values, best_rows, top_k)
+        top_values = np.take_along_axis(values, top, axis=1)
+        top_rows = np.take_along_axis(best_rows, top, axis=1)
+        found = np.isfinite(top_values)
+        pair_rows.append(rows[top_rows[found]])
+        pair_columns.append(top[found])
+        ranks.append(np.broadcast_to(np.arange(top_k), top.shape)[found])
+        first_rune = last_rune
+
+    pair_rows = np.concatenate(pair_rows) if pair_rows else np.zeros(0, dtype=int)
+    pair_columns = np.concatenate(pair_columns) if pair_columns else np.zeros(0, dtype=int)
+    pairs = pairing.pair_frame(pair_rows, pair_columns, fill_stats=True)
+    pairs['rank'] = np.concatenate(ranks) if ranks else np.zeros(0, dtype=int)
+    return pairs
 
 def update_monster_priority(my_monsters):
     monster_priority = pd.read_csv('monster_priority.csv')
@@ -2,6 +2,7 @@
 import os
 import pandas as pd
 import stat_distribution
+import player_store
 from stat_distribution import (
     load_data,
     load_set_bonuses,
@@ -36,15 +37,16 @@ def analyze_monster(monster_name):
     """
     print(f"=== Analyzing {monster_name} ===")
     
-    # Get monster list from SWARFARM and search for the monster.
-    monster_data = sa.find_monster_by_name(all_monsters, monster_name)
+    # Look the monster up in the SWARFARM catalog.
+    monster_data = sa.get_catalog().find(monster_name)
     if not monster_data:
         print(f"Monster {monster_name} not found in SWARFARM API data.")
-    else:
-        print("Monster Details:")
-        print(f"  ID: {monster_data['id']}")
-        print(f"  Element: {monster_data.get('element', 'N/A')}")
-        print(f"  Archetype: {monster_data.get('archetype', 'N/A')}")
+        return
+    print("Monster Details:")
+    print(f"  ID: {monster_data['id']}")
+    print(f"  Element: {monster_data.get('element', 'N/A')}")
+    print(f"  Archetype: {monster_data.get('archetype', 'N/A')}")
+    base_stats = sa.monster_base_stats(monster_data)
     
     # Load the player data CSV for the monster.
     df = get_monster_player_data(monster_name)
@@ -68,20 +70,40 @@ def analyze_monster(monster_name):
     print(avg_distribution_df)
     print("=" * 60 + "\n")
 
+def roster_base_stats(catalog, player_dir='player_data', store_dir=None):
+    """
+    Maps each player data CSV (file name without .csv), or each monster in the player_store
+    at store_dir, to its monster's base stats from the swarfarm_api.MonsterCatalog.
+    """
+    file_monsters = {file_name.lower(): name for name, file_name in monster_file_names.items()}
+    file_names = player_store.stored_monsters(store_dir) if store_dir else stat_distribution.player_data_files(player_dir)
+    base_stats = {}
+    for file_name in file_names:
+        name = file_monsters.get(file_name.lower(), file_name.replace('_', ' '))
+        monster_base_stats = catalog.base_stats_of(name)
+        if monster_base_stats:
+            base_stats[file_name] = monster_base_stats
+    return base_stats
+
+def analyze_all_monsters(player_dir='player_data', processes=None, store_dir=None):
+    """
+    Runs the substat roll distribution analysis for every monster in player_dir (or in the
+    player_store at store_dir) on a process pool, reusing cached results for unchanged data.
+    See stat_distribution.analyze_roster.
+    """
+    current_path = os.path.dirname(os.path.abspath(__file__))
+    base_stats = roster_base_stats(sa.get_catalog(), player_dir, store_dir)
+    return stat_distribution.analyze_roster(base_stats, player_dir=player_dir, processes=processes, store_dir=store_dir,
+                                            set_bonus_file=os.path.join(current_path, 'set_bonuses.csv'))
+
 def load_my_monsters(data):
     """
     Loads the player's monster data and maps monster IDs to names using SWARFARM API.
     """
     my_monsters = pd.DataFrame.from_dict(data['unit_list'])
     
-    # Fetch all monsters from SWARFARM API
-    all_monsters = sa.get_all_monsters()
-    
-    # Create a mapping from unit_master_id to name
-    monster_id_to_name = {monster['com2us_id']: monster['name'].lower() for monster in all_monsters}
-    
-    # Map names using the dictionary
-    my_monsters['name'] = my_monsters['unit_master_id'].map(monster_id_to_name).str.lower()
+    # Map unit_master_id (the com2us id) to names with the SWARFARM catalog
+    my_monsters['name'] = sa.get_catalog().names_for_com2us_ids(my_monsters['unit_master_id'])
     
     # Load additional monster summaries
     monster_summaries = pd.read_csv('monster_summaries.csv')
@@ -200,6 +222,5 @@ def main():
         analyze_monster(monster)
 
 if __name__ == "__main__":
-    all_monsters = sa.get_all_monsters()
     main()
 # %%
\ No newline at end of file
@@ -0,0 +1,253 @@
+# %%
+import json
+import os
+import shutil
+import tempfile
+import uuid
+
+import numpy as np
+import pandas as pd
+
+import export_cache
+
+# One dataset for every monster's scraped player data (pulldown.get_player_data), partitioned by monster.
+# Rows live in segments saved with export_cache.save_frame, one .npy file per column. manifest.json maps
+# every monster to its parts: a row range of a segment plus the part's Data Age range, so reads only
+# touch the columns and row ranges that can match. Appends write a new segment, compact() rewrites
+# every live part into one segment ordered by monster, so a roster-wide read is one range per column.
+
+STORE_FORMAT_VERSION = 1
+
+stat_columns = ['HP', 'ATK', 'DEF', 'SPD', 'CR', 'CD', 'ACC', 'RES']
+categorical_columns = ['Set1', 'Set2', 'Set3', 'Slot2', 'Slot4', 'Slot6']
+
+# the store is compacted when an append leaves it with more segments than this
+max_segments = 64
+
+def read_player_csv(file_path):
+    """
+    Loads a player data CSV into a pandas DataFrame.
+    Attempts several delimiters.
+    """
+    try:
+        df = pd.read_csv(file_path, sep=",")
+    except pd.errors.ParserError:
+        try:
+            df = pd.read_csv(file_path, sep=r'\s+', engine='python')
+        except pd.errors.ParserError:
+            df = pd.read_csv(file_path, sep=";")
+    return df
+
+def normalize_player_data(df):
+    """
+    Returns a copy of df with the store's column types: int stats, numeric Score,
+    categorical sets and slots and a datetime Data Age.
+    """
+    df = df.reset_index(drop=True)
+    for stat in stat_columns:
+        if stat in df.columns and df[stat].dtype != 'int32':
+            df[stat] = pd.to_numeric(df[stat], errors='coerce').fillna(0).astype('int32')
+    if 'Score' in df.columns:
+        df['Score'] = pd.to_numeric(df['Score'], errors='coerce')
+    for col in categorical_columns:
+        if col in df.columns:
+            df[col] = df[col].astype('category')
+    if 'Data Age' in df.columns:
+        df['Data Age'] = pd.to_datetime(df['Data Age'], errors='coerce')
+    return df
+
+# %% manifest
+def load_manifest(store_dir='player_store'):
+    path = os.path.join(store_dir, 'manifest.json')
+    if not os.path.exists(path):
+        return {'version': STORE_FORMAT_VERSION, 'segments': {}, 'monsters': {}}
+    with open(path) as f:
+        manifest = json.load(f)
+    if manifest.get('version') != STORE_FORMAT_VERSION:
+        raise ValueError(f"{store_dir} was written with store format {manifest.get('version')}, expected {STORE_FORMAT_VERSION}")
+    return manifest
+
+def save_manifest(manifest, store_dir='player_store'):
+    """
+    Writes the manifest (through a temporary file, so readers never see half of it)
+    and removes the segments it no longer references.
+    """
+    used = {part['segment'] for parts in manifest['monsters'].values() for part in parts}
+    manifest['segments'] = {segment: rows for segment, rows in manifest['segments'].items() if segment in used}
+    fd, tmp_path = tempfile.mkstemp(dir=store_dir, suffix='.json')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, os.path.join(store_dir, 'manifest.json'))
+    segment_dir = os.path.join(store_dir, 'segments')
+    for name in os.listdir(segment_dir) if os.path.isdir(segment_dir) else []:
+        if name not in used:
+            shutil.rmtree(os.path.join(segment_dir, name), ignore_errors=True)
+
+def stored_monsters(store_dir='player_store'):
+    return sorted(monster for monster, parts in load_manifest(store_dir)['monsters'].items() if parts)
+
+def partition_signatures(store_dir='player_store'):
+    """
+    Returns {monster: signature}. A part keeps its id when compaction moves it,
+    so a monster's signature only changes when its data does.
+    """
+    return {monster: '-'.join(part['id'] for part in parts)
+            for monster, parts in load_manifest(store_dir)['monsters'].items() if parts}
+
+# %% writing
+def write_segment(df, sizes, store_dir, ids=None):
+    """
+    Saves df as one new segment. sizes is [(monster, rows)], one part per entry, in df's row order.
+    Returns the segment's name and [(monster, part)] with each part's row range and Data Age range.
+    ids keeps the parts' ids when rows are moved.
+    """
+    name = uuid.uuid4().hex[:16]
+    segment_dir = os.path.join(store_dir, 'segments')
+    os.makedirs(segment_dir, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(dir=segment_dir)
+    export_cache.save_frame(df.reset_index(drop=True), tmp_dir)
+    os.replace(tmp_dir, os.path.join(segment_dir, name))
+
+    ages = df['Data Age'].to_numpy() if 'Data Age' in df.columns else np.full(len(df), np.datetime64('NaT'), dtype='datetime64[ns]')
+    parts, start = [], 0
+    for i, (monster, rows) in enumerate(sizes):
+        part_ages = ages[start:start + rows]
+        part_ages = part_ages[~np.isnat(part_ages)].astype('int64')
+        parts.append((monster, {'id': ids[i] if ids else uuid.uuid4().hex[:16], 'segment': name, 'start': start, 'stop': start + rows,
+                                'min_age': int(part_ages.min()) if len(part_ages) else None,
+                                'max_age': int(part_ages.max()) if len(part_ages) else None}))
+        start += rows
+    return name, parts
+
+def row_hashes(df, columns):
+    # categoricals hash by value, so parts with different categories still match
+    return pd.util.hash_pandas_object(df[columns], index=False).to_numpy()
+
+def append_player_data(monster, df, store_dir='player_store', replace=False):
+    """
+    Adds a scrape of monster's player data to the store. Builds already stored for the monster
+    are skipped, so the scraper can append a full rescrape. With replace=True the monster's
+    stored builds are dropped first. Returns the number of rows written.
+    """
+    return append_many([(monster, df)], store_dir, replace)
+
+def append_many(frames, store_dir='player_store', replace=False):
+    """
+    append_player_data for [(monster, DataFrame)], normalized and written as one segment.
+    Returns the number of rows written.
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    manifest = load_manifest(store_dir)
+    owner, monsters = pd.factorize(np.repeat([monster for monster, _ in frames], [len(df) for _, df in frames]))
+    for monster, _ in frames:
+        if replace or monster not in manifest['monsters']:
+            manifest['monsters'][monster] = []
+
+    written = 0
+    if len(owner):
+        df = normalize_player_data(pd.concat([df for _, df in frames], ignore_index=True))
+        # builds already written for the same monster, in this batch or in the store, are skipped
+        keep = ~pd.DataFrame({'owner': owner, 'row': row_hashes(df, list(df.columns))}).duplicated().to_numpy()
+        for code, monster in enumerate(monsters):
+            if manifest['monsters'][monster]:
+                stored = read_player_data(store_dir, monsters=[monster], manifest=manifest)
+                columns = [col for col in df.columns if col in stored.columns]
+                rows = np.flatnonzero(owner == code)
+                keep[rows] &= ~np.isin(row_hashes(df.iloc[rows], columns), row_hashes(stored, columns))
+        order = np.flatnonzero(keep)[np.argsort(owner[keep], kind='stable')]
+        counts = np.bincount(owner[keep], minlength=len(monsters))
+        written = len(order)
+        if written:
+            segment, parts = write_segment(df.iloc[order], [(monster, int(count)) for monster, count in zip(monsters, counts) if count], store_dir)
+            manifest['segments'][segment] = written
+            for monster, part in parts:
+                manifest['monsters'][monster].append(part)
+    save_manifest(manifest, store_dir)
+    if len(manifest['segments']) > max_segments:
+        compact(store_dir)
+    return written
+
+def compact(store_dir='player_store'):
+    """
+    Rewrites every stored part into one segment ordered by monster, dropping replaced rows.
+    """
+    manifest = load_manifest(store_dir)
+    monsters = sorted(monster for monster, parts in manifest['monsters'].items() if parts)
+    live = [part for monster in monsters for part in manifest['monsters'][monster]]
+    # already one segment holding only live rows in monster order
+    bounds = np.cumsum([0] + [part['stop'] - part['start'] for part in live])
+    if not live or (len(manifest['segments']) == 1 and [part['start'] for part in live] == bounds[:-1].tolist()
+                    and list(manifest['segments'].values()) == [bounds[-1]]):
+        return
+    df = read_player_data(store_dir, manifest=manifest).drop(columns='Monster')
+    sizes = [(monster, part['stop'] - part['start']) for monster in monsters for part in manifest['monsters'][monster]]
+    segment, parts = write_segment(df, sizes, store_dir, [part['id'] for part in live])
+    manifest['segments'] = {segment: int(bounds[-1])}
+    manifest['monsters'] = {monster: [] for monster in manifest['monsters']}
+    for monster, part in parts:
+        manifest['monsters'][monster].append(part)
+    save_manifest(manifest, store_dir)
+
+def import_player_csvs(player_dir='player_data', store_dir='player_store'):
+    """
+    Loads every CSV in player_dir into the store, one monster per file (file name without .csv),
+    replacing what was stored for those monsters.
+    """
+    frames = [(os.path.splitext(name)[0], read_player_csv(os.path.join(player_dir, name)))
+              for name in sorted(os.listdir(player_dir)) if name.endswith('.csv')]
+    return append_many(frames, store_dir, replace=True)
+
+# %% reading
+def read_player_data(store_dir='player_store', monsters=None, start=None, end=None, columns=None, manifest=None, categorical=True):
+    """
+    Returns the stored builds of monsters (every monster by default) with a categorical
+    'Monster' column. start and end keep builds with a Data Age on or after start and before end.
+    Only the parts of the selected monsters whose Data Age range overlaps [start, end) are read,
+    and only their columns in columns. With categorical=False sets and slots are plain strings.
+    """
+    manifest = manifest or load_manifest(store_dir)
+    start = pd.Timestamp(start) if start is not None else None
+    end = pd.Timestamp(end) if end is not None else None
+    names = sorted(manifest['monsters']) if monsters is None else list(monsters)
+    read_columns = None
+    if columns is not None:
+        read_columns = list(columns) + (['Data Age'] if start is not None or end is not None else [])
+
+    # consecutive parts of the same segment are read as one row range
+    runs, codes, lengths = [], [], []
+    for code, monster in enumerate(names):
+        for part in manifest['monsters'].get(monster, []):
+            if start is not None and (part['max_age'] is None or part['max_age'] < start.value):
+                continue
+            if end is not None and (part['min_age'] is None or part['min_age'] >= end.value):
+                continue
+            if runs and runs[-1][0] == part['segment'] and runs[-1][2] == part['start']:
+                runs[-1][2] = part['stop']
+            else:
+                runs.append([part['segment'], part['start'], part['stop']])
+            codes.append(code)
+            lengths.append(part['stop'] - part['start'])
+
+    segments = {}
+    frames = []
+    for segment, run_start, run_stop in runs:
+        if segment not in segments:
+            segments[segment] = export_cache.load_frame(os.path.join(store_dir, 'segments', segment), columns=read_columns, categorical=True)
+        frames.append(segments[segment].iloc[run_start:run_stop])
+    if not frames:
+        return pd.DataFrame({'Monster': pd.Categorical([], categories=names)})
+    df = frames[0].reset_index(drop=True) if len(frames) == 1 else normalize_player_data(pd.concat(frames, ignore_index=True))
+    df.insert(0, 'Monster', pd.Categorical.from_codes(np.repeat(codes, lengths), names))
+
+    keep = np.ones(len(df), dtype=bool)
+    if start is not None:
+        keep &= (df['Data Age'] >= start).to_numpy()
+    if end is not None:
+        keep &= (df['Data Age'] < end).to_numpy()
+    if not keep.all():
+        df = df[keep].reset_index(drop=True)
+    if columns is not None:
+        df = df[['Monster'] + [col for col in columns if col in df.columns]]
+    if not categorical:
+        df = df.astype({col: object for col in df.columns if col != 'Monster' and isinstance(df[col].dtype, pd.CategoricalDtype)})
+    return df.copy()
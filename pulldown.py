@@ -1,11 +1,15 @@
 # %%
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from io import StringIO
 import pandas as pd
 import requests
 import re
 
 import http_utils
-from http_utils import get_legacy_session, header
+import player_store
+from http_utils import shared_session, cached_get
  
 # %%
 # Stat constants
@@ -59,18 +63,19 @@ def canonical_file_name(name: str) -> str:
     return base.lower().strip().replace(" ", "_")
 
 # %%
-def get_html_text(monster='Vigor'):
+site_url = 'https://godsarmy.garude.de'
+
+def monster_page_url(monster, site_url=site_url):
     # Build URL using the canonical URL name.
     url_name = canonical_monster_url(monster)
-    url = f'https://godsarmy.garude.de/monsters/{url_name}'
 
     # Special-case for Feng Yan:
-    missing_monster_dic = {'feng_yan': 'https://godsarmy.garude.de/node/228'}
-    if url_name in missing_monster_dic:
-        url = missing_monster_dic[url_name]
-    
+    missing_monster_dic = {'feng_yan': '/node/228'}
+    return site_url + missing_monster_dic.get(url_name, f'/monsters/{url_name}')
+
+def fetch_html_text(session, monster, site_url=site_url):
     try:
-        r = get_legacy_session().get(url, headers=header)
+        r = cached_get(session, monster_page_url(monster, site_url))
         if r.status_code == 200:
             html_text = re.sub('<img title="', '', r.text)
             html_text = re.sub('" src="https://godsarmy.garude.de/sites/default/files/.*?.png">', '', html_text)
@@ -80,6 +85,9 @@ def get_html_text(monster='Vigor'):
     except requests.RequestException as e:
         print(f"Failed to retrieve data for {monster}: {str(e)}")
         return None
+
+def get_html_text(monster='Vigor', site_url=site_url):
+    return fetch_html_text(shared_session(), monster, site_url)
  
 def get_player_data(html_text=None, newest=True):
     if html_text is None:
@@ -179,29 +187,42 @@ def get_max_stats(base_stats):
     max_stats['SPD'] = int(max_stats['SPD'])
     return pd.DataFrame(max_stats, index=[0])
 
-def get_monster_summary(monster_name: str) -> dict:
+def save_player_data(monster_name, player_data, player_dir='player_data', store_dir='player_store'):
+    # Save player data using the canonical file name.
+    file_name = canonical_file_name(monster_name)
+    player_data.to_csv(os.path.join(player_dir, file_name + '.csv'), index=False)
+    # builds already in the store are skipped, so rescrapes only add new ones
+    player_store.append_player_data(file_name, player_data, store_dir)
+
+def get_monster_summary(monster_name: str, site_url=site_url, player_dir='player_data', store_dir='player_store') -> dict:
     print('Checking monster:', monster_name)
-    html_text = get_html_text(monster_name)
+    summary, player_data = summarize_monster_page(monster_name, get_html_text(monster_name, site_url))
+    if player_data is not None:
+        save_player_data(monster_name, player_data, player_dir, store_dir)
+    return summary
+
+def summarize_monster_page(monster_name, html_text):
+    """
+    Parses a monster's page into its summary. Returns (summary, player data as scraped or None).
+    Nothing is written to disk, so pages can be parsed in worker processes.
+    """
     if html_text is None:
         return {"error": f"No data available for {monster_name}. Unable to retrieve or parse HTML.",
                 "name": monster_name,
-                "site_name": monster_name}
+                "site_name": monster_name}, None
 
     player_data = get_player_data(html_text)
     if player_data is None:
         return {"error": f"Failed to process player data for {monster_name}.",
                 "name": monster_name,
-                "site_name": monster_name}
+                "site_name": monster_name}, None
+    scraped_data = player_data.copy()
 
-    # Save player data using the canonical file name.
-    file_name = canonical_file_name(monster_name)
-    player_data.to_csv('player_data/' + file_name + '.csv', index=False)
-    
     base_stats = get_base_stats(html_text)
     if base_stats is None:
         return {"error": f"Failed to retrieve base stats for {monster_name}.",
                 "name": monster_name,
-                "site_name": monster_name}
+                "site_name": monster_name}, scraped_data
 
     # Optionally, calculate rune main stats.
     # runeMainStats = get_rune_main_stat(player_data, base_stats)
@@ -273,15 +294,16 @@ def get_monster_summary(monster_name: str) -> dict:
         'ACC_value': round(stat_efficiency_multiplier['efficiency_multiplier'].get('ACC', 0), 2) if 'ACC' in stat_efficiency_multiplier['efficiency_multiplier'] else 0,
         'RES_value': round(stat_efficiency_multiplier['efficiency_multiplier'].get('RES', 0), 2) if 'RES' in stat_efficiency_multiplier['efficiency_multiplier'] else 0
     }
-    return summary
+    return summary, scraped_data
  
 # %%
 def get_monster_list():
     alphabet = 'abcdefghijklmnopqrstuvwxyz'
     monster_list = pd.DataFrame()
+    session = shared_session()
     for letter in alphabet:
         try:
-            r = get_legacy_session().get('https://godsarmy.garude.de/monsters/' + letter, headers=header)
+            r = cached_get(session, 'https://godsarmy.garude.de/monsters/' + letter)
         except Exception as e:
             print('Error:', letter, e)
             continue
@@ -306,23 +328,75 @@ def get_first_n_stats(line, n=4):
     first_n = stats[:n]
     return '>'.join(first_n).strip()
  
+# %%
+summary_columns = ['name', 'site_name', 'most_popular_mainset', 'most_popular_offset', 'most_popular_slot2', 'most_popular_slot4',
+                   'most_popular_slot6', 'stats_priority', 'main_sets', 'offset_sets', 'slot2s', 'slot4s', 'slot6s',
+                   'HP_value', 'ATK_value', 'DEF_value', 'SPD_value', 'CR_value', 'CD_value', 'ACC_value', 'RES_value',
+                   'error', 'top_2_sub_stats', 'top_3_sub_stats', 'top_4_sub_stats']
+
+def summary_frame(summaries):
+    monster_summaries_df = pd.DataFrame([summary for summary in summaries if summary is not None]).reindex(columns=summary_columns)
+
+    # Add columns for the top 2, 3, and 4 sub-stats
+    for n in [2, 3, 4]:
+        monster_summaries_df[f'top_{n}_sub_stats'] = monster_summaries_df['stats_priority'].apply(lambda x: get_first_n_stats(x, n=n))
+    return monster_summaries_df
+
+async def scrape_monsters(monster_names, concurrency=8, processes=None, site_url=site_url, player_dir='player_data',
+                          store_dir='player_store', summary_file='monster_summaries.csv'):
+    """
+    Scrapes every monster in monster_names with up to concurrency page fetches in flight on one pooled
+    session, while finished pages are parsed on a pool of processes (os.cpu_count() by default).
+    Each monster's player data is saved and its summary row appended to summary_file + '.partial' as
+    soon as its page is parsed, on one writer thread so disk writes don't hold up the fetches and the
+    player_store sees one append at a time. At the end the rows are rewritten in monster_names order
+    and moved over summary_file, so a failed or interrupted run leaves the old summary_file in place.
+    Returns the summaries DataFrame.
+    """
+    loop = asyncio.get_running_loop()
+    session = shared_session(pool_maxsize=concurrency)
+    fetch_slots = asyncio.Semaphore(concurrency)
+    # pages waiting for a parser count too, so memory stays bounded when parsing is the bottleneck
+    page_slots = asyncio.Semaphore(2 * concurrency)
+    partial_file = summary_file + '.partial' if summary_file else None
+    if partial_file:
+        pd.DataFrame(columns=summary_columns).to_csv(partial_file, index=False)
+    summaries = {}
+
+    def save(monster_name, summary, player_data):
+        if player_data is not None:
+            save_player_data(monster_name, player_data, player_dir, store_dir)
+        if partial_file:
+            summary_frame([summary]).to_csv(partial_file, mode='a', header=False, index=False)
+
+    async def scrape(monster_name):
+        async with page_slots:
+            async with fetch_slots:
+                html_text = await loop.run_in_executor(fetchers, fetch_html_text, session, monster_name, site_url)
+            summary, player_data = await loop.run_in_executor(parsers, summarize_monster_page, monster_name, html_text)
+        await loop.run_in_executor(writer, save, monster_name, summary, player_data)
+        summaries[monster_name] = summary
+        print(f'{len(summaries)}/{len(monster_names)} Checked monster:', monster_name)
+
+    with ThreadPoolExecutor(concurrency) as fetchers, ProcessPoolExecutor(processes) as parsers, ThreadPoolExecutor(1) as writer:
+        await asyncio.gather(*(scrape(monster_name) for monster_name in monster_names))
+
+    monster_summaries_df = summary_frame([summaries[monster_name] for monster_name in monster_names])
+    if summary_file:
+        monster_summaries_df.to_csv(partial_file, index=False)
+        os.replace(partial_file, summary_file)
+    return monster_summaries_df
+
 # %%
 if __name__ == '__main__':
     monster_list = get_monster_list()
     if not monster_list.empty:
-        # For each monster, use its original Name from the list.
-        monster_summaries = monster_list.apply(lambda x: get_monster_summary(x['Name']), axis=1)
-        valid_summaries = [summary for summary in monster_summaries if summary is not None]
-        monster_summaries_df = pd.DataFrame(valid_summaries)
-
-        # Add columns for the top 2, 3, and 4 sub-stats
-        monster_summaries_df['top_2_sub_stats'] = monster_summaries_df['stats_priority'].apply(lambda x: get_first_n_stats(x, n=2))
-        monster_summaries_df['top_3_sub_stats'] = monster_summaries_df['stats_priority'].apply(lambda x: get_first_n_stats(x, n=3))
-        monster_summaries_df['top_4_sub_stats'] = monster_summaries_df['stats_priority'].apply(lambda x: get_first_n_stats(x, n=4))
-
-        if not monster_summaries_df.empty:
-            monster_summaries_df.to_csv('monster_summaries.csv', index=False)
-        else:
+        # For each monster, use its original Name from the list. Summaries are written to monster_summaries.csv as pages finish.
+        monster_summaries_df = asyncio.run(scrape_monsters(monster_list['Name'].tolist()))
+        # one segment per scraped monster until now, rewrite them as one for fast roster-wide reads
+        player_store.compact()
+
+        if monster_summaries_df.empty:
             print("No valid monster data was processed.")
     else:
         print("No monster data available to process.")
@@ -1,6 +1,7 @@
 # %%
 GRADE_SETTING='hero' # Setting for gems and grinds
 
+import numpy as np
 import pandas as pd
 
 stat_list = ['HP','ATK','DEF','SPD','CR','CD','ACC','RES']
@@ -100,110 +101,354 @@ stat_dict = {
 
 gem_max_rolls = gems_and_grinds.loc[(gems_and_grinds['type']=='gem') & (gems_and_grinds['grade']==GRADE_SETTING)].drop(columns=['type','grade'])
 
-def load_runes(data):
-    runes = pd.DataFrame.from_dict(data['runes'])
-    equipt_runes = pd.json_normalize(data['unit_list'],record_path=['runes'])
-    #runes = pd.json_normalize(data.loc['runes'].values[0])
-    runes = pd.concat([runes,equipt_runes])
-
-    dropCols=['occupied_type'
-    #,'wizard_id'
-    #,'occupied_id'
-    ,'upgrade_limit']
-
-    grade_id_dict = {3:'rare'
-        ,4:'hero'
-        ,5:'legendary'}
-
-    renameCols={'upgrade_curr':'level'
-                ,'class':'stars'
-                ,'pri_eff':'main_stat'
-                ,'prefix_eff':'innate'
-                ,'extra':'grade'}    
-    
-    runes = runes.drop(dropCols,axis=1).rename(columns=renameCols)
+grade_id_dict = {3:'rare'
+    ,4:'hero'
+    ,5:'legendary'}
+
+# column of each exporter stat id in the decoded stat matrices (stat_dict order)
+stat_code_index = {code: i for i, code in enumerate(stat_dict)}
+
+def decode_runes(rune_list):
+    """
+    Walks each exporter rune's pri_eff, prefix_eff and sec_eff once and writes them
+    straight into preallocated arrays. Stat matrices are (n_runes x 11) with columns in
+    stat_dict order and NaN where the rune doesn't have the stat. Like the old pivot,
+    'base' and 'rolls' include the innate stat while 'gemmed' and 'grind' only cover subs.
+
+    Returns a dictionary of numpy arrays.
+    """
+    n = len(rune_list)
+    n_stats = len(stat_dict)
+    roles = [stat_roles[stat] for stat in stat_dict.values()]
+
+    decoded = {
+        'rune_id': np.empty(n, dtype=np.int64),
+        'slot_no': np.empty(n, dtype=np.int64),
+        'set_id': np.empty(n, dtype=np.int64),
+        'level': np.empty(n, dtype=np.int64),
+        'occupied_id': np.empty(n, dtype=np.int64),
+        'grade': np.empty(n, dtype=np.int64),
+        'main_stat_code': np.empty(n, dtype=np.int64),
+        'main_stat_value': np.empty(n, dtype=np.int64),
+        'innate_code': np.empty(n, dtype=np.int64),
+        'innate_value': np.empty(n, dtype=np.int64),
+        'base': np.full((n, n_stats), np.nan),
+        'gemmed': np.full((n, n_stats), np.nan),
+        'grind': np.full((n, n_stats), np.nan),
+        'rolls': np.full((n, n_stats), np.nan),
+    }
+    rune_id, slot_no, set_id, level = decoded['rune_id'], decoded['slot_no'], decoded['set_id'], decoded['level']
+    occupied_id, grade = decoded['occupied_id'], decoded['grade']
+    main_stat_code, main_stat_value = decoded['main_stat_code'], decoded['main_stat_value']
+    innate_code, innate_value = decoded['innate_code'], decoded['innate_value']
+    base, gemmed, grind, rolls = decoded['base'], decoded['gemmed'], decoded['grind'], decoded['rolls']
+
+    for i, rune in enumerate(rune_list):
+        rune_id[i] = rune['rune_id']
+        slot_no[i] = rune['slot_no']
+        set_id[i] = rune['set_id']
+        level[i] = rune['upgrade_curr']
+        occupied_id[i] = rune['occupied_id']
+        grade[i] = rune['extra']
+        main_stat_code[i], main_stat_value[i] = rune['pri_eff']
+        innate_code[i], innate_value[i] = rune['prefix_eff']
+
+        j = stat_code_index.get(innate_code[i])
+        if j is not None:
+            base[i, j] = innate_value[i]
+            rolls[i, j] = innate_value[i] / roles[j]
+
+        for sub in rune['sec_eff']:
+            j = stat_code_index.get(sub[0])
+            if j is None:
+                continue
+            base[i, j] = sub[1]
+            gemmed[i, j] = sub[2]
+            grind[i, j] = sub[3]
+            rolls[i, j] = max(sub[1] / roles[j], 0)
+
+    return decoded
+
+def decoded_runes_to_df(decoded):
+    """
+    Builds load_runes' DataFrame from decode_runes' arrays: one column per stat the
+    inventory has, sorted by set, SPD rank, main stat and slot, indexed by rune_id.
+    The stat matrices are popped from decoded as they are used.
+    """
+    stat_names = list(stat_dict.values())
+    stat_name_array = np.array(stat_names + [np.nan], dtype=object)
+    roles = np.array([stat_roles[stat] for stat in stat_names] + [np.nan])
+
+    slot_no = decoded['slot_no']
+    set_id = pd.Series(decoded['set_id']).map(set_id_dict).to_numpy()
+    main_stat_type = stat_name_array[[stat_code_index.get(code, -1) for code in decoded['main_stat_code'].tolist()]]
+
+    # sort by SPD rank within slot/set/main stat, where SPD main stat runes count as max main stat SPD
+    spd = decoded['base'][:, stat_names.index('SPD')]
+    spd = np.where(np.isnan(spd) & (main_stat_type == 'SPD'), main_stat_max['SPD'], spd)
+    spd_rank = pd.DataFrame({'slot_no': slot_no, 'set_id': set_id, 'main_stat_type': main_stat_type, 'SPD': spd})
+    spd_rank['SPD Rank'] = spd_rank.groupby(['slot_no','set_id','main_stat_type'])['SPD'].rank(method="dense",ascending=False)
+    order = spd_rank.sort_values(['set_id','SPD Rank','main_stat_type','slot_no']).index.to_numpy()
 
     # check for anciant runes
-    runes['ancient'] = runes['grade'] > 10
-    runes.loc[runes['ancient'],'grade'] -= 10
-
-    runes['set_id'] = runes['set_id'].map(set_id_dict)
-    runes['grade'] = runes['grade'].map(grade_id_dict)
-
-    runes = runes.set_index('rune_id')
-
-    runes_main_stat = pd.DataFrame(runes['main_stat'].tolist(),columns=['main_stat_type','main_stat_value'],index=runes.index)
-    runes_main_stat['main_stat_type']= runes_main_stat['main_stat_type'].map(stat_dict)
-    runes = runes.join(runes_main_stat)
-
-    # Innrate
-    runeInnates = pd.DataFrame(runes['innate'].to_list(),columns=['Stat','Base'],index=runes.index)
-    runeInnates['Stat']= runeInnates['Stat'].map(stat_dict)
-    runeInnates['Rolls']= runeInnates['Base']/runeInnates['Stat'].map(stat_roles)
-    runes = runes.join(runeInnates)
-
-
-    rune_stats = pd.DataFrame(runes['sec_eff'].explode().to_list(),columns=['Stat','Base','Gemmed','Grind'],index=runes['sec_eff'].explode().index)
-    rune_stats['Stat']= rune_stats['Stat'].map(stat_dict)
-    rune_stats['Rolls'] = rune_stats['Base']/rune_stats['Stat'].map(stat_roles)
-    rune_stats.loc[rune_stats['Rolls']< 0,'Rolls'] = 0
-    rune_base_stats = pd.concat([rune_stats,runeInnates])
-    rune_base_stats = rune_base_stats.pivot(columns='Stat')
-
-    #Clean up Base Stats
-    rune_base_stat_columns = rune_base_stats['Base'].columns[rune_base_stats['Base'].columns.notna()]
-    rune_base_stats_clean = rune_base_stats['Base'][rune_base_stat_columns]
-    rune_stat_rolls_columns = rune_base_stats['Rolls'].columns[rune_base_stats['Rolls'].columns.notna()]
-    rune_stat_rolls_clean = rune_base_stats['Rolls'][rune_stat_rolls_columns]
-    rune_stat_rolls_clean = rune_stat_rolls_clean.add_suffix(' Rolls')
-    rune_stat_rolls_clean['Total_Rolls']= rune_base_stats['Rolls'].sum(axis=1)
-
-    #round all columns to nearest zero except 'Total_Rolls'
-    rune_stat_rolls_clean.update(rune_stat_rolls_clean.loc[:,
-    rune_stat_rolls_clean.columns
-    != 'Total_Rolls'].round(),
-    errors='ignore')
-
-    columns_to_keep = ['slot_no','set_id','main_stat_type','main_stat_value','level','occupied_id','grade','ancient']
-    
-    runes = runes[columns_to_keep].join(rune_base_stats_clean).join(rune_stat_rolls_clean)
-    runes['Missing_Rolls']= (4- runes['level'].astype(int)/3).astype(int)
-    runes.loc[runes['Missing_Rolls']< 0,'Missing_Rolls'] = 0
-
-    runes['Efficiency']= (runes['Total_Rolls']+ runes['Missing_Rolls'])/10
-    runes_main_stat['main_stat_value']= runes_main_stat['main_stat_type'].map(main_stat_max)
-    runes = runes.fillna(runes_main_stat.pivot(columns='main_stat_type')['main_stat_value'])
-
-    runes.iloc[:,5:len(runes.columns)-2]= runes.iloc[:,5:len(runes.columns)-2]#.astype(int)
-    runes['SPD Rank']= runes.groupby(['slot_no','set_id','main_stat_type'])['SPD'].rank(method="dense",ascending=False)
-    runes['CR Rank']= runes.groupby(['slot_no','set_id','main_stat_type'])['CR'].rank(method="dense",ascending=False)
-    runes = runes.sort_values(['set_id','SPD Rank','main_stat_type','slot_no'])
-    first_col = runes.pop('SPD Rank')
-    runes.insert(0,'SPD Rank',first_col)
-    #runes.to_clipboard()
-
-    # create a clean runes df
-    # Took out ,'Spd','Spd Rolls','Crit Rate','Crit Rate Rolls','Efficiency','Missing_Rolls' from runes_df to keep it cleaner
-    runes_df = runes[columns_to_keep]
-    runeInnates = runeInnates.rename(columns={'Stat':'Innate Stat'
-                                              ,'Base':'Innate Stat Value'
-                                              ,'Rolls':'Innate Stat Rolls'})
-    runes_df = runes_df.join(runeInnates)
-    # remove rune_base_stats's multi column index
-    rune_base_stats_1_level = rune_base_stats['Base'].add_prefix('Base ').join(rune_base_stats['Gemmed'].add_prefix('Gemmed ')).join(rune_base_stats['Grind'].add_prefix('Grinded ')).join(rune_base_stats['Rolls'].add_prefix('Rolls '))
-    drop_cols = ['Base nan','Gemmed nan','Grinded nan','Rolls nan','Grinded ACC','Grinded CD','Grinded CR','Grinded RES']
-    rune_base_stats_1_level = rune_base_stats_1_level.drop(columns=drop_cols)
-    runes_df = runes_df.join(rune_base_stats_1_level)
-    runes_df
+    grade = decoded['grade'][order]
+    ancient = grade > 10
+    grade = np.where(ancient, grade - 10, grade)
+
+    innate_idx = np.array([stat_code_index.get(code, -1) for code in decoded['innate_code'][order].tolist()], dtype=int)
+    innate_value = decoded['innate_value'][order]
+
+    columns = {
+        'slot_no': slot_no[order],
+        'set_id': set_id[order],
+        'main_stat_type': main_stat_type[order],
+        'main_stat_value': decoded['main_stat_value'][order],
+        'level': decoded['level'][order],
+        'occupied_id': decoded['occupied_id'][order],
+        'grade': pd.Series(grade).map(grade_id_dict).to_numpy(),
+        'ancient': ancient,
+        'Innate Stat': stat_name_array[innate_idx],
+        'Innate Stat Value': innate_value,
+        'Innate Stat Rolls': innate_value / roles[innate_idx],
+    }
 
     # check if any of the "Gemmed" stats are already gemmed (check if value is 1)
-    runes_df['Gemmed']= 0
-    runes_df['Gemmed']= runes_df[['Gemmed ACC', 'Gemmed CD', 'Gemmed CR', 'Gemmed Flat Atk', 'Gemmed Flat Def', 'Gemmed Flat HP', 'Gemmed ATK', 'Gemmed DEF', 'Gemmed HP', 'Gemmed RES', 'Gemmed SPD']].sum(axis=1)
-    runes_df['Gemmed']= runes_df['Gemmed'].astype(int).astype(bool)
-    runes_df.loc[runes_df[runes_df['Gemmed']].index,'Gemmed_Stat_Name'] = runes_df[['Gemmed ACC','Gemmed CD', 'Gemmed CR', 'Gemmed Flat Atk', 'Gemmed Flat Def', 'Gemmed Flat HP', 'Gemmed ATK', 'Gemmed DEF', 'Gemmed HP', 'Gemmed RES', 'Gemmed SPD']].idxmax(axis=1)
-    runes_df['Gemmed_Stat_Name']= runes_df['Gemmed_Stat_Name'].fillna('')
-    runes_df['Gemmed_Stat_Name']= runes_df['Gemmed_Stat_Name'].str.replace('Gemmed ','')
-    return runes_df
+    gemmed = np.nan_to_num(decoded['gemmed'][order])
+    gemmed_stat_name = np.where(gemmed.sum(axis=1) > 0, np.array(stat_names, dtype=object)[gemmed.argmax(axis=1)], '')
+    del gemmed
+
+    # one column per stat any rune has, in the same sorted order the old pivot produced.
+    # Each matrix is popped once it is reordered so the decoded copy doesn't stay alive.
+    present = sorted((i for i in range(len(stat_names)) if not np.isnan(decoded['base'][:, i]).all()), key=lambda i: stat_names[i])
+    for prefix, key in [('Base ', 'base'), ('Gemmed ', 'gemmed'), ('Grinded ', 'grind'), ('Rolls ', 'rolls')]:
+        matrix = decoded.pop(key)[order]
+        for i in present:
+            if prefix == 'Grinded ' and stat_names[i] in ['ACC','CD','CR','RES']:
+                continue
+            columns[prefix + stat_names[i]] = matrix[:, i]
+
+    columns['Gemmed'] = gemmed_stat_name != ''
+    columns['Gemmed_Stat_Name'] = gemmed_stat_name
+
+    return pd.DataFrame(columns, index=pd.Index(decoded['rune_id'][order], name='rune_id'))
+
+def load_runes(data):
+    """
+    Loads the inventory and equipped runes from an exporter file's data into one row per rune.
+    """
+    rune_list = list(data['runes']) + [rune for unit in data['unit_list'] for rune in unit['runes']]
+    return decoded_runes_to_df(decode_runes(rune_list))
+
+# Categories for RuneTable's int8 codes (-1 means missing).
+set_names = list(dict.fromkeys(set_id_dict.values()))
+stat_names = list(stat_dict.values())
+grade_names = ['rare', 'hero', 'legendary']
+
+# Pivoted stat column order load_runes produces.
+rune_stat_columns = sorted(stat_names)
+grindable_stats = ['Flat Atk', 'Flat Def', 'Flat HP', 'ATK', 'DEF', 'HP', 'SPD']
+
+# popcount for the 11-bit sub stat masks
+popcount_table = np.array([bin(i).count('1') for i in range(1 << len(stat_names))], dtype=np.int8)
+
+def stat_bitmask(present):
+    """
+    Packs an (n_runes x 11) boolean matrix (columns in stat_dict order) into uint16 bitmasks.
+    """
+    return (present.astype(np.uint16) << np.arange(len(stat_names), dtype=np.uint16)).sum(axis=1).astype(np.uint16)
+
+class RuneTable:
+    """
+    Compact columnar copy of load_runes' DataFrame.
+
+    Slot, set, main stat, grade and innate are int8 codes, base and grind values are
+    (n_runes x 11) int16 matrices with columns in stat_dict order, and which stats a rune
+    has are uint16 bitmasks (bit i = stat_names[i]):
+      - stat_mask: stats with a base value (sub stats and the innate stat)
+      - sub_mask: sub stats (the ones that have Gemmed/Grinded values)
+      - gemmed_mask: the gemmed sub stat
+
+    Use RuneTable.from_dataframe() and to_dataframe() to convert at the edges.
+    """
+
+    def __init__(self, rune_id, slot_no, set_code, main_stat_code, main_stat_value, level,
+                 occupied_id, grade_code, ancient, innate_code, innate_value,
+                 base, grind, stat_mask, sub_mask, gemmed_mask):
+        self.rune_id = rune_id
+        self.slot_no = slot_no
+        self.set_code = set_code
+        self.main_stat_code = main_stat_code
+        self.main_stat_value = main_stat_value
+        self.level = level
+        self.occupied_id = occupied_id
+        self.grade_code = grade_code
+        self.ancient = ancient
+        self.innate_code = innate_code
+        self.innate_value = innate_value
+        self.base = base
+        self.grind = grind
+        self.stat_mask = stat_mask
+        self.sub_mask = sub_mask
+        self.gemmed_mask = gemmed_mask
+
+    def __len__(self):
+        return len(self.rune_id)
+
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for array in vars(self).values())
+
+    @property
+    def rolls(self):
+        # roll counts of each stat, 0 where the rune doesn't have it
+        return self.base.astype(np.float32) / np.array([stat_roles[stat] for stat in stat_names], dtype=np.float32)
+
+    def has_stat(self, stat, mask=None):
+        """
+        Returns a boolean array of which runes have the stat set in the mask (stat_mask by default).
+        """
+        mask = self.stat_mask if mask is None else mask
+        return (mask & (1 << stat_names.index(stat))) != 0
+
+    def gemmed_stat_index(self):
+        """
+        Returns which runes are gemmed and the stat_names index of the gemmed stat (0 if not gemmed).
+        """
+        gemmed = self.gemmed_mask != 0
+        return gemmed, np.log2(np.where(gemmed, self.gemmed_mask, 1)).astype(int)
+
+    def take(self, indexer):
+        """
+        Returns a new RuneTable with only the rows selected by a boolean mask or integer positions.
+        """
+        return RuneTable(**{name: array[indexer] for name, array in vars(self).items()})
+
+    @classmethod
+    def from_dataframe(cls, runes_df):
+        """
+        Builds a RuneTable from the DataFrame returned by load_runes (indexed by rune_id).
+        Stats with a missing or 0 base value are treated as absent.
+        """
+        n = len(runes_df)
+
+        def codes(column, categories):
+            return pd.Categorical(runes_df[column], categories=categories).codes.astype(np.int8)
+
+        def stat_matrix(prefix, fill=0):
+            matrix = np.full((n, len(stat_names)), fill, dtype=float)
+            for i, stat in enumerate(stat_names):
+                if prefix + stat in runes_df.columns:
+                    matrix[:, i] = runes_df[prefix + stat].to_numpy(dtype=float)
+            return matrix
+
+        base = np.nan_to_num(stat_matrix('Base '))
+        gemmed = stat_matrix('Gemmed ', fill=np.nan)
+        grind = np.nan_to_num(stat_matrix('Grinded '))
+
+        innate_value = runes_df['Innate Stat Value'].fillna(0) if 'Innate Stat Value' in runes_df.columns else pd.Series(0, index=runes_df.index)
+
+        return cls(
+            rune_id=runes_df.index.to_numpy(dtype=np.int64),
+            slot_no=runes_df['slot_no'].to_numpy(dtype=np.int8),
+            set_code=codes('set_id', set_names),
+            main_stat_code=codes('main_stat_type', stat_names),
+            main_stat_value=runes_df['main_stat_value'].to_numpy(dtype=np.int16),
+            level=runes_df['level'].to_numpy(dtype=np.int8),
+            occupied_id=runes_df['occupied_id'].to_numpy(dtype=np.int64),
+            grade_code=codes('grade', grade_names),
+            ancient=runes_df['ancient'].to_numpy(dtype=bool),
+            innate_code=codes('Innate Stat', stat_names),
+            innate_value=innate_value.to_numpy(dtype=np.int16),
+            base=base.astype(np.int16),
+            grind=grind.astype(np.int16),
+            stat_mask=stat_bitmask(base != 0),
+            sub_mask=stat_bitmask(~np.isnan(gemmed)),
+            gemmed_mask=stat_bitmask(np.nan_to_num(gemmed) > 0),
+        )
+
+    def column(self, name):
+        """
+        Returns one column in load_runes' layout as a numpy array. Also accepts the plain
+        stat names in stat_list, which give the base value with 0 for missing stats.
+        """
+        def decode(codes, categories):
+            return np.array(categories + [np.nan], dtype=object)[codes]
+
+        if name == 'rune_id':
+            return self.rune_id
+        if name == 'slot_no':
+            return self.slot_no.astype(np.int64)
+        if name == 'set_id':
+            return decode(self.set_code, set_names)
+        if name == 'main_stat_type':
+            return decode(self.main_stat_code, stat_names)
+        if name in ['main_stat_value', 'level', 'occupied_id']:
+            return getattr(self, name).astype(np.int64)
+        if name == 'grade':
+            return decode(self.grade_code, grade_names)
+        if name == 'ancient':
+            return self.ancient
+        if name == 'Innate Stat':
+            return decode(self.innate_code, stat_names)
+        if name == 'Innate Stat Value':
+            return self.innate_value.astype(np.int64)
+        if name == 'Innate Stat Rolls':
+            roles = np.array([stat_roles[stat] for stat in stat_names] + [np.nan])
+            return self.innate_value / roles[self.innate_code]
+        if name == 'Gemmed':
+            return self.gemmed_mask != 0
+        if name == 'Gemmed_Stat_Name':
+            gemmed, gemmed_idx = self.gemmed_stat_index()
+            return np.where(gemmed, np.array(stat_names, dtype=object)[gemmed_idx], '')
+        if name in stat_list:
+            return self.base[:, stat_names.index(name)].astype(float)
+
+        prefix, _, stat = name.partition(' ')
+        if stat in stat_names:
+            i = stat_names.index(stat)
+            if prefix == 'Base':
+                return np.where(self.has_stat(stat), self.base[:, i], np.nan)
+            if prefix == 'Rolls':
+                return np.where(self.has_stat(stat), self.base[:, i] / stat_roles[stat], np.nan)
+            if prefix == 'Gemmed':
+                return np.where(self.has_stat(stat, self.sub_mask), self.has_stat(stat, self.gemmed_mask), np.nan)
+            if prefix == 'Grinded' and stat in grindable_stats:
+                return np.where(self.has_stat(stat, self.sub_mask), self.grind[:, i], np.nan)
+        raise KeyError(name)
+
+    @staticmethod
+    def columns():
+        """
+        Returns the column names to_dataframe() produces, in load_runes' order.
+        """
+        return (['slot_no','set_id','main_stat_type','main_stat_value','level','occupied_id','grade','ancient',
+                 'Innate Stat','Innate Stat Value','Innate Stat Rolls']
+                + ['Base ' + stat for stat in rune_stat_columns]
+                + ['Gemmed ' + stat for stat in rune_stat_columns]
+                + ['Grinded ' + stat for stat in rune_stat_columns if stat in grindable_stats]
+                + ['Rolls ' + stat for stat in rune_stat_columns]
+                + ['Gemmed', 'Gemmed_Stat_Name'])
+
+    def to_dataframe(self, columns=None, index=True):
+        """
+        Converts back to load_runes' DataFrame layout, or only the requested columns.
+        With index=False, rune_id is returned as a column instead of the index.
+        """
+        columns = self.columns() if columns is None else columns
+        runes_df = pd.DataFrame({name: self.column(name) for name in columns if name != 'rune_id'},
+                                index=pd.Index(self.rune_id, name='rune_id'))
+        if not index:
+            runes_df = runes_df.reset_index()
+        return runes_df
+
+def as_runes_df(runes, columns=None, index=True):
+    """
+    Returns runes as a DataFrame, converting a RuneTable at the edge.
+    DataFrames are passed through unchanged.
+    """
+    if isinstance(runes, RuneTable):
+        return runes.to_dataframe(columns, index=index)
+    return runes
 
 def grind_runes(df,grade=GRADE_SETTING):
     runes_df = df.copy()
@@ -238,80 +483,110 @@ def get_new_stats(df):
 
     return runes_df
 
-def all_gem_grind_combinations(runes_df):
-    runes_with_all_gems = []
-    
-    #fill na from 'Base ' + stat_dict.values() with 0
-    runes_df[['Base '+stat for stat in stat_dict.values()]] = runes_df[['Base '+stat for stat in stat_dict.values()]].fillna(0)
-
-    def filter_runes(stat,df):
-        # exclude runes that have the stat as their main stat
-        df = df[df['main_stat_type'] != stat]
-
-        #exclude runes that have the stat as an Innate Stat
-        df = df[df['Innate Stat'] != stat]
-
-        # exclude slots that can't have the stat
-        if stat in ['DEF','Flat Def','Flat Atk']:
-            df = df[df['slot_no'] != 1]
-
-        if stat in ['ATK','Flat Def','Flat Atk']:
-            df = df[df['slot_no'] != 3]
-
-        if stat == 'Flat HP':
-            df = df[df['slot_no'] != 5]
+# Slots that can't roll a stat as a sub stat (and so can't have it gemmed in or out).
+gem_excluded_slots = {
+    'DEF': [1],
+    'Flat Def': [1, 3],
+    'Flat Atk': [1, 3],
+    'ATK': [3],
+    'Flat HP': [5]
+}
 
-        return df
+def gem_eligibility(runes_df):
+    """
+    Builds the (n_runes x 11) masks of which stats each rune can gem out and gem in,
+    with columns in stat_dict order. A stat is excluded when it is the rune's main stat,
+    its innate stat, or can't roll on the rune's slot. Gem out also requires the rune to
+    have the stat and no other gem; gem in requires the stat to be below gem_max_rolls.
+    """
+    gem_stats = list(stat_dict.values())
+    stat_names = np.array(gem_stats, dtype=object)
+
+    base = runes_df[['Base '+stat for stat in gem_stats]].fillna(0).to_numpy(dtype=float)
+    slot_no = runes_df['slot_no'].to_numpy()
+    main_stat = runes_df['main_stat_type'].to_numpy(dtype=object)
+    innate = runes_df['Innate Stat'].to_numpy(dtype=object)
+    gemmed = runes_df['Gemmed'].to_numpy(dtype=bool)
+    gemmed_name = runes_df['Gemmed_Stat_Name'].to_numpy(dtype=object)
+    gem_max = gem_max_rolls.iloc[0][gem_stats].to_numpy(dtype=float)
+
+    allowed = (main_stat[:, None] != stat_names) & (innate[:, None] != stat_names)
+    for i, stat in enumerate(gem_stats):
+        allowed[:, i] &= ~np.isin(slot_no, gem_excluded_slots.get(stat, []))
+
+    # we can't gem out ATK if we have already gemmed in HP
+    gem_out_ok = allowed & (base > 0) & (~gemmed[:, None] | (gemmed_name[:, None] == stat_names))
+    gem_in_ok = allowed & (base < gem_max)
+    return gem_out_ok, gem_in_ok
 
-    for gem_out_stat in stat_dict.values():
-        # exclude runes that don't have the gem_out_stat in their subs
-        runes_with_gem_out_stat = runes_df[runes_df['Base '+gem_out_stat] > 0.0].copy() #check to see why we also were exluding runes that had an NA value for the stat
+def all_gem_grind_combinations(runes_df):
+    """
+    Builds every legal gem out/gem in option for every rune, with max grinds applied.
+    The full runes x gem out x gem in space is built as one broadcast boolean mask and only
+    the valid candidates are materialized, ordered by rune_id, gem out stat, then gem in stat.
 
-        # only include runes that have no gem or have the current gem_out_stat as their gem (example: we can't gem out ATK if we have already gemmed in HP)
-        runes_with_gem_out_stat = runes_with_gem_out_stat[(~runes_with_gem_out_stat['Gemmed']) | (runes_with_gem_out_stat['Gemmed_Stat_Name'] == gem_out_stat)]
+    Returns one row per candidate with the rune's final HP/ATK/DEF/SPD (gemmed and ground)
+    and CR/CD/ACC/RES (gemmed) values.
+    """
+    gem_stats = list(stat_dict.values())
+    stat_names = np.array(gem_stats, dtype=object)
 
-        runes_with_gem_out_stat = filter_runes(gem_out_stat,runes_with_gem_out_stat)
-    
-        for gem_in_stat in stat_dict.values():
-            runes_with_new_gemmed_stat = filter_runes(gem_in_stat,runes_with_gem_out_stat)
+    #fill na from 'Base ' + stat_dict.values() with 0
+    runes_df[['Base '+stat for stat in gem_stats]] = runes_df[['Base '+stat for stat in gem_stats]].fillna(0)
+
+    gem_out_ok, gem_in_ok = gem_eligibility(runes_df)
+
+    # (rune, gem out, gem in) with runes sorted by rune_id, so nonzero() keeps each rune's options together
+    rune_order = np.argsort(runes_df.index.to_numpy(), kind='stable')
+    candidates = gem_out_ok[rune_order, :, None] & gem_in_ok[rune_order, None, :]
+    sorted_idx, gem_out_idx, gem_in_idx = np.nonzero(candidates)
+    rune_idx = rune_order[sorted_idx]
+    del candidates
+
+    gem_max = gem_max_rolls.iloc[0][gem_stats].to_numpy(dtype=float)
+    rows = np.arange(len(rune_idx))
+    new_base = runes_df[['Base '+stat for stat in gem_stats]].to_numpy(dtype=float)[rune_idx]
+    new_base[rows, gem_out_idx] = 0 # set the new value of the original stat to 0
+    new_base[rows, gem_in_idx] = gem_max[gem_in_idx]
+
+    maxed_runes = pd.DataFrame({
+        'set_id': runes_df['set_id'].to_numpy()[rune_idx],
+        'slot_no': runes_df['slot_no'].to_numpy()[rune_idx],
+        'main_stat_type': runes_df['main_stat_type'].to_numpy()[rune_idx],
+        'rune_id': runes_df.index.to_numpy()[rune_idx],
+        'Gemmed_Stat_Name': runes_df['Gemmed_Stat_Name'].to_numpy()[rune_idx],
+        'Suggested Gem In': stat_names[gem_in_idx],
+        'Suggested Gem Out': stat_names[gem_out_idx],
+    })
+
+    # only add grinds to stats the rune has after gemming, a gemmed out stat stays at 0
+    max_grinds = gems_and_grinds[(gems_and_grinds['type'] == 'grind') & (gems_and_grinds['grade'] == GRADE_SETTING)].iloc[0]
+    for stat in ['HP','ATK','DEF','SPD']:
+        i = gem_stats.index(stat)
+        new_stat = np.where(gem_out_idx == i, 0.0, np.nan)
+        has_stat = new_base[:, i] > 0
+        new_stat[has_stat] = new_base[has_stat, i] + max_grinds[stat]
+        maxed_runes[stat] = new_stat
+
+    for stat in ['CR','CD','ACC','RES']:
+        maxed_runes[stat] = new_base[:, gem_stats.index(stat)]
 
-            # exclude any runes where the stat is equal or higher to the max roll of our current gem grade
-            runes_with_new_gemmed_stat = runes_with_new_gemmed_stat[runes_with_new_gemmed_stat['Base '+gem_in_stat] < gem_max_rolls.iloc[0][gem_in_stat]]
-            
-            runes_with_new_gemmed_stat['New '+gem_out_stat] = 0 # set the new value of the original stat to 0
-            runes_with_new_gemmed_stat['Suggested Gem Out'] = gem_out_stat
-            runes_with_new_gemmed_stat['Suggested Gem In'] = ''
-            runes_with_new_gemmed_stat['Logic']= ''
-            runes_with_new_gemmed_stat['Suggested Gem In'] = gem_in_stat
-            new_stat_value = gem_max_rolls.iloc[0][gem_in_stat]
-            runes_with_new_gemmed_stat['New '+gem_max_rolls[gem_in_stat].name] = new_stat_value
-            runes_with_new_gemmed_stat['Logic']= f'Gem In {new_stat_value} {gem_in_stat} Over {gem_out_stat}'
-            runes_with_all_gems.append(runes_with_new_gemmed_stat)
-
-    runes_with_all_gems = pd.concat(runes_with_all_gems).reset_index()
-
-    runes_with_all_gems_main_stat = runes_with_all_gems.drop(columns=['main_stat_type','Innate Stat']).set_index('rune_id').join(runes_df[['main_stat_type','Innate Stat']])
-       
-    runes_with_all_gems_and_max_grinds = grind_runes(runes_with_all_gems_main_stat)
-
-    runes_with_all_gems_and_max_grinds = get_new_stats(runes_with_all_gems_and_max_grinds)
-    #HP_value   ATK_value   DEF_value   SPD_value   CR_value    CD_value    ACC_value   RES_value
-    
-    maxed_runes = runes_with_all_gems_and_max_grinds.rename(columns={
-        'New HP':'HP'
-        ,'New ATK':'ATK'
-        ,'New DEF':'DEF'
-        ,'New SPD':'SPD'
-        ,'Base CR':'CR'
-        ,'Base CD':'CD'
-        ,'Base ACC':'ACC'
-        ,'Base RES':'RES'
-    })[['set_id','slot_no','main_stat_type','rune_id','Gemmed_Stat_Name','Suggested Gem In','Suggested Gem Out','HP','ATK','DEF','SPD','CR','CD','ACC','RES']]
     return maxed_runes
 
 popular_sets = ['VIOLENT','SWIFT','WILL','DESPAIR','INTANGIBLE']
 other_sets = ['REVENGE','RAGE','FIGHT','SEAL','BLADE','FOCUS','NEMESIS','DESTROY']
 
+desired_bonus = {
+    'HP': 1, # HP%  
+    'ATK': 1, # ATK%  
+    'DEF': 0.5, # DEF%  
+    'SPD': 1.5, # Speed
+    'CR': 1,
+    'CD': 0.5,
+    'ACC': 1,
+    'RES': 0.5,
+}
+
 def score_rune(row): 
     """
     Calculates the rune's score using the updated framework:
@@ -328,17 +603,6 @@ def score_rune(row):
       - Set-based bonuses/penalties.
     """
 
-    desired_bonus = {
-        'HP': 1, # HP%  
-        'ATK': 1, # ATK%  
-        'DEF': 0.5, # DEF%  
-        'SPD': 1.5, # Speed
-        'CR': 1,
-        'CD': 0.5,
-        'ACC': 1,
-        'RES': 0.5,
-    }
-    
     # Check if set is popular, other, or less desired
     # (Script’s own dictionaries: popular_sets, other_sets)
     set_name = str(row['set_id'])
@@ -453,6 +717,187 @@ def score_rune(row):
 
     return round(total_score, 2)
 
+def sub_stat_score(value, stat):
+    """
+    Array version of score_rune's per sub stat score: roll count, 3-roll/4-roll
+    threshold bonus and desired stat bonus. Missing or non-positive values score 0,
+    NaN values stay NaN.
+    """
+    max_roll = stat_roles[stat]
+    raw_roll_count = value / max_roll
+
+    # 3-roll => >= 3 * max_roll * 0.95, 4-roll => >= 4 * max_roll * 0.90
+    multi_rolls_above_2 = np.where(value >= 4 * max_roll * 0.90, 2,
+                                   np.where(value >= 3 * max_roll * 0.95, 1, 0))
+    multi_rolls_above_2 = np.where(raw_roll_count >= 3, multi_rolls_above_2, 0)
+
+    sub_score = raw_roll_count + desired_bonus.get(stat, 0)
+    sub_score = sub_score + multi_rolls_above_2
+
+    # skip missing or non-positive sub stats (NaN still propagates like in score_rune)
+    has_stat = ~(value <= 0)
+    return np.where(has_stat, sub_score, 0)
+
+def score_runes(runes_df):
+    """
+    Column-wise version of score_rune that scores every rune in the DataFrame at once.
+    Applies the same sub stat, threshold, innate, slot and set rules in the same order
+    so the result matches runes_df.apply(score_rune, axis=1).
+
+    Returns a Series of scores indexed like runes_df.
+    """
+    total_score = np.zeros(len(runes_df))
+
+    # B) Base Score from Sub Stats
+    for stat in stat_list:
+        if stat not in runes_df.columns:
+            continue
+        total_score = total_score + sub_stat_score(runes_df[stat].to_numpy(dtype=float), stat)
+
+    # C) Innate Penalty
+    if 'Innate Stat' in runes_df.columns and 'Innate Stat Value' in runes_df.columns:
+        innate_penalty = runes_df['Innate Stat'].isin(stat_list).to_numpy() & (runes_df['Innate Stat Value'].to_numpy(dtype=float) > 0)
+        total_score = total_score - np.where(innate_penalty, 0.5, 0)
+
+    # D) Slot-Based Modifiers
+    slot_no = runes_df['slot_no'].fillna(0).to_numpy().astype(int)
+    main_stat_type = runes_df['main_stat_type'].astype(str).str.upper().to_numpy()
+
+    is_flat_main = np.char.startswith(main_stat_type.astype(str), 'FLAT')
+    total_score = total_score - np.where(np.isin(slot_no, [2,4,6]) & is_flat_main, 2, 0)
+
+    slot_bonus = np.zeros(len(runes_df))
+    slot_bonus[(slot_no == 2) & (main_stat_type == 'SPD')] = 1
+    slot_bonus[(slot_no == 4) & np.isin(main_stat_type, ['HP','PERC HP'])] = 1.5
+    slot_bonus[(slot_no == 4) & np.isin(main_stat_type, ['CRIT RATE','CR','CRIT Dmg','CRIT DMG'])] = 1
+    slot_bonus[(slot_no == 6) & np.isin(main_stat_type, ['HP','PERC HP','ATK','PERC ATK'])] = 1
+    total_score = total_score + slot_bonus
+
+    # E) Set-Based Modifier
+    set_name = runes_df['set_id'].astype(str).to_numpy()
+    set_bonus = np.where(np.isin(set_name, popular_sets), 1, np.where(np.isin(set_name, other_sets), 0, -1))
+    total_score = total_score + set_bonus
+
+    # Python's round() is correctly rounded, np.round is not, so round each value the same way score_rune does
+    return pd.Series([round(score, 2) for score in total_score.tolist()], index=runes_df.index, dtype=float)
+
+def iter_top_gem_options(runes_df, k=3, by='New Total Rolls', min_value=None, chunk_size=4096):
+    """
+    Lazily yields the best k gem/grind options for each rune, ranked by 'New Total Rolls'
+    (same as get_rolls on all_gem_grind_combinations) or 'New Score' (same sub stat rules
+    as score_runes). Every stat's value is independent of the others, so each option's
+    value is the rune's maxed value plus the gem in stat's gain minus the gem out stat's loss.
+
+    Runes are processed chunk_size at a time. A rune's upper bound (its best gem in with
+    nothing gemmed out) is checked against min_value before any of its options are built.
+
+    Yields one dict per option with rune_id, Rank, Suggested Gem Out, Suggested Gem In and the value.
+    """
+    if by not in ['New Total Rolls', 'New Score']:
+        raise ValueError(f"by must be 'New Total Rolls' or 'New Score', not {by!r}")
+
+    gem_stats = list(stat_dict.values())
+    stat_names = np.array(gem_stats, dtype=object)
+    gem_max = gem_max_rolls.iloc[0][gem_stats].to_numpy(dtype=float)
+    max_grinds = gems_and_grinds[(gems_and_grinds['type'] == 'grind') & (gems_and_grinds['grade'] == GRADE_SETTING)].iloc[0]
+    grind_values = np.array([max_grinds[stat] if stat in ['HP','ATK','DEF','SPD'] else 0 for stat in gem_stats], dtype=float)
+
+    def stat_values(base):
+        # value of each stat once gemmed and max ground, flat stats are worth nothing
+        ground = np.where(base > 0, base + grind_values, base)
+        values = np.zeros(ground.shape)
+        for i, stat in enumerate(gem_stats):
+            if stat not in stat_list:
+                continue
+            if by == 'New Score':
+                values[..., i] = sub_stat_score(ground[..., i], stat)
+            else:
+                values[..., i] = np.where(ground[..., i] > 0, ground[..., i] / stat_roles[stat], 0)
+        return values
+
+    gem_in_values = stat_values(gem_max)
+    not_same_stat = ~np.eye(len(gem_stats), dtype=bool)
+    rune_columns = [col for col in ['slot_no','set_id','main_stat_type','Innate Stat','Innate Stat Value'] if col in runes_df.columns]
+
+    for start in range(0, len(runes_df), chunk_size):
+        chunk = runes_df.iloc[start:start + chunk_size]
+        base = chunk[['Base '+stat for stat in gem_stats]].fillna(0).to_numpy(dtype=float)
+        current_values = stat_values(base)
+        totals = current_values.sum(axis=1)
+        if by == 'New Score':
+            totals = totals + score_runes(chunk[rune_columns]).to_numpy()
+
+        gem_out_ok, gem_in_ok = gem_eligibility(chunk)
+        gem_in_gain = np.where(gem_in_ok, gem_in_values - current_values, -np.inf)
+        upper_bound = totals + gem_in_gain.max(axis=1)
+        keep = gem_out_ok.any(axis=1) & gem_in_ok.any(axis=1)
+        if min_value is not None:
+            keep &= upper_bound >= min_value
+        if not keep.any():
+            continue
+
+        # gain[rune, gem out, gem in], gemming out a different stat also loses that stat's value
+        current_values = current_values[keep]
+        gain = gem_in_gain[keep][:, None, :] - current_values[:, :, None] * not_same_stat
+        valid = gem_out_ok[keep][:, :, None] & gem_in_ok[keep][:, None, :]
+        option_values = np.where(valid, totals[keep][:, None, None] + gain, -np.inf).reshape(len(current_values), -1)
+        best = np.argsort(-option_values, axis=1, kind='stable')[:, :k]
+        best_values = np.take_along_axis(option_values, best, axis=1)
+        selected = best_values > -np.inf
+        if min_value is not None:
+            selected &= best_values >= min_value
+        rows, ranks = np.nonzero(selected)
+        gem_out_idx, gem_in_idx = np.divmod(best[rows, ranks], len(gem_stats))
+
+        # rescore only the selected options the same way get_rolls/score_runes would,
+        # so rounding matches the full all_gem_grind_combinations path exactly
+        new_base = base[keep][rows]
+        option_rows = np.arange(len(rows))
+        new_base[option_rows, gem_out_idx] = 0
+        new_base[option_rows, gem_in_idx] = gem_max[gem_in_idx]
+        new_stats = np.where(new_base > 0, new_base + grind_values, new_base)
+        options = chunk[keep].iloc[rows][rune_columns]
+        options = options.assign(**{stat: new_stats[:, gem_stats.index(stat)] for stat in stat_list})
+        if by == 'New Score':
+            values = score_runes(options).to_numpy()
+        else:
+            values = get_rolls(options)['New Total Rolls'].to_numpy()
+
+        # plain python values so callers building DataFrames from the dicts don't pay for numpy scalars
+        for rune_id, rank, gem_out, gem_in, value in zip(options.index.tolist(), (ranks + 1).tolist(),
+                                                         stat_names[gem_out_idx].tolist(), stat_names[gem_in_idx].tolist(),
+                                                         values.tolist()):
+            yield {
+                'rune_id': rune_id,
+                'Rank': rank,
+                'Suggested Gem Out': gem_out,
+                'Suggested Gem In': gem_in,
+                by: value,
+            }
+
+def scoring_version():
+    """
+    Returns a short hash of the constants that load_runes, all_gem_grind_combinations and
+    the scoring functions depend on, so cached results can be dropped when any of them change.
+    """
+    import hashlib
+    import json
+
+    constants = {
+        'GRADE_SETTING': GRADE_SETTING,
+        'gems_and_grinds_dict': gems_and_grinds_dict,
+        'stat_roles': stat_roles,
+        'main_stat_max': main_stat_max,
+        'gem_excluded_slots': gem_excluded_slots,
+        'set_id_dict': set_id_dict,
+        'stat_dict': stat_dict,
+        'grade_id_dict': grade_id_dict,
+        'desired_bonus': desired_bonus,
+        'popular_sets': popular_sets,
+        'other_sets': other_sets,
+    }
+    return hashlib.sha256(json.dumps(constants, sort_keys=True, default=str).encode()).hexdigest()[:12]
+
 def get_rolls(runes_df):
     runes_df['New Total Rolls'] = 0
     for stat in stat_list:
@@ -496,6 +941,156 @@ def find_reapp_targets(runes_df):
 
 import pandas as pd
 
+def to_bitset(present):
+    """
+    Packs a boolean array into a bitset of uint64 words, bit i of the set is row i.
+    """
+    n_words = (len(present) + 63) // 64
+    bits = np.zeros(n_words * 64, dtype=bool)
+    bits[:len(present)] = present
+    return np.packbits(bits, bitorder='little').view('<u8').copy()
+
+def bitset_rows(bitset, n):
+    """
+    Returns the row positions set in a bitset of n rows.
+    """
+    return np.flatnonzero(np.unpackbits(bitset.view(np.uint8), bitorder='little')[:n])
+
+def bitset_at_least(bitsets, k):
+    """
+    Returns the bitset of rows that are set in at least k of the (non-empty list of) bitsets.
+    The bitsets are added up with a bit-sliced counter, bit planes of each row's count,
+    so rows are never looked at one by one, then the planes are compared with k.
+    """
+    if k <= 0:
+        return ~np.zeros_like(bitsets[0])
+    planes = []
+    for bitset in bitsets:
+        carry = bitset
+        for i, plane in enumerate(planes):
+            planes[i], carry = plane ^ carry, plane & carry
+        planes.append(carry)
+    if k >= 1 << len(planes):
+        return np.zeros_like(bitsets[0])
+
+    # compare the count with k from the highest bit down
+    greater = np.zeros_like(bitsets[0])
+    equal = ~greater
+    for i in reversed(range(len(planes))):
+        if (k >> i) & 1:
+            equal = equal & planes[i]
+        else:
+            greater = greater | (equal & planes[i])
+            equal = equal & ~planes[i]
+    return greater | equal
+
+class RuneView:
+    """
+    Rows of a DataFrame or RuneTable selected by a RuneIndex query. Only the row positions
+    (and each row's matching sub stat count) are kept until to_dataframe() is called.
+    """
+
+    def __init__(self, runes, rows, num_substats):
+        self.runes = runes
+        self.rows = rows
+        self.num_substats = num_substats
+
+    def __len__(self):
+        return len(self.rows)
+
+    @property
+    def rune_ids(self):
+        if isinstance(self.runes, RuneTable):
+            return self.runes.rune_id[self.rows]
+        return self.runes.index.to_numpy()[self.rows]
+
+    def to_dataframe(self):
+        """
+        Returns the selected runes with a 'num_substats' column, like find_runes.
+        """
+        if isinstance(self.runes, RuneTable):
+            df = self.runes.take(self.rows).to_dataframe()
+        else:
+            df = self.runes.iloc[self.rows].copy()
+        df["num_substats"] = self.num_substats.astype(np.int64)
+        return df
+
+class RuneIndex:
+    """
+    Inverted index over a load_runes DataFrame or a RuneTable for find_runes queries.
+    Holds one bitset per set, per slot, per (slot, main stat) and per sub stat
+    (Base or Gemmed value above 0), so a query is a handful of bitwise operations
+    over n_runes / 64 words. Build it once per inventory and query it many times.
+    """
+
+    def __init__(self, runes):
+        self.runes = runes
+        if isinstance(runes, RuneTable):
+            set_id = np.array(set_names, dtype=object)[runes.set_code]
+            slot_no = runes.slot_no
+            main_stat_type = np.array(stat_names, dtype=object)[runes.main_stat_code]
+            present = {stat: runes.base[:, i] > 0 for i, stat in enumerate(stat_names)}
+        else:
+            set_id = runes['set_id'].to_numpy()
+            slot_no = runes['slot_no'].to_numpy()
+            main_stat_type = runes['main_stat_type'].to_numpy()
+            present = {}
+            for stat in stat_names:
+                has_stat = np.zeros(len(runes), dtype=bool)
+                for column in ['Base ' + stat, 'Gemmed ' + stat]:
+                    if column in runes.columns:
+                        has_stat |= runes[column].to_numpy(dtype=float) > 0
+                present[stat] = has_stat
+
+        self.n = len(runes)
+        self.all_rows = to_bitset(np.ones(self.n, dtype=bool))
+        self.empty = np.zeros_like(self.all_rows)
+        self.sets = {name: to_bitset(set_id == name) for name in pd.unique(set_id)}
+        self.slots = {slot: to_bitset(slot_no == slot) for slot in pd.unique(slot_no)}
+        self.slot_main_stats = {}
+        slot_main = pd.DataFrame({'slot_no': slot_no, 'main_stat_type': main_stat_type})
+        for key, rows in slot_main.groupby(['slot_no','main_stat_type'], sort=False).indices.items():
+            in_group = np.zeros(self.n, dtype=bool)
+            in_group[rows] = True
+            self.slot_main_stats[key] = to_bitset(in_group)
+        self.sub_stats = {stat: to_bitset(has_stat) for stat, has_stat in present.items()}
+
+    @property
+    def nbytes(self):
+        bitsets = list(self.sets.values()) + list(self.slots.values()) + list(self.slot_main_stats.values()) + list(self.sub_stats.values())
+        return sum(bitset.nbytes for bitset in bitsets)
+
+    def query(self, sets=[], slot_2=[], slot_4=[], slot_6=[], sub_stats=[], min_sub_stats=3):
+        """
+        Returns a RuneView of the runes find_runes would return for the same arguments.
+        """
+        mask = self.all_rows.copy()
+        if sets:
+            sets = list(sets) if 'INTANGIBLE' in sets else list(sets) + ['INTANGIBLE']
+            in_sets = self.empty.copy()
+            for name in sets:
+                in_sets |= self.sets.get(name, self.empty)
+            mask &= in_sets
+
+        for slot, slot_main_stats in [(2, slot_2), (4, slot_4), (6, slot_6)]:
+            if slot_main_stats:
+                allowed = ~self.slots.get(slot, self.empty)
+                for main_stat in slot_main_stats:
+                    allowed = allowed | self.slot_main_stats.get((slot, main_stat), self.empty)
+                mask &= allowed
+
+        # a stat listed twice counts twice, like find_runes
+        stat_bitsets = [self.sub_stats.get(stat, self.empty) for stat in sub_stats]
+        mask &= bitset_at_least(stat_bitsets or [self.empty], min_sub_stats)
+
+        rows = bitset_rows(mask, self.n)
+        # count the matching sub stats of the selected rows only
+        words, bits = rows >> 6, (rows & 63).astype(np.uint64)
+        num_substats = np.zeros(len(rows), dtype=np.int64)
+        for bitset in stat_bitsets:
+            num_substats += ((bitset[words] >> bits) & np.uint64(1)).astype(np.int64)
+        return RuneView(self.runes, rows, num_substats)
+
 def find_runes(
     runes_df: pd.DataFrame,
     sets: list = [],
@@ -514,55 +1109,60 @@ def find_runes(
          the given 'sub_stats' (checking 'Base XYZ' or 'Gemmed XYZ' != 0).
 
     Returns the filtered DataFrame of runes that meet all criteria.
+    runes_df can also be a RuneTable or a RuneIndex, build a RuneIndex once
+    to run many queries over the same runes.
     """
+    rune_index = runes_df if isinstance(runes_df, RuneIndex) else RuneIndex(runes_df)
 
-    df = runes_df.copy()
-
-    # --- 1. Filter by sets ---
-    if sets:
-        # add INTANGIBLE if it's not already in sets
-        if 'INTANGIBLE' not in sets:
-            sets.append('INTANGIBLE')
-        df = df[df["set_id"].isin(sets)]
-
-    # --- 2. Filter by slot & main stat ---
-    def slot_mainstat_ok(row):
-        s = row["slot_no"]
-        m = row["main_stat_type"]  # e.g. "SPD", "CD", "HP", "Flat HP", etc.
-
-        if s == 2 and slot_2:  # If the user provided a constraint for slot 2
-            return m in slot_2
-        if s == 4 and slot_4:
-            return m in slot_4
-        if s == 6 and slot_6:
-            return m in slot_6
-        # For slots 1,3,5 or if no constraint was given for that slot,
-        # just allow it (return True).
-        return True
-
-    df = df[df.apply(slot_mainstat_ok, axis=1)]
-
-    # --- 3. Filter by number of sub-stats present ---
-    # We'll assume "sub_stats" are exactly the names like "HP", "DEF", "Flat HP", "ACC", etc.
-    # And that the columns for them are "Base HP", "Gemmed HP", etc.
-    # We'll check if either Base or Gemmed is > 0.
-
-    def count_substats(row, sub_stats):
-        count = 0
-        for stat in sub_stats:
-            base_col = f"Base {stat}"
-            gemmed_col = f"Gemmed {stat}"
-            base_val = row.get(base_col, 0) or 0
-            gem_val = row.get(gemmed_col, 0) or 0
-            # If either is nonzero, we consider that sub-stat present
-            if base_val > 0 or gem_val > 0:
-                count += 1
-        return count
-
-    df["num_substats"] = df.apply(lambda r: count_substats(r, sub_stats), axis=1)
-    df = df[df["num_substats"] >= min_sub_stats]
+    # add INTANGIBLE if it's not already in sets
+    if sets and 'INTANGIBLE' not in sets:
+        sets.append('INTANGIBLE')
 
-    return df
+    return rune_index.query(sets, slot_2, slot_4, slot_6, sub_stats, min_sub_stats).to_dataframe()
+
+grade_categories = ['max_value','high_value','some_value','no_value','negative_value']
+
+def grade_runes_profiles(runes_df, profiles) -> pd.DataFrame:
+    """
+    Grades every rune against P value profiles at once.
+    profiles is a {name: profile} dictionary (or a list of profiles) where each profile
+    has the grade_runes_sub_stats keyword lists: max_value, high_value, some_value,
+    no_value and negative_value.
+
+    Each stat's rolls are (Base + Gemmed) / stat_roles, and the rules are applied to
+    the whole (n_runes x stats) roll matrix: rolls x 2 for max, min(rolls, 2) x 1.5 for
+    high, min(rolls, 1) for some, 0 for no and -rolls for negative value stats. A stat in
+    more than one list takes the first rule. Returns an (n_runes x P) DataFrame of
+    grade scores rounded to 2 decimals, with one column per profile.
+    """
+    runes_df = as_runes_df(runes_df)
+    if not isinstance(profiles, dict):
+        profiles = dict(enumerate(profiles))
+
+    stats = list(dict.fromkeys(stat for profile in profiles.values() for category in grade_categories for stat in profile.get(category, [])))
+    rolls = np.zeros((len(runes_df), len(stats)))
+    for i, stat in enumerate(stats):
+        if not stat_roles.get(stat, 0):
+            continue
+        for column in ['Base ' + stat, 'Gemmed ' + stat]:
+            if column in runes_df.columns:
+                rolls[:, i] += np.nan_to_num(runes_df[column].to_numpy(dtype=float))
+        rolls[:, i] /= stat_roles[stat]
+
+    # one (stats x P) weight matrix per rule, 1 where the profile puts the stat under that rule
+    weights = np.zeros((len(grade_categories), len(stats), len(profiles)))
+    for p, profile in enumerate(profiles.values()):
+        for i, stat in enumerate(stats):
+            for k, category in enumerate(grade_categories):
+                if stat in profile.get(category, []):
+                    weights[k, i, p] = 1
+                    break
+
+    scores = (rolls * 2.0) @ weights[0]
+    scores += (np.minimum(rolls, 2) * 1.5) @ weights[1]
+    scores += np.minimum(rolls, 1) @ weights[2]
+    scores -= rolls @ weights[4]
+    return pd.DataFrame(np.round(scores, 2), index=runes_df.index, columns=list(profiles))
 
 def grade_runes_sub_stats(runes_df,
                           max_value=[],
@@ -578,57 +1178,13 @@ def grade_runes_sub_stats(runes_df,
 
     Returns a copy of the passed DataFrame with a 'grade_score'
     column, summing each rune's sub-stat scores.
+    Use grade_runes_profiles to grade against several profiles at once.
     """
-    import math
-    
-    df = runes_df.copy()
-
-    # Collect all relevant sub-stats into one list:
-    all_stats = set(max_value + high_value + some_value + no_value + negative_value)
-
-    def substat_rolls(row, stat):
-        base_col   = f"Base {stat}"
-        gemmed_col = f"Gemmed {stat}"
-
-        base_val = row.get(base_col, 0)
-        gem_val  = row.get(gemmed_col, 0)
-
-        # Convert any numeric NaNs to 0
-        if isinstance(base_val, float) and math.isnan(base_val):
-            base_val = 0
-        if isinstance(gem_val, float) and math.isnan(gem_val):
-            gem_val = 0
-
-        total_val = base_val + gem_val
-
-        # Convert total_val into "rolls"
-        divisor = stat_roles.get(stat, 0)
-        if divisor == 0:
-            return 0.0
-        return total_val / divisor
-
-    def get_sub_score(roll_count, stat):
-        # The weighting logic
-        if stat in max_value:
-            return roll_count * 2.0
-        elif stat in high_value:
-            return min(roll_count, 2) * 1.5
-        elif stat in some_value:
-            return min(roll_count, 1) * 1.0
-        elif stat in no_value:
-            return 0.0
-        elif stat in negative_value:
-            return -1.0 * roll_count
-        return 0.0
-
-    def calc_rune_score(row):
-        total_score = 0.0
-        for stat in all_stats:
-            rc = substat_rolls(row, stat)
-            total_score += get_sub_score(rc, stat)
-        return round(total_score, 2)
-
-    df["grade_score"] = df.apply(calc_rune_score, axis=1)
+    df = as_runes_df(runes_df).copy()
+
+    profile = {'max_value': max_value, 'high_value': high_value, 'some_value': some_value,
+               'no_value': no_value, 'negative_value': negative_value}
+    df["grade_score"] = grade_runes_profiles(df, [profile])[0].to_numpy()
 
     # Now reorder columns so that 'grade_score' is right after 'main_stat_type'.
     # We'll do this only if both columns actually exist in the DataFrame.
@@ -644,16 +1200,196 @@ def grade_runes_sub_stats(runes_df,
 
     return df
 
+percentile_levels = {'Slot': ['slot_no','main_stat_type'], 'Set': ['slot_no','main_stat_type','set_id']}
+
+class PercentileIndex:
+    """
+    Sorted values of several metrics for every (slot, main stat) and (slot, main stat, set) group.
+    A percentile is two binary searches into the group's sorted values and gives the same
+    average rank as groupby(...).rank(pct=True), so percentiles of the indexed runes, of
+    runes that are not indexed and of hypothetical values (a gem option, a reapp outcome)
+    can be looked up without ranking the table again. NaN values are not indexed.
+    """
+
+    def __init__(self, rune_df, metrics):
+        self.metrics = list(metrics)
+        self.groups = {level: {} for level in percentile_levels}
+        self.insert(rune_df)
+
+    def group_rows(self, rune_df, level):
+        # {group key: row positions}, rows with a missing key aren't in any group
+        return rune_df.groupby(percentile_levels[level], sort=False).indices
+
+    def insert(self, rune_df):
+        """
+        Adds the metric values of every row of rune_df to its groups.
+        """
+        rune_df = as_runes_df(rune_df)
+        values = {metric: rune_df[metric].to_numpy(dtype=float) for metric in self.metrics}
+        for level, groups in self.groups.items():
+            for key, rows in self.group_rows(rune_df, level).items():
+                group = groups.setdefault(key, {metric: np.empty(0) for metric in self.metrics})
+                for metric in self.metrics:
+                    new_values = np.sort(values[metric][rows])
+                    new_values = new_values[~np.isnan(new_values)]
+                    group[metric] = np.insert(group[metric], np.searchsorted(group[metric], new_values), new_values)
+
+    def remove(self, rune_df):
+        """
+        Removes the metric values of every row of rune_df from its groups.
+        Raises KeyError if a value isn't in the index.
+        """
+        rune_df = as_runes_df(rune_df)
+        values = {metric: rune_df[metric].to_numpy(dtype=float) for metric in self.metrics}
+        for level, groups in self.groups.items():
+            for key, rows in self.group_rows(rune_df, level).items():
+                for metric in self.metrics:
+                    old_values = np.sort(values[metric][rows])
+                    old_values = old_values[~np.isnan(old_values)]
+                    sorted_values = groups[key][metric] if key in groups else np.empty(0)
+                    # equal values are removed from consecutive positions
+                    positions = np.searchsorted(sorted_values, old_values) + np.arange(len(old_values)) - np.searchsorted(old_values, old_values)
+                    if np.any(positions >= len(sorted_values)) or np.any(sorted_values[np.minimum(positions, len(sorted_values) - 1)] != old_values):
+                        raise KeyError(f'{metric} values of {key} are not in the index')
+                    groups[key][metric] = np.delete(sorted_values, positions)
+
+    def rank(self, sorted_values, values):
+        # average rank of each value among the sorted values, as a fraction of the group size.
+        # searching the distinct values in order is much faster than searching every value
+        unique_values, inverse = np.unique(values, return_inverse=True)
+        less = np.searchsorted(sorted_values, unique_values, 'left')
+        equal = np.searchsorted(sorted_values, unique_values, 'right') - less
+        ranks = ((less + (equal + 1) / 2) / len(sorted_values))[inverse.reshape(-1)]
+        return np.where(np.isnan(values), np.nan, ranks)
+
+    def percentile(self, metric, value, slot_no, main_stat_type, set_id=None):
+        """
+        Returns the percentile of value in the (slot_no, main_stat_type) group, or in the
+        (slot_no, main_stat_type, set_id) group when set_id is given. For an indexed value
+        this is its rank(pct=True), any other value is placed as if it were between its neighbours.
+        """
+        level, key = ('Slot', (slot_no, main_stat_type)) if set_id is None else ('Set', (slot_no, main_stat_type, set_id))
+        group = self.groups[level].get(key)
+        if group is None or not len(group[metric]):
+            return np.nan
+        return float(self.rank(group[metric], np.array([value], dtype=float))[0])
+
+    def percentiles(self, rune_df, metric, level='Slot'):
+        """
+        Returns the percentile of every row's metric value in its group, as an array.
+        """
+        return self.percentile_frame(rune_df, [metric], [level]).iloc[:, 0].to_numpy()
+
+    def percentile_frame(self, rune_df, metrics=None, levels=None):
+        """
+        Returns '<level> <metric> Percentile' columns for every metric, indexed like rune_df.
+        Each level groups rune_df once for all the metrics.
+        """
+        rune_df = as_runes_df(rune_df)
+        metrics = self.metrics if metrics is None else metrics
+        levels = list(percentile_levels) if levels is None else levels
+        values = {metric: rune_df[metric].to_numpy(dtype=float) for metric in metrics}
+        result = {(level, metric): np.full(len(rune_df), np.nan) for level in levels for metric in metrics}
+        for level in levels:
+            groups = self.groups[level]
+            for key, rows in self.group_rows(rune_df, level).items():
+                for metric in metrics:
+                    if key in groups and len(groups[key][metric]):
+                        result[level, metric][rows] = self.rank(groups[key][metric], values[metric][rows])
+        return pd.DataFrame({f'{level} {metric} Percentile': result[level, metric] for metric in metrics for level in levels},
+                            index=rune_df.index)
+
 def find_percentiles(rune_df: pd.DataFrame,col: str) -> pd.DataFrame:
     col_list = ['slot_no','set_id','main_stat_type',col]
+    rune_df = as_runes_df(rune_df, col_list)
     df = rune_df[col_list].copy()
 
-    df['Slot Percentile'] = rune_df.groupby(['slot_no','main_stat_type'])[col].rank(pct=True)
-    df['Set Percentile'] = rune_df.groupby(['slot_no','main_stat_type','set_id'])[col].rank(pct=True)
+    percentiles = PercentileIndex(df, [col]).percentile_frame(df)
+    df['Slot Percentile'] = percentiles[f'Slot {col} Percentile'].to_numpy()
+    df['Set Percentile'] = percentiles[f'Set {col} Percentile'].to_numpy()
     
     return df
 
+def update_percentiles(percentile_df: pd.DataFrame, rune_df: pd.DataFrame, col: str, changed_ids) -> pd.DataFrame:
+    """
+    Updates find_percentiles output for a new rune_df where only the runes in changed_ids
+    were added, removed or modified, instead of ranking every group again.
+    Groups without changed runes keep their percentiles. In the other groups, rows of
+    unchanged runes shift their average rank by the changed values below or equal to them
+    and rows of changed runes are ranked against their group.
+    """
+    col_list = ['slot_no','set_id','main_stat_type',col]
+    rune_df = as_runes_df(rune_df, col_list)
+    df = rune_df[col_list].copy()
+
+    kept = ~percentile_df.index.isin(changed_ids)
+    new_rows = df.index.isin(changed_ids)
+    if not np.array_equal(percentile_df.index[kept], df.index[~new_rows]):
+        # unchanged runes were reordered, rank from scratch
+        return find_percentiles(rune_df, col)
+
+    removed = percentile_df[~kept]
+    value = df[col].to_numpy(dtype=float)
+    removed_value = removed[col].to_numpy(dtype=float)
+
+    # number the groups of old and new rows together: slot, then main stat, then set
+    key_codes = {}
+    for key in ['slot_no','main_stat_type','set_id']:
+        codes, uniques = pd.factorize(np.concatenate([df[key].to_numpy(), removed[key].to_numpy()]))
+        key_codes[key] = (codes, len(uniques))
+    slot_codes = key_codes['slot_no'][0] * key_codes['main_stat_type'][1] + key_codes['main_stat_type'][0]
+    set_codes = slot_codes * key_codes['set_id'][1] + key_codes['set_id'][0]
+
+    for name, all_codes in [('Slot Percentile', slot_codes), ('Set Percentile', set_codes)]:
+        codes, removed_codes = all_codes[:len(df)], all_codes[len(df):]
+        percentile = np.full(len(df), np.nan)
+        percentile[~new_rows] = percentile_df[name].to_numpy()[kept]
+
+        # rows of the touched groups, sorted by group so each group is one slice
+        touched = np.unique(np.concatenate([codes[new_rows], removed_codes]))
+        touched_rows = np.flatnonzero(np.isin(codes, touched))
+        touched_rows = touched_rows[np.argsort(codes[touched_rows], kind='stable')]
+        starts = np.searchsorted(codes[touched_rows], touched, 'left')
+        ends = np.searchsorted(codes[touched_rows], touched, 'right')
+
+        for code, start, end in zip(touched, starts, ends):
+            rows = touched_rows[start:end]
+            group_value = value[rows]
+            is_new = new_rows[rows]
+            valid_value = group_value[~np.isnan(group_value)]
+            added_value = np.sort(group_value[is_new & ~np.isnan(group_value)])
+            gone_value = removed_value[removed_codes == code]
+            gone_value = np.sort(gone_value[~np.isnan(gone_value)])
+            count = len(valid_value)
+            previous_count = count - len(added_value) + len(gone_value)
+
+            # twice an average rank is a whole number, so the previous ranks come back exactly
+            old_value = group_value[~is_new]
+            doubled_rank = np.rint(percentile[rows[~is_new]] * previous_count * 2)
+            for sorted_value, sign in [(added_value, 1), (gone_value, -1)]:
+                less = np.searchsorted(sorted_value, old_value, 'left')
+                equal = np.searchsorted(sorted_value, old_value, 'right') - less
+                doubled_rank += sign * (2 * less + equal)
+            percentile[rows[~is_new]] = doubled_rank / 2 / count
+
+            new_value = group_value[is_new]
+            valid_value = np.sort(valid_value)
+            less = np.searchsorted(valid_value, new_value, 'left')
+            equal = np.searchsorted(valid_value, new_value, 'right') - less
+            percentile[rows[is_new]] = np.where(np.isnan(new_value), np.nan, (less + (equal + 1) / 2) / count)
+
+        df[name] = percentile
+
+    return df
+
 def check_hero_gem(rune_df: pd.DataFrame) -> pd.DataFrame:
+    # a RuneTable can't take new columns, so return the 'Max Hero Gem' flags instead
+    if isinstance(rune_df, RuneTable):
+        gem_max = gem_max_rolls.iloc[0][stat_names].to_numpy(dtype=float)
+        gemmed, gemmed_idx = rune_df.gemmed_stat_index()
+        gemmed_base = np.take_along_axis(rune_df.base, gemmed_idx[:, None], axis=1)[:, 0]
+        return pd.Series(gemmed & (gemmed_base >= gem_max[gemmed_idx]), index=rune_df.rune_id, name='Max Hero Gem')
+
     no_gem_mask = rune_df[rune_df['Gemmed_Stat_Name'].isna()]
     rune_df.loc[no_gem_mask.index,'Max Hero Gem'] = False
     for stat in stat_dict.values():
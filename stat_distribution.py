@@ -1,11 +1,18 @@
 # %%
 import os
+import json
+import hashlib
+import multiprocessing
+import shutil
+import numpy as np
 import pandas as pd
 from datetime import datetime
 import importlib
 
 import runes
 importlib.reload(runes)
+import export_cache
+import player_store
 from runes import main_stat_max, impossible_sub_stats, grind, stat_roles
 
 # --- Functions for Loading Data ---
@@ -15,14 +22,7 @@ def load_data(file_path):
     Loads CSV data into a pandas DataFrame.
     Attempts several delimiters.
     """
-    try:
-        df = pd.read_csv(file_path, sep=",")
-    except pd.errors.ParserError:
-        try:
-            df = pd.read_csv(file_path, sep=r'\s+', engine='python')
-        except pd.errors.ParserError:
-            df = pd.read_csv(file_path, sep=";")
-    return df
+    return player_store.read_player_csv(file_path)
 
 def load_set_bonuses(file_path):
     """
@@ -42,14 +42,18 @@ def load_set_bonuses(file_path):
 
 # --- Data Filtering and Grouping ---
 
+def date_cutoff():
+    """
+    Returns January 1 of last year, the oldest Data Age the analysis keeps.
+    """
+    return datetime(year=datetime.today().year - 1, month=1, day=1)
+
 def filter_data_by_date(df):
     """
     Filters the DataFrame to include only builds with Data Age on or after January 1 of last year.
     """
-    today = datetime.today()
-    january_first_last_year = datetime(year=today.year - 1, month=1, day=1)
     df['Data Age'] = pd.to_datetime(df['Data Age'], errors='coerce')
-    return df[df['Data Age'] >= january_first_last_year].copy()
+    return df[df['Data Age'] >= date_cutoff()].copy()
 
 def filter_data(df):
     """
@@ -68,17 +72,16 @@ def group_builds_by_set(df):
     """
     df = df.copy()
     # Create a tuple from the three set columns (order matters here if desired; for order-agnostic, sort the tuple)
-    df['Set_Build'] = df.apply(lambda row: (str(row.get("Set1", "")).strip(),
-                                            str(row.get("Set2", "")).strip(),
-                                            str(row.get("Set3", "")).strip()), axis=1)
-    grouped = df.groupby("Set_Build")
-    selected_rows = []
-    for set_build, group in grouped:
-        count = len(group)
-        best_build = group.sort_values(by='Score', ascending=False).iloc[0].copy()
-        best_build['Build Count'] = count
-        selected_rows.append(best_build)
-    return pd.DataFrame(selected_rows)
+    set_columns = [df[col].astype(str).str.strip() if col in df.columns else pd.Series('', index=df.index)
+                   for col in ["Set1", "Set2", "Set3"]]
+    df['Set_Build'] = list(zip(*set_columns))
+    # best build of each group by position, so duplicate index labels don't matter
+    keys = [col.to_numpy() for col in set_columns]
+    scores = pd.Series(df['Score'].fillna(-np.inf).to_numpy())
+    grouped = scores.groupby(keys)
+    best_rows = df.iloc[grouped.idxmax().to_numpy()].copy()
+    best_rows['Build Count'] = grouped.size().to_numpy()
+    return best_rows
 
 # --- Rune Main Stat Contributions ---
 
@@ -247,33 +250,237 @@ def estimate_rolls_for_build(build, base_stats, set_bonus_data):
     
     return estimated_rolls
 
+# --- Column-wise Roll Estimation ---
+
+stat_names = ["HP", "ATK", "DEF", "SPD", "CR", "CD", "ACC", "RES"]
+percent_stats = ["HP", "ATK", "DEF"]
+
+# variable slot main stat (lower case) -> stat it adds to
+variable_main_stat_names = {"spd": "SPD", "hp": "HP", "%hp": "HP", "atk": "ATK", "%atk": "ATK", "def": "DEF", "%def": "DEF",
+                            "cr": "CR", "cd": "CD", "acc": "ACC", "res": "RES"}
+
+def eligible_slot_table():
+    """
+    Returns a (6 slots x 8 stats) boolean table of the slots that can carry each substat:
+    not disallowed by impossible_sub_stats and not the fixed main stat of slots 1, 3 and 5.
+    A variable slot's main stat still has to be checked per build.
+    """
+    table = np.ones((6, len(stat_names)), dtype=bool)
+    for j, stat in enumerate(stat_names):
+        for slot in impossible_sub_stats.get(stat, []):
+            table[slot - 1, j] = False
+    for slot, (stat_key, _) in get_fixed_main_stats().items():
+        table[slot - 1, stat_names.index(stat_key)] = False
+    return table
+
+def set_bonus_table(set_bonus_data, base_stats):
+    """
+    Returns the set names and a (sets + 1 x 8 stats) array of the bonus each set adds,
+    with a last row of zeros for sets without a bonus.
+    """
+    set_names = list(set_bonus_data)
+    table = np.zeros((len(set_names) + 1, len(stat_names)))
+    for i, set_name in enumerate(set_names):
+        bonus_stat, amount = set_bonus_data[set_name]["Stat"], set_bonus_data[set_name]["Amount"]
+        if bonus_stat in percent_stats or bonus_stat == "SPD":
+            table[i, stat_names.index(bonus_stat)] = base_stats[bonus_stat] * (amount / 100.0)
+        else:
+            table[i, stat_names.index(bonus_stat)] = amount
+    return set_names, table
+
+def estimate_rolls(builds, base_stats, set_bonus_data):
+    """
+    Column-wise estimate_rolls_for_build for every row of builds at once.
+    Returns a DataFrame with one column of estimated rolls per stat, aligned with builds.
+    """
+    if not len(builds):
+        return pd.DataFrame(0, columns=stat_names, index=builds.index)
+    base = np.array([base_stats[stat] for stat in stat_names], dtype=float)
+    residual = builds[stat_names].to_numpy(dtype=float) - base
+
+    # fixed main stats (slots 1,3,5)
+    for slot, (stat_key, value) in get_fixed_main_stats().items():
+        residual[:, stat_names.index(stat_key)] -= value
+
+    # variable main stats (slots 2,4,6), matched once per distinct main stat
+    main_stat_bonus = np.array([base_stats[stat] * main_stat_max[stat] / 100.0 if stat in percent_stats else main_stat_max[stat]
+                                for stat in stat_names])
+    stat_lower = np.array([stat.lower() for stat in stat_names], dtype=object)
+    same_as_main = []
+    for slot in [2, 4, 6]:
+        mains = builds[f"Slot{slot}"].fillna("").to_numpy() if f"Slot{slot}" in builds.columns else np.full(len(builds), "", dtype=object)
+        # strings are only cleaned up once per distinct value
+        codes, uniques = pd.factorize(mains)
+        uniques = np.array([str(m).strip().lower() for m in uniques], dtype=object)
+        main_index = np.array([stat_names.index(variable_main_stat_names[m]) if m in variable_main_stat_names else -1 for m in uniques], dtype=int)
+        stat_index = main_index[codes]
+        has_main = stat_index >= 0
+        residual[np.flatnonzero(has_main), stat_index[has_main]] -= main_stat_bonus[stat_index[has_main]]
+        same_as_main.append((uniques[:, None] == stat_lower[None, :])[codes])
+
+    # set bonuses from the set -> stat lookup
+    set_names, bonus_table = set_bonus_table(set_bonus_data, base_stats)
+    set_lookup = pd.Series(np.arange(len(set_names)), index=set_names)
+    for col in ["Set1", "Set2", "Set3"]:
+        if col in builds.columns:
+            codes, uniques = pd.factorize(builds[col].to_numpy(), use_na_sentinel=False)
+            set_index = pd.Series([str(name).strip().lower() for name in uniques], dtype=object).map(set_lookup).fillna(len(set_names))
+            residual -= bonus_table[set_index.to_numpy(dtype=int)[codes]]
+
+    # eligible slots per stat, minus variable slots whose main stat is the substat
+    table = eligible_slot_table()
+    available = table.sum(axis=0) - (np.stack(same_as_main) & table[[1, 3, 5]][:, None, :]).sum(axis=0)
+
+    grind_bonus = np.array([grind["legend"].get(stat, 0) if stat in percent_stats or stat == "SPD" else 0 for stat in stat_names])
+    per_roll = np.array([stat_roles[stat] for stat in stat_names], dtype=float)
+    is_percent = np.isin(stat_names, percent_stats)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        bonus = np.where(is_percent, residual / base * 100, residual)
+        avg_bonus = bonus / available
+        adjusted_bonus = np.fmax(0, avg_bonus - grind_bonus)
+        total_rolls = adjusted_bonus / per_roll * available
+    rolls = np.where(available > 0, np.round(total_rolls), 0).astype(int)
+    return pd.DataFrame(rolls, columns=stat_names, index=builds.index)
+
 def analyze_set_builds(df, base_stats, set_bonus_data):
     """
     Processes the filtered builds:
       1. Groups builds by their set combination (Set1, Set2, Set3).
       2. For each group, selects the most efficient build (highest Score) and counts the frequency.
-      3. Computes the substat roll distribution for each selected build.
+      3. Computes the substat roll distribution for all selected builds at once.
     
     Returns a DataFrame with each set build, its count, and estimated roll distribution,
     and a separate DataFrame with the average distribution across all set builds.
     """
     grouped_df = group_builds_by_set(df)
-    results = []
-    for _, row in grouped_df.iterrows():
-        rolls = estimate_rolls_for_build(row, base_stats, set_bonus_data)
-        result = {
-            "Set_Build": row['Set_Build'],
-            "Build Count": row.get("Build Count", 1),
-            "Score": row["Score"]
-        }
-        result.update(rolls)
-        results.append(result)
-    results_df = pd.DataFrame(results)
+    results_df = pd.DataFrame({
+        "Set_Build": grouped_df['Set_Build'].to_numpy(),
+        "Build Count": grouped_df["Build Count"].to_numpy(),
+        "Score": grouped_df["Score"].to_numpy()
+    })
+    rolls = estimate_rolls(grouped_df, base_stats, set_bonus_data)
+    results_df[stat_names] = rolls.to_numpy()
     results_df.sort_values(by="Build Count", ascending=False, inplace=True)
     avg_distribution = results_df[["HP", "ATK", "DEF", "SPD", "CR", "CD", "ACC", "RES"]].mean().round().astype(int)
     avg_distribution_df = pd.DataFrame(avg_distribution).transpose()
     return results_df, avg_distribution_df
 
+# --- Roster-wide Analysis ---
+
+# Bump when the analysis changes so cached results are recomputed.
+DISTRIBUTION_CACHE_VERSION = 1
+
+def player_data_files(player_dir='player_data'):
+    """
+    Returns {file name without .csv: path} for every player data CSV in player_dir.
+    """
+    return {os.path.splitext(name)[0]: os.path.join(player_dir, name)
+            for name in sorted(os.listdir(player_dir)) if name.endswith('.csv')}
+
+def analyze_player_file(task):
+    """
+    Runs the analysis for one monster's player data. task is (monster, CSV path or DataFrame of builds,
+    base stats, set bonus data), so it can be sent to a worker process.
+    Returns (monster, set builds DataFrame with a 'Monster' column).
+    """
+    monster, source, base_stats, set_bonus_data = task
+    df = load_data(source) if isinstance(source, str) else source
+    if not df.empty:
+        df = filter_data(filter_data_by_date(df))
+    if df.empty:
+        return monster, pd.DataFrame(columns=['Monster', 'Set_Build', 'Build Count', 'Score'] + stat_names)
+    set_builds_df, _ = analyze_set_builds(df, base_stats, set_bonus_data)
+    set_builds_df.insert(0, 'Monster', monster)
+    return monster, set_builds_df.reset_index(drop=True)
+
+def distribution_cache_key(csv_hash, base_stats, set_bonus_data):
+    """
+    Keys a monster's cached results on its CSV's content (or its player_store signature), its base stats,
+    the set bonuses and the date filter's cutoff year, so a change to any of them reprocesses the monster.
+    """
+    settings = [csv_hash, base_stats, set_bonus_data, date_cutoff().year, DISTRIBUTION_CACHE_VERSION]
+    return hashlib.sha256(json.dumps(settings, sort_keys=True, default=str).encode()).hexdigest()[:24]
+
+def analyze_roster(base_stats_by_monster, player_dir='player_data', set_bonus_file='set_bonuses.csv',
+                   cache_dir=os.path.join('cache', 'stat_distribution'), output_file='set_build_distributions.csv', processes=None,
+                   store_dir=None):
+    """
+    Runs analyze_set_builds for every monster in player_dir and writes one table of all
+    monsters' set builds and roll distributions to output_file (skipped when None).
+    base_stats_by_monster maps each CSV's name (without .csv) to the monster's base stats,
+    monsters without base stats are skipped. set_bonuses.csv is loaded once.
+    With store_dir the builds come from that player_store instead of player_dir's CSVs,
+    read in one pass and without the builds older than the date filter's cutoff.
+
+    Results are cached per monster in cache_dir. A CSV whose mtime and size haven't changed
+    isn't read at all, otherwise its sha256 decides whether it really changed, so only new and
+    changed files are analyzed, on a pool of processes (os.cpu_count() by default).
+    Returns the consolidated DataFrame.
+    """
+    set_bonus_data = load_set_bonuses(set_bonus_file)
+    os.makedirs(cache_dir, exist_ok=True)
+    index_path = os.path.join(cache_dir, 'index.json')
+    index = {}
+    if os.path.exists(index_path):
+        with open(index_path) as f:
+            index = json.load(f)
+
+    sources = player_store.partition_signatures(store_dir) if store_dir else player_data_files(player_dir)
+    cached, stale = [], []
+    for monster, source in sources.items():
+        if monster not in base_stats_by_monster:
+            print(f"No base stats for {monster}, skipping")
+            continue
+        entry = index.get(monster, {})
+        if store_dir:
+            # the signature names the monster's parts, which are never rewritten
+            csv_hash = source
+            index[monster] = {'sha256': csv_hash, 'key': entry.get('key')}
+        else:
+            stat = os.stat(source)
+            if entry.get('mtime') == stat.st_mtime_ns and entry.get('size') == stat.st_size:
+                csv_hash = entry['sha256']
+            else:
+                csv_hash = export_cache.file_hash(source)
+            index[monster] = {'mtime': stat.st_mtime_ns, 'size': stat.st_size, 'sha256': csv_hash, 'key': entry.get('key')}
+        key = distribution_cache_key(csv_hash, base_stats_by_monster[monster], set_bonus_data)
+        if entry.get('key') == key and os.path.isdir(os.path.join(cache_dir, monster)):
+            cached.append(monster)
+        else:
+            stale.append((monster, source, base_stats_by_monster[monster], set_bonus_data, key))
+
+    if store_dir and stale:
+        # one read of every stale monster's recent builds, split into one frame per monster
+        builds = player_store.read_player_data(store_dir, monsters=[task[0] for task in stale], start=date_cutoff(), categorical=False)
+        by_monster = {monster: group.drop(columns='Monster').reset_index(drop=True)
+                      for monster, group in builds.groupby('Monster', observed=True)}
+        stale = [(monster, by_monster.get(monster, pd.DataFrame()), *rest) for monster, _, *rest in stale]
+
+    results = {monster: export_cache.load_frame(os.path.join(cache_dir, monster), mmap=False) for monster in cached}
+    tasks = [task[:4] for task in stale]
+    processes = min(processes or os.cpu_count(), max(len(tasks), 1))
+    if processes == 1:
+        analyzed = [analyze_player_file(task) for task in tasks]
+    else:
+        with multiprocessing.Pool(processes) as pool:
+            analyzed = pool.map(analyze_player_file, tasks)
+    for (monster, _, _, _, key), (_, set_builds_df) in zip(stale, analyzed):
+        monster_dir = os.path.join(cache_dir, monster)
+        if os.path.isdir(monster_dir):
+            shutil.rmtree(monster_dir)
+        export_cache.save_frame(set_builds_df, monster_dir)
+        index[monster]['key'] = key
+        results[monster] = set_builds_df
+    with open(index_path, 'w') as f:
+        json.dump(index, f)
+    print(f"{len(stale)} monsters analyzed, {len(cached)} loaded from the cache")
+
+    frames = [results[monster] for monster in sorted(results)]
+    roster_df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=['Monster', 'Set_Build', 'Build Count', 'Score'] + stat_names)
+    if output_file:
+        roster_df.to_csv(output_file, index=False)
+    return roster_df
+
 # %% --- Main Execution ---
 
 # Monster base stats (Adriana)
@@ -1,78 +1,177 @@
 # %%
+import numpy as np
+import pandas as pd
 import requests
-import os
 import json
-import time
-from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlencode, urlsplit, urlunsplit
 
-import http_utils
-from http_utils import get_legacy_session, header
+from http_utils import shared_session, cached_get
 
-def get_all_monsters():
+def get_monsters_page(session, url):
+    """
+    Returns the decoded JSON of one page of the monsters list, or an error message.
+    """
+    try:
+        response = cached_get(session, url)
+        if response.status_code == 200:
+            return response.json()
+        else:
+            return {"error": f"Unexpected error: {response.status_code}"}
+    except requests.exceptions.RequestException as e:
+        return {"error": f"Request failed: {e}"}
+
+def page_urls(first_page):
+    """
+    Returns the URLs of pages 2 to the last, built from the first page's count, page size and next link.
+    """
+    if not first_page['next'] or not first_page['results']:
+        return []
+    n_pages = -(-first_page['count'] // len(first_page['results']))
+    next_url = urlsplit(first_page['next'])
+    query = parse_qs(next_url.query)
+    urls = []
+    for page in range(2, n_pages + 1):
+        query['page'] = [str(page)]
+        urls.append(urlunsplit(next_url._replace(query=urlencode(query, doseq=True))))
+    return urls
+
+def get_all_monsters(base_url="https://swarfarm.com/api/v2/monsters/", workers=8):
     """
     Fetches the list of all monsters from the SWARFARM API.
-    First checks for a local copy saved as 'monsters_data.json' and returns it if it is not older than 1 month.
-    Otherwise, the data is fetched from the API and saved locally.
+    The first page's count gives every page's URL, so the rest are fetched at once by up to
+    workers threads on the shared session and put back in page order.
+    Pages go through the http_utils cache as they arrive, so for a month (http_utils.cache_ttls) they are
+    loaded from disk, after that only pages the API reports as changed are downloaded again.
     
     :return: List of dictionaries containing monster data or an error message.
     """
-    file_name = 'monsters_data.json'
-    one_month = timedelta(days=30)
-
-    if os.path.exists(file_name):
-        file_mod_time = datetime.fromtimestamp(os.path.getmtime(file_name))
-        if datetime.now() - file_mod_time < one_month:
-            try:
-                with open(file_name, 'r') as f:
-                    print("Loading monsters data from local file.")
-                    return json.load(f)
-            except Exception as e:
-                print("Error loading local copy, fetching new data:", e)
-    
-    base_url = "https://swarfarm.com/api/v2/monsters/"
+    session = shared_session(pool_maxsize=workers)
+    first_page = get_monsters_page(session, base_url)
+    if "error" in first_page:
+        return first_page
+
+    with ThreadPoolExecutor(workers) as pool:
+        pages = [first_page] + list(pool.map(lambda url: get_monsters_page(session, url), page_urls(first_page)))
     monsters = []
-    next_url = base_url
+    for page in pages:
+        if "error" in page:
+            return page
+        monsters.extend(page['results'])
 
+    # monsters added while fetching push the list past the pages computed from count
+    next_url = pages[-1]['next']
     while next_url:
-        try:
-            response = get_legacy_session().get(next_url, headers=header)
-            if response.status_code == 200:
-                data = response.json()
-                monsters.extend(data['results'])
-                next_url = data['next']
-            else:
-                return {"error": f"Unexpected error: {response.status_code}"}
-        except requests.exceptions.RequestException as e:
-            return {"error": f"Request failed: {e}"}
-    
-    try:
-        with open(file_name, 'w') as f:
-            json.dump(monsters, f)
-    except Exception as e:
-        print("Error saving data locally:", e)
-    
+        page = get_monsters_page(session, next_url)
+        if "error" in page:
+            return page
+        monsters.extend(page['results'])
+        next_url = page['next']
     return monsters
 
 def get_monster_stats(name):
-    global all_monsters
-    if 'all_monsters' not in globals():
-        print('Getting all monster data')
-        all_monsters = get_all_monsters()
-    monster_data = find_monster_by_name(all_monsters, name)
+    monster_data = get_catalog().find(name)
     if not monster_data:
         return {"error": f"Monster named '{name}' not found."}
-    monster_data_dict = {
-        'HP': monster_data['base_hp'],
-        'ATK': monster_data['base_attack'],
-        'DEF': monster_data['base_defense'],
-        'SPD': monster_data['speed'],
-        'CR': monster_data['crit_rate'],
-        'CD': monster_data['crit_damage'],
-        'RES': monster_data['resistance'],
-        'ACC': monster_data['accuracy']
-    }
+    return monster_base_stats(monster_data)
+
+# SWARFARM fields of the base stats, keyed like stat_distribution's base_stats
+base_stat_fields = {
+    'HP': 'base_hp',
+    'ATK': 'base_attack',
+    'DEF': 'base_defense',
+    'SPD': 'speed',
+    'CR': 'crit_rate',
+    'CD': 'crit_damage',
+    'RES': 'resistance',
+    'ACC': 'accuracy'
+}
+
+def monster_base_stats(monster_data):
+    """
+    Returns the base stats of a monster from the SWARFARM API keyed like stat_distribution's base_stats.
+    """
+    monster_data_dict = {stat: monster_data[field] for stat, field in base_stat_fields.items()}
     return monster_data_dict
 
+class MonsterCatalog:
+    """
+    The SWARFARM monster list with dict indexes on lowercase name, SWARFARM id, com2us_id and
+    (element, family_id), so lookups don't scan the list. Base stats are one float array with a row
+    per monster and a column per base_stat_fields entry (NaN where SWARFARM has none).
+    """
+    def __init__(self, monsters):
+        self.monsters = list(monsters)
+        self.by_name, self.by_id, self.by_com2us_id, self.by_family = {}, {}, {}, {}
+        for i, monster in enumerate(self.monsters):
+            # the first monster with a name wins, like find_monster_by_name
+            self.by_name.setdefault(monster['name'].lower(), i)
+            self.by_id[monster.get('id')] = i
+            self.by_com2us_id[monster.get('com2us_id')] = i
+            self.by_family.setdefault((str(monster.get('element')).lower(), monster.get('family_id')), []).append(i)
+        self.stat_names = list(base_stat_fields)
+        self.base_stats = np.array([[np.nan if monster.get(field) is None else monster[field] for field in base_stat_fields.values()]
+                                    for monster in self.monsters], dtype=float).reshape(len(self.monsters), len(base_stat_fields))
+        self.com2us_names = pd.Series({monster.get('com2us_id'): monster['name'].lower() for monster in self.monsters}, dtype=object)
+
+    def __len__(self):
+        return len(self.monsters)
+
+    def find(self, name):
+        i = self.by_name.get(name.lower())
+        return None if i is None else self.monsters[i]
+
+    def get(self, monster_id):
+        i = self.by_id.get(monster_id)
+        return None if i is None else self.monsters[i]
+
+    def get_com2us(self, com2us_id):
+        i = self.by_com2us_id.get(com2us_id)
+        return None if i is None else self.monsters[i]
+
+    def family(self, element, family_id):
+        return [self.monsters[i] for i in self.by_family.get((element.lower(), family_id), [])]
+
+    def names_for_com2us_ids(self, com2us_ids):
+        """
+        Maps a Series of com2us ids (unit_master_id in the export) to lowercase names, NaN where unknown.
+        """
+        return com2us_ids.map(self.com2us_names)
+
+    def base_stat_array(self, names):
+        """
+        Returns the base stats of names as a (len(names), 8) float array, NaN rows for unknown names.
+        """
+        rows = np.array([self.by_name.get(name.lower(), -1) for name in names], dtype=int)
+        stats = np.full((len(rows), len(self.stat_names)), np.nan)
+        stats[rows >= 0] = self.base_stats[rows[rows >= 0]]
+        return stats
+
+    def base_stats_of(self, name):
+        """
+        Returns monster_base_stats of name, or None if it isn't in the catalog.
+        """
+        monster_data = self.find(name)
+        return None if monster_data is None else monster_base_stats(monster_data)
+
+monster_catalog = None
+
+def get_catalog(refresh=False):
+    """
+    Returns the MonsterCatalog of get_all_monsters(), built on first use and kept for the session.
+    refresh=True fetches the list again.
+    """
+    global monster_catalog
+    if monster_catalog is None or refresh:
+        print('Getting all monster data')
+        all_monsters = get_all_monsters()
+        if isinstance(all_monsters, dict):
+            # not kept, so the next call tries again
+            print(all_monsters['error'])
+            return MonsterCatalog([])
+        monster_catalog = MonsterCatalog(all_monsters)
+    return monster_catalog
+
 def find_monster_by_name(monsters, name):
     """
     Searches for a monster by name in the list of monsters.
@@ -97,7 +196,7 @@ def get_monster_data(monster_id):
     url = f"{base_url}{monster_id}/"
     
     try:
-        response = get_legacy_session().get(url, headers=header)
+        response = cached_get(shared_session(), url)
         if response.status_code == 200:
             return response.json()
         elif response.status_code == 404: